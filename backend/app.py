@@ -1,6 +1,12 @@
-from flask import Flask, jsonify, send_from_directory
+from flask import Flask, Response, jsonify, request
+import json
 import os
-from .rfid_reader import RFIDReader # Assuming rfid_reader.py is in the same directory
+from .reader_service import ReaderService # Assuming reader_service.py is in the same directory
+from .rfid_reader import RFIDReader
+from .fake_serial import serial_factory_from_env
+from .reader_service import metrics # The same registry the reader modules record into
+from .static_assets import StaticAssetServer
+from .stage_manifest import build_stage_manifest, preload_link_header
 from .epc_mappings import get_name_for_epc # Assuming epc_mappings.py is in the same directory
 
 # Определяем путь к каталогу frontend относительно текущего файла (app.py)
@@ -8,24 +14,33 @@ from .epc_mappings import get_name_for_epc # Assuming epc_mappings.py is in the
 # поэтому нам нужно подняться на один уровень из backend/ и затем войти в frontend/
 FRONTEND_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'frontend')
 
-app = Flask(__name__, static_folder=FRONTEND_FOLDER) # <-- 修改这里，但主要通过路由提供
+app = Flask(__name__, static_folder=None) # 静态文件由 asset_server 通过下面的路由提供
+asset_server = StaticAssetServer(FRONTEND_FOLDER)
 
-# Initialize RFIDReader once if you want to keep the connection open (advanced)
-# For simplicity, we'll create it per request for now.
-# rfid_scanner = RFIDReader() 
-# rfid_scanner.connect() # You'd need to handle connect/disconnect carefully
+# One reader for the whole process. It keeps the serial port open and runs a single
+# inventory that all concurrent /api/scan_tag requests share; recent reads are cached.
+# RFID_REPLAY=<capture file> serves scans from a recorded session (see fake_serial.py).
+SCAN_TIMEOUT_SECONDS = 10
+reader_service = ReaderService(RFIDReader(serial_factory=serial_factory_from_env()))
 
 @app.route('/api/scan_tag', methods=['GET'])
 def scan_tag_api():
-    reader = None
+    # Optional query parameters:
+    #   timeout  - seconds to wait for a read (default 10)
+    #   fresh_ms - answer from the cache if the tag was seen this recently
+    #   epc / item - only accept a specific EPC or item name
     try:
-        reader = RFIDReader() # Create an instance for each scan
-        # Note: connect() and disconnect() are called within scan_single_tag()
-        scan_result = reader.scan_single_tag()
+        scan_result = reader_service.scan(
+            timeout=request.args.get('timeout', SCAN_TIMEOUT_SECONDS, type=float),
+            freshness_ms=request.args.get('fresh_ms', None, type=int),
+            epc=request.args.get('epc'),
+            item_name=request.args.get('item')
+        )
 
         response_data = {
             'status': scan_result.get('status'),
-            'message': scan_result.get('message', '') # Include message for errors or no_tag
+            'message': scan_result.get('message', ''), # Include message for errors or no_tag
+            'cached': scan_result.get('cached', False)
         }
 
         if scan_result.get('status') == 'success':
@@ -50,21 +65,96 @@ def scan_tag_api():
         print(f"Error in scan_tag_api: {str(e)}")
         return jsonify({'status': 'error', 'message': f'An internal server error occurred: {str(e)}'}), 500
     finally:
-        # Ensure the reader is disconnected if it was connected outside scan_single_tag
-        # However, our current RFIDReader.scan_single_tag handles its own connect/disconnect.
+        # The shared reader stays connected between requests; nothing to clean up here.
         pass
 
+def _sse_event(seq, event):
+    # One SSE message per reader event, encoded once and shared by every follower
+    if event["event"] == "tag":
+        tag = event["tag"]
+        human_name = get_name_for_epc(tag.epc)
+        data = dict(tag.to_dict(), item_name=human_name if human_name else 'Unknown Item')
+        name = 'tag'
+    else:
+        data = {'status': 'error', 'message': event['message']}
+        name = 'reader_error' # 'error' is reserved by EventSource for connection errors
+    return f"id: {seq}\nevent: {name}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/api/scan_feed', methods=['GET'])
+def scan_feed_api():
+    # Server-Sent Events: every read as a 'tag' event (same fields as /api/scan_tag),
+    # reader failures as 'reader_error'. Each event has an id; a reconnecting EventSource
+    # sends it back as Last-Event-ID and receives exactly the events it missed (the last
+    # ReaderService.FEED_SIZE are kept). ?last_event_id=N does the same for the first
+    # connection (0 = everything still kept). A 'gap' event reports events that were lost.
+    # Optional filters: epc, item.
+    last_seq = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_seq = int(last_seq) if last_seq else None
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Last-Event-ID must be an integer'}), 400
+    wanted_epc = (request.args.get('epc') or '').upper() or None
+    wanted_item = request.args.get('item')
+
+    def matches(event):
+        if event["event"] != "tag":
+            return True # Reader errors concern every follower
+        if wanted_epc and event["tag"].epc_hex != wanted_epc:
+            return False
+        return not wanted_item or get_name_for_epc(event["tag"].epc) == wanted_item
+
+    def stream():
+        yield "retry: 2000\n\n"
+        for item in reader_service.feed(last_seq, encode=_sse_event):
+            if item is None:
+                yield ": keepalive\n\n" # Keeps proxies from closing an idle stream
+                continue
+            seq, event, message = item
+            if seq is None:
+                yield f"event: gap\ndata: {json.dumps({'missed': event['missed']})}\n\n"
+            elif matches(event):
+                yield message
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 # --- 新增前端路由 ---
 @app.route('/')
 def serve_index():
     # Отправляем index.html из каталога FRONTEND_FOLDER
-    return send_from_directory(FRONTEND_FOLDER, 'index.html')
+    return asset_server.send('index.html')
+
+@app.route('/asset-manifest.json')
+def asset_manifest():
+    # Карта: путь файла -> URL с хешем содержимого (Cache-Control: immutable)
+    return jsonify(asset_server.manifest())
+
+@app.route('/api/preload_manifest')
+def preload_manifest():
+    # ?stage=<currentStage>: медиа этого этапа и следующих, плюс заголовок Link: rel=preload
+    stage = request.args.get('stage')
+    if stage is not None and not stage.strip():
+        return jsonify({'error': 'stage must not be empty'}), 400
+    manifest = build_stage_manifest(asset_server, stage)
+    if manifest is None:
+        return jsonify({'error': f'Unknown stage: {stage}'}), 404
+    response = jsonify(manifest)
+    if stage:
+        link_header = preload_link_header(manifest)
+        if link_header:
+            response.headers['Link'] = link_header
+    return response
+
+@app.route('/metrics')
+def metrics_route():
+    # Метрики в текстовом формате Prometheus
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
 
 @app.route('/<path:filename>')
 def serve_static(filename):
     # Отправляем любой запрошенный файл из FRONTEND_FOLDER
-    # Это будет обрабатывать style.css, js/esp32.js и т.д.
-    return send_from_directory(FRONTEND_FOLDER, filename)
+    # Это будет обрабатывать style.css, js/esp32.js и т.д. (ETag, Range, gzip/brotli)
+    return asset_server.send(filename)
 # --- 结束新增前端路由 ---
 
 if __name__ == '__main__':
@@ -0,0 +1,317 @@
+# benchmark.py
+# Reproducible benchmarks for the scan pipeline and the server endpoints, driven by a
+# simulated reader (fake_serial.ReplaySerial), so they run on any machine.
+#
+#   python benchmark.py                          # run everything, print JSON
+#   python benchmark.py --only parser --output results.json
+#   python benchmark.py --compare baseline.json  # exit code 1 on a regression
+#
+# Benchmarks:
+#   parser      - FrameDecoder.feed() and RFIDReader._parse_response_data() throughput (frames/s)
+#   scan        - latency from a tag's first frame reaching the port to the Socket.IO batch
+#                 carrying its tag_arrived, through the reader engine, the presence
+#                 tracker and the event bus
+#   fanout      - cost of publishing events through the event bus vs. number of connected
+#                 clients (a quarter of them subscribed), batched EVENTS_PER_TICK at a time
+#   status      - /get_scan_status and /mark_tag_completed throughput and latency under
+#                 concurrent HTTP clients (real sockets, threaded server)
+import argparse
+import contextlib
+import http.client
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from event_bus import BATCH_EVENT, decode_batch
+from fake_serial import ReplaySerial, synthetic_records
+from rfid_frames import FrameDecoder, build_tag_notification
+from rfid_reader import RFIDReader
+
+# Metrics where bigger is better; every other numeric metric is treated as a cost.
+THROUGHPUT_METRICS = ("frames_per_second", "requests_per_second", "emits_per_second")
+DEFAULT_TOLERANCE = 0.25 # Relative change beyond which --compare reports a regression
+
+
+def _epc(index):
+    return bytes.fromhex("E200%020X" % index)
+
+
+def _percentiles(samples_seconds):
+    values = np.asarray(samples_seconds) * 1000.0
+    return {
+        "count": int(len(values)),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p90_ms": float(np.percentile(values, 90)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "max_ms": float(values.max()),
+    }
+
+
+# --- parser ---
+def bench_parser(frame_count=50000, chunk_sizes=(1, 64, 4096)):
+    frames = [build_tag_notification(_epc(index % 64)) for index in range(frame_count)]
+    stream = b"".join(frames)
+    results = {}
+
+    for chunk_size in chunk_sizes:
+        decoder = FrameDecoder()
+        chunks = [stream[pos:pos + chunk_size] for pos in range(0, len(stream), chunk_size)]
+        if chunk_size == 1:
+            chunks = chunks[:len(frames[0]) * 5000] # Byte-at-a-time is slow; a smaller sample is enough
+        decoded = 0
+        started = time.perf_counter()
+        for chunk in chunks:
+            decoded += len(decoder.feed(chunk))
+        elapsed = time.perf_counter() - started
+        results[f"decoder_chunk_{chunk_size}"] = {"frames": decoded, "frames_per_second": decoded / elapsed}
+
+    reader = RFIDReader(port="benchmark")
+    started = time.perf_counter()
+    for frame in frames:
+        reader._parse_response_data(frame)
+    elapsed = time.perf_counter() - started
+    results["parse_response_data"] = {"frames": len(frames), "frames_per_second": len(frames) / elapsed}
+    return results
+
+
+# --- scan ---
+class _TimedReplaySerial(ReplaySerial):
+    """Remembers when each EPC's first frame was handed to the reader."""
+    delivered = {}
+
+    def _deliver(self, chunk):
+        self.delivered.setdefault(chunk[8:20], time.perf_counter())
+        return super()._deliver(chunk)
+
+
+def bench_scan(tag_count=200, interval=0.02, read_gap=0.005):
+    import main_server
+    from event_log import EventLog
+
+    # Each tag is read twice, read_gap apart (PresenceTracker needs two reads to report
+    # an arrival); tags arrive `interval` apart.
+    records = []
+    for index in range(tag_count):
+        frame = build_tag_notification(_epc(index))
+        records.extend(synthetic_records([frame, frame], read_gap))
+        records[-2].timestamp_ns += int(index * interval * 1e9)
+        records[-1].timestamp_ns += int(index * interval * 1e9)
+
+    _TimedReplaySerial.delivered = {}
+    latencies = []
+    done = threading.Event()
+    original_emit = main_server.socketio.emit
+
+    def timed_emit(event_name, payload=None, *args, **kwargs):
+        if event_name == BATCH_EVENT:
+            for name, event in decode_batch(payload):
+                if name != 'tag_arrived':
+                    continue
+                first_frame = _TimedReplaySerial.delivered.get(bytes.fromhex(event['epc']))
+                if first_frame is not None:
+                    latencies.append(time.perf_counter() - first_frame)
+            if len(latencies) >= tag_count:
+                done.set()
+        return original_emit(event_name, payload, *args, **kwargs)
+
+    reader = next(iter(main_server.reader_manager.readers.values()))
+    original_factory = reader.serial_factory
+    reader.serial_factory = _TimedReplaySerial.factory(records=records, speed=1.0)
+    main_server.socketio.emit = timed_emit
+    main_server.event_bus._emit = timed_emit
+    original_log, log_dir = main_server.event_log, tempfile.TemporaryDirectory()
+    main_server.event_log = EventLog(log_dir.name) # Replayed reads stay out of the real event log
+    main_server.ensure_background_tasks()
+    main_server.presence_tracker.reset()
+    try:
+        main_server.reader_manager.start(main_server.handle_reader_event)
+        done.wait(tag_count * interval + 5)
+    finally:
+        main_server.reader_manager.stop()
+        time.sleep(0.2)
+        main_server.socketio.emit = original_emit
+        main_server.event_bus._emit = original_emit
+        reader.serial_factory = original_factory
+        main_server.event_log.close()
+        main_server.event_log = original_log
+        log_dir.cleanup()
+    result = _percentiles(latencies) if latencies else {"count": 0}
+    result["tags"] = tag_count
+    return {"tag_arrived_latency": result}
+
+
+# --- fanout ---
+EVENTS_PER_TICK = 10
+
+
+def bench_fanout(client_counts=(1, 10, 50, 100), emits=200):
+    import main_server
+
+    results = {}
+    payload = {"epc": "E2000000000000000000000001", "pc": "3000", "rssi": 200.0, "reads": 2, "first_seen": 0.0,
+               "last_seen": 0.0, "reader_id": "main", "status": "success", "name": "cup"}
+    for count in client_counts:
+        clients = [main_server.socketio.test_client(main_server.app) for _ in range(count)]
+        subscribed = clients[:max(1, count // 4)]
+        for client in subscribed:
+            client.emit('subscribe', {'topics': ['presence']})
+        for client in clients:
+            client.get_received()
+        started = time.perf_counter()
+        for index in range(emits):
+            main_server.event_bus.publish('tag_arrived', payload, main_server.event_topics('tag_arrived', payload))
+            if index % EVENTS_PER_TICK == EVENTS_PER_TICK - 1:
+                main_server.event_bus.flush()
+        main_server.event_bus.flush()
+        elapsed = time.perf_counter() - started
+        received = sum(len(client.get_received()) for client in clients)
+        for client in clients:
+            client.disconnect()
+        results[f"clients_{count}"] = {
+            "clients": count,
+            "subscribed": len(subscribed),
+            "emits_per_second": emits / elapsed,
+            "ms_per_emit": elapsed / emits * 1000.0,
+            "us_per_client": elapsed / emits / count * 1e6,
+            "delivered": received,
+        }
+    return results
+
+
+# --- status ---
+def bench_status(client_count=8, requests_per_client=300):
+    from werkzeug.serving import make_server
+    import main_server
+    from scan_status_store import ScanStatusStore
+    from event_log import EventLog
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # Never touch the real progress file or event log
+        original_store, original_log = main_server.scan_status_store, main_server.event_log
+        main_server.scan_status_store = ScanStatusStore(os.path.join(tmp_dir, "status.json"),
+                                                        main_server.TARGET_TAGS_FOR_COMPLETION.values())
+        main_server.event_log = EventLog(os.path.join(tmp_dir, "event_log"))
+        server = make_server("127.0.0.1", 0, main_server.app, threaded=True)
+        server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+        server_thread.start()
+        try:
+            results = {}
+            tag_names = list(main_server.TARGET_TAGS_FOR_COMPLETION)
+            for name, method, make_body in (
+                ("get_scan_status", "GET", None),
+                ("mark_tag_completed", "POST",
+                 lambda client, index: {"tag_name": tag_names[index % len(tag_names)], "session_id": f"bench-{client}-{index // 4}"}),
+            ):
+                path = "/" + name
+                latencies = [[] for _ in range(client_count)]
+
+                def run_client(client):
+                    connection = http.client.HTTPConnection("127.0.0.1", server.server_port)
+                    for index in range(requests_per_client):
+                        body, headers = None, {"X-Session-Id": f"bench-{client}"}
+                        if make_body is not None:
+                            body = json.dumps(make_body(client, index))
+                            headers["Content-Type"] = "application/json"
+                        started = time.perf_counter()
+                        connection.request(method, path, body=body, headers=headers)
+                        connection.getresponse().read()
+                        latencies[client].append(time.perf_counter() - started)
+                    connection.close()
+
+                threads = [threading.Thread(target=run_client, args=(client,)) for client in range(client_count)]
+                started = time.perf_counter()
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                elapsed = time.perf_counter() - started
+                total = client_count * requests_per_client
+                results[name] = dict(_percentiles([value for values in latencies for value in values]),
+                                     clients=client_count, requests_per_second=total / elapsed)
+            return results
+        finally:
+            server.shutdown()
+            main_server.scan_status_store.flush()
+            main_server.event_log.close()
+            main_server.scan_status_store, main_server.event_log = original_store, original_log
+
+
+BENCHMARKS = {
+    "parser": bench_parser,
+    "scan": bench_scan,
+    "fanout": bench_fanout,
+    "status": bench_status,
+}
+
+
+def run(names):
+    results = {}
+    for name in names:
+        print(f"Running {name} benchmark...", file=sys.stderr)
+        with contextlib.redirect_stdout(sys.stderr): # The servers log to stdout; keep it for the JSON
+            results[name] = BENCHMARKS[name]()
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": np.__version__,
+        },
+        "results": results,
+    }
+
+
+def compare(current, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Lists metrics that got worse by more than `tolerance` (relative) against a baseline.
+    Returns:
+        list: Human-readable regression descriptions (empty if none).
+    """
+    regressions = []
+    for bench_name, cases in current["results"].items():
+        for case_name, metrics in cases.items():
+            base_metrics = baseline.get("results", {}).get(bench_name, {}).get(case_name, {})
+            for metric, value in metrics.items():
+                base_value = base_metrics.get(metric)
+                if not isinstance(value, float) or not isinstance(base_value, (int, float)) or not base_value:
+                    continue
+                change = (value - base_value) / base_value
+                worse = -change if metric in THROUGHPUT_METRICS else change
+                if worse > tolerance:
+                    regressions.append(f"{bench_name}.{case_name}.{metric}: {base_value:.4g} -> {value:.4g} ({change:+.0%})")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks for the RFID scan pipeline and server endpoints.")
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), help="benchmarks to run (default: all)")
+    parser.add_argument("--output", help="write the JSON results to this file instead of stdout")
+    parser.add_argument("--compare", help="baseline JSON results; exit with code 1 if a metric regressed")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help=f"relative change counted as a regression (default {DEFAULT_TOLERANCE})")
+    args = parser.parse_args(argv)
+
+    results = run(args.only or list(BENCHMARKS))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,228 @@
+# capture_log.py
+# Append-only binary capture of reader and glove traffic, for replaying field sessions.
+#
+# File layout (all little-endian, everything 8-byte aligned so a reader can mmap the
+# file and walk it with struct.unpack_from, without parsing or copying):
+#
+#   File header (16 bytes): magic b'RFIDCAP\0' | version (u16) | header size (u16) | reserved (u32)
+#   Record header (16 bytes): timestamp_ns (u64, time.monotonic_ns()) | kind (u8) | flags (u8)
+#                             | channel (u16) | payload length (u32)
+#   Payload, zero-padded to a multiple of 8 bytes
+#
+# Records are only ever appended. A record cut short by a crash is ignored when reading.
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+import numpy as np
+
+import serial
+
+MAGIC = b'RFIDCAP\x00'
+VERSION = 1
+FILE_HEADER = struct.Struct('<8sHHI')
+RECORD_HEADER = struct.Struct('<QBBHI')
+ALIGNMENT = 8
+
+# Record kinds
+KIND_SERIAL_RX = 1 # Bytes received from the reader
+KIND_SERIAL_TX = 2 # Bytes sent to the reader
+KIND_IMU = 3 # Glove samples, packed like imu_stream's binary format (float32 x 6 per sample)
+KIND_DISCONNECT = 4 # The serial port failed; payload is the error message
+KIND_MARKER = 5 # Free-form UTF-8 note (session start, operator comment, ...)
+
+KIND_NAMES = {
+    KIND_SERIAL_RX: "serial_rx",
+    KIND_SERIAL_TX: "serial_tx",
+    KIND_IMU: "imu",
+    KIND_DISCONNECT: "disconnect",
+    KIND_MARKER: "marker",
+}
+
+
+def _padding(length):
+    return -length % ALIGNMENT
+
+
+class CaptureRecord:
+    __slots__ = ("timestamp_ns", "kind", "channel", "payload")
+
+    def __init__(self, timestamp_ns, kind, channel, payload):
+        self.timestamp_ns = timestamp_ns
+        self.kind = kind
+        self.channel = channel
+        self.payload = payload # bytes
+
+    def imu_samples(self):
+        """The (N, 6) float array of a KIND_IMU record."""
+        return np.frombuffer(self.payload, dtype='<f4').astype(np.float64).reshape(-1, 6)
+
+    def __repr__(self):
+        return f"CaptureRecord({KIND_NAMES.get(self.kind, self.kind)}, t={self.timestamp_ns}, {len(self.payload)} bytes)"
+
+
+class CaptureWriter:
+    """Appends records to a capture file. Thread-safe; every record is flushed as it is written."""
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if os.path.exists(file_path) and os.path.getsize(file_path):
+            # Drop a record a crash cut short, so new records start at a record boundary
+            valid_length = CaptureReader(file_path).valid_length()
+            if valid_length != os.path.getsize(file_path):
+                os.truncate(file_path, valid_length)
+        self._file = open(file_path, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(FILE_HEADER.pack(MAGIC, VERSION, FILE_HEADER.size, 0))
+        self.marker(f"capture opened {time.strftime('%Y-%m-%dT%H:%M:%S')}")
+
+    def record(self, kind, payload, channel=0, timestamp_ns=None):
+        if timestamp_ns is None:
+            timestamp_ns = time.monotonic_ns()
+        payload = bytes(payload)
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(RECORD_HEADER.pack(timestamp_ns, kind, 0, channel, len(payload)))
+            self._file.write(payload + b'\x00' * _padding(len(payload)))
+            self._file.flush()
+
+    def serial_rx(self, data, channel=0):
+        self.record(KIND_SERIAL_RX, data, channel)
+
+    def serial_tx(self, data, channel=0):
+        self.record(KIND_SERIAL_TX, data, channel)
+
+    def imu(self, samples, channel=0):
+        self.record(KIND_IMU, np.asarray(samples, dtype='<f4').tobytes(), channel)
+
+    def disconnect(self, message, channel=0):
+        self.record(KIND_DISCONNECT, str(message).encode('utf-8'), channel)
+
+    def marker(self, text, channel=0):
+        self.record(KIND_MARKER, str(text).encode('utf-8'), channel)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class CaptureReader:
+    """Reads a capture file through mmap."""
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+
+    def records(self, kinds=None):
+        """
+        Yields every complete record in file order, optionally only the given kinds.
+        Raises:
+            ValueError: If the file is not a capture.
+        """
+        for record, _end in self._scan():
+            if kinds is None or record.kind in kinds:
+                yield record
+
+    def valid_length(self):
+        """Offset just past the last complete record."""
+        end = FILE_HEADER.size
+        for _record, end in self._scan():
+            pass
+        return end
+
+    def _scan(self):
+        with open(self.file_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < FILE_HEADER.size:
+                raise ValueError(f"'{self.file_path}' is too short to be a capture")
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                magic, version, header_size, _reserved = FILE_HEADER.unpack_from(view, 0)
+                if magic != MAGIC:
+                    raise ValueError(f"'{self.file_path}' is not a capture file")
+                if version != VERSION:
+                    raise ValueError(f"Unsupported capture version {version}")
+                offset = header_size
+                while offset + RECORD_HEADER.size <= size:
+                    timestamp_ns, kind, _flags, channel, length = RECORD_HEADER.unpack_from(view, offset)
+                    start = offset + RECORD_HEADER.size
+                    end = start + length + _padding(length)
+                    if end > size:
+                        break # Cut short by a crash
+                    yield CaptureRecord(timestamp_ns, kind, channel, view[start:start + length]), end
+                    offset = end
+
+    def summary(self):
+        """Record counts and payload bytes per kind, plus the captured time span in seconds."""
+        counts, sizes = {}, {}
+        first = last = None
+        for record in self.records():
+            name = KIND_NAMES.get(record.kind, str(record.kind))
+            counts[name] = counts.get(name, 0) + 1
+            sizes[name] = sizes.get(name, 0) + len(record.payload)
+            first = record.timestamp_ns if first is None else first
+            last = record.timestamp_ns
+        span = (last - first) / 1e9 if first is not None else 0.0
+        return {"records": counts, "payload_bytes": sizes, "seconds": span}
+
+
+class RecordingSerial:
+    """Wraps an open serial port and copies all its traffic into a capture."""
+
+    def __init__(self, serial_conn, writer, channel=0):
+        self._serial = serial_conn
+        self.writer = writer
+        self.channel = channel
+
+    @classmethod
+    def factory(cls, writer, channel=0, serial_factory=serial.Serial):
+        """A serial_factory for RFIDReader that records everything the real port sees."""
+        def open_port(port, baudrate, timeout=None):
+            return cls(serial_factory(port, baudrate, timeout=timeout), writer, channel)
+        return open_port
+
+    def read(self, size=1):
+        try:
+            data = self._serial.read(size)
+        except serial.SerialException as e:
+            self.writer.disconnect(e, self.channel)
+            raise
+        if data:
+            self.writer.serial_rx(data, self.channel)
+        return data
+
+    def write(self, data):
+        self.writer.serial_tx(data, self.channel)
+        try:
+            return self._serial.write(data)
+        except serial.SerialException as e:
+            self.writer.disconnect(e, self.channel)
+            raise
+
+    @property
+    def in_waiting(self):
+        return self._serial.in_waiting
+
+    def __getattr__(self, name):
+        # is_open, close(), fileno(), ... go straight to the real port
+        return getattr(self._serial, name)
+
+    def __setattr__(self, name, value):
+        if name in ('_serial', 'writer', 'channel'):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._serial, name, value) # e.g. timeout
+
+
+if __name__ == "__main__":
+    # python capture_log.py <capture file>: prints what a capture contains
+    if len(sys.argv) != 2:
+        print("Usage: python capture_log.py <capture file>")
+        sys.exit(1)
+    print(CaptureReader(sys.argv[1]).summary())
@@ -1,23 +1,157 @@
 # epc_mappings.py
+# Maps RFID EPCs to human-readable names, from the catalog in data/epc_catalog.json:
+#
+#   {
+#       "version": 1,
+#       "tags":     {"E280F3372000F0000FDAE3BA": "cup", ...},           # exact EPCs
+#       "prefixes": [{"prefix": "E280F33720", "name": "prop_batch_a"}],  # tag batches
+#       "masks":    [{"value": "E2800000", "mask": "FFF000FF", "name": "..."}]
+#   }
+#
+# Lookups take the raw EPC bytes straight from the frame, so no hex string is built per
+# read. Exact EPCs win over prefixes, longer prefixes over shorter ones, and masks (tried
+# in file order) come last. Prefixes with an odd number of hex digits become masks.
+#
+# The file is re-read when it changes on disk (checked at most every `check_interval`
+# seconds, during lookups), so props can be added while the server and readers keep running.
+import json
+import os
+import threading
+import time
 
-# This dictionary maps RFID EPC codes (hex strings) to human-readable names.
-EPC_TO_NAME_MAP = {
-    "E280F3372000F0000FDAE3BA": "cup",
-    "E280F3372000F0000FDAED20": "knife",
-    "E280F3372000F0000FDAF9A8": "phone",
-    "E280F3372000F0000FDAD0F6": "monitor",
-    # Add more mappings here as needed, for example:
-    # "ANOTHER_EPC_CODE_HERE": "book",
-    # "YET_ANOTHER_EPC": "keychain",
-}
-
-def get_name_for_epc(epc_hex):
+CATALOG_FILE_PATH = os.path.join(os.path.dirname(__file__), 'data', 'epc_catalog.json')
+
+
+class _CatalogIndex:
+    """One immutable snapshot of the catalog; swapped as a whole on reload."""
+    __slots__ = ("exact", "prefixes", "prefix_lengths", "masks", "cache", "counts")
+
+    MAX_CACHE = 4096 # Prefix/mask results remembered per EPC
+
+    def __init__(self, data):
+        self.exact = {bytes.fromhex(epc): name for epc, name in (data.get("tags") or {}).items()}
+        self.prefixes = {} # prefix length -> {prefix bytes: name}
+        self.masks = [] # (length, mask int, value int, name), in file order
+        for rule in data.get("prefixes") or []:
+            prefix = rule["prefix"]
+            if len(prefix) % 2:
+                # Half a byte: match the last nibble through a mask instead
+                length = (len(prefix) + 1) // 2
+                value = int(prefix + "0", 16)
+                mask = int("F" * len(prefix) + "0", 16)
+                self.masks.append((length, mask, value, rule["name"]))
+            else:
+                self.prefixes.setdefault(len(prefix) // 2, {})[bytes.fromhex(prefix)] = rule["name"]
+        for rule in data.get("masks") or []:
+            if len(rule["mask"]) != len(rule["value"]) or len(rule["mask"]) % 2:
+                raise ValueError(f"Mask rule {rule!r}: value and mask must be whole bytes of the same length")
+            mask = int(rule["mask"], 16)
+            self.masks.append((len(rule["mask"]) // 2, mask, int(rule["value"], 16) & mask, rule["name"]))
+        self.prefix_lengths = sorted(self.prefixes, reverse=True) # Longest match first
+        self.cache = {}
+        self.counts = {"tags": len(self.exact), "prefixes": sum(map(len, self.prefixes.values())), "masks": len(self.masks)}
+
+    def lookup(self, epc):
+        name = self.exact.get(epc)
+        if name is not None or not (self.prefix_lengths or self.masks):
+            return name
+        try:
+            return self.cache[epc]
+        except KeyError:
+            pass
+        for length in self.prefix_lengths:
+            name = self.prefixes[length].get(epc[:length])
+            if name is not None:
+                break
+        else:
+            for length, mask, value, rule_name in self.masks:
+                if len(epc) >= length and int.from_bytes(epc[:length], 'big') & mask == value:
+                    name = rule_name
+                    break
+        if len(self.cache) >= self.MAX_CACHE:
+            self.cache.clear()
+        self.cache[epc] = name
+        return name
+
+
+class EPCCatalog:
+    DEFAULT_CHECK_INTERVAL = 1.0 # Seconds between checks of the file's modification time
+
+    def __init__(self, file_path=CATALOG_FILE_PATH, check_interval=DEFAULT_CHECK_INTERVAL):
+        self.file_path = file_path
+        self.check_interval = check_interval
+        self._lock = threading.Lock() # Only one thread reloads at a time
+        self._index = _CatalogIndex({})
+        self._stat = None # (mtime_ns, size) of the loaded file
+        self._next_check = 0.0
+        self.loaded_at = None
+        self.reload()
+
+    def name_for(self, epc):
+        """Name for raw EPC bytes, or None if the catalog has no rule for it."""
+        if time.monotonic() >= self._next_check:
+            self._check_for_changes()
+        return self._index.lookup(bytes(epc))
+
+    def epcs_for(self, name):
+        """Raw EPCs the catalog maps to `name` exactly (prefix and mask rules can't be listed)."""
+        return [epc for epc, item in self._index.exact.items() if item == name]
+
+    def reload(self):
+        """
+        Re-reads the catalog file. A missing or broken file keeps the current catalog.
+        Returns:
+            bool: True if a new catalog was loaded.
+        """
+        with self._lock:
+            self._next_check = time.monotonic() + self.check_interval
+            try:
+                stat = os.stat(self.file_path)
+                with open(self.file_path, 'r', encoding='utf-8') as f:
+                    index = _CatalogIndex(json.load(f))
+            except FileNotFoundError:
+                print(f"EPC catalog '{self.file_path}' not found. Keeping {self._index.counts}.")
+                return False
+            except (ValueError, KeyError, TypeError) as e:
+                print(f"Error loading EPC catalog '{self.file_path}': {e}. Keeping the previous catalog.")
+                self._stat = (stat.st_mtime_ns, stat.st_size) # Don't retry until the file changes again
+                return False
+            reloaded = self.loaded_at is not None
+            self._index = index
+            self._stat = (stat.st_mtime_ns, stat.st_size)
+            self.loaded_at = time.time()
+            if reloaded:
+                print(f"EPC catalog reloaded: {index.counts}")
+            return True
+
+    def stats(self):
+        return dict(self._index.counts, file=self.file_path, loaded_at=self.loaded_at)
+
+    def _check_for_changes(self):
+        self._next_check = time.monotonic() + self.check_interval
+        try:
+            stat = os.stat(self.file_path)
+        except OSError:
+            return
+        if (stat.st_mtime_ns, stat.st_size) != self._stat:
+            self.reload()
+
+
+CATALOG = EPCCatalog()
+
+
+def get_name_for_epc(epc):
     """Looks up the human-readable name for a given EPC.
-    
+
     Args:
-        epc_hex (str): The EPC hex string.
-        
+        epc (bytes or str): The raw EPC bytes (preferred on hot paths) or its hex string.
+
     Returns:
         str: The human-readable name if found, otherwise None.
     """
-    return EPC_TO_NAME_MAP.get(epc_hex)
+    if isinstance(epc, str):
+        try:
+            epc = bytes.fromhex(epc)
+        except ValueError:
+            return None
+    return CATALOG.name_for(epc)
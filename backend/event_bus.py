@@ -0,0 +1,169 @@
+# event_bus.py
+# Batches reader events and delivers them only to Socket.IO clients subscribed to
+# one of their topics.
+#
+# Events are queued by publish() and sent every `tick` seconds as binary 'event_batch'
+# messages addressed to the rooms of their topics (a client in several of them still
+# gets each batch once). Events keep their publish order across batches: consecutive
+# events for the same rooms share a batch, and a change of rooms starts the next one,
+# so a client never sees a tag's rssi_changed before its tag_arrived. Within a tick,
+# repeated rssi_changed events for one tag collapse into the latest, and an arrival or
+# departure drops the tag's pending rssi_changed. Clients join topics with the
+# 'subscribe' socket event; rooms are named "topic:<topic>".
+#
+# Batch encoding (little-endian), decoded by frontend/js/eventBatch.js:
+#   header  B version, B reserved, H event count
+#   event   B kind (1 tag_arrived, 2 tag_left, 3 rssi_changed), B EPC length, EPC bytes,
+#           2s PC, f RSSI, I reads, d first_seen, d last_seen,
+#           B length + UTF-8 name, B length + UTF-8 reader id
+import struct
+import threading
+import time
+
+import metrics
+
+BATCH_EVENT = 'event_batch'
+VERSION = 1
+KINDS = {'tag_arrived': 1, 'tag_left': 2, 'rssi_changed': 3}
+EVENT_NAMES = {kind: name for name, kind in KINDS.items()}
+COALESCED_EVENTS = ('rssi_changed',) # Only the latest one per tag and tick is sent
+
+_HEADER = struct.Struct('<BBH')
+_FIELDS = struct.Struct('<2sfIdd')
+
+BATCHES_SENT = metrics.counter("event_bus_batches_total", "Binary event batches sent to Socket.IO rooms.")
+EVENTS_PUBLISHED = metrics.counter("event_bus_events_total", "Events published to the event bus.", ["event"])
+EVENTS_COALESCED = metrics.counter("event_bus_events_coalesced_total", "Events replaced by a newer one in the same tick.")
+BATCH_BYTES = metrics.counter("event_bus_batch_bytes_total", "Encoded size of the batches sent.")
+
+
+def room_for(topic):
+    return f"topic:{topic}"
+
+
+def _short_text(value):
+    data = str(value or '').encode('utf-8')[:255]
+    return bytes([len(data)]) + data
+
+
+def encode_event(event_name, payload):
+    epc = bytes.fromhex(payload['epc'])
+    return b''.join((
+        bytes([KINDS[event_name], len(epc)]), epc,
+        _FIELDS.pack(bytes.fromhex(payload.get('pc') or '0000'), payload['rssi'], payload['reads'],
+                     payload['first_seen'], payload['last_seen']),
+        _short_text(payload.get('name')),
+        _short_text(payload.get('reader_id')),
+    ))
+
+
+def encode_batch(encoded_events):
+    """One batch from events already encoded by encode_event()."""
+    return _HEADER.pack(VERSION, 0, len(encoded_events)) + b''.join(encoded_events)
+
+
+def decode_batch(data):
+    """
+    The events of one batch as (event name, payload) pairs; the inverse of encode_batch().
+    Raises:
+        ValueError: If the batch is truncated or has an unknown version.
+    """
+    try:
+        version, _, count = _HEADER.unpack_from(data, 0)
+        if version != VERSION:
+            raise ValueError(f"Unsupported event batch version {version}")
+        offset = _HEADER.size
+        events = []
+        for _ in range(count):
+            kind, epc_length = data[offset], data[offset + 1]
+            epc = bytes(data[offset + 2:offset + 2 + epc_length])
+            offset += 2 + epc_length
+            pc, rssi, reads, first_seen, last_seen = _FIELDS.unpack_from(data, offset)
+            offset += _FIELDS.size
+            texts = []
+            for _ in range(2):
+                length = data[offset]
+                texts.append(bytes(data[offset + 1:offset + 1 + length]).decode('utf-8'))
+                offset += 1 + length
+            if offset > len(data): # Slices past the end come back short instead of failing
+                raise ValueError(f"Malformed event batch: truncated at event {len(events) + 1} of {count}")
+            events.append((EVENT_NAMES[kind], {
+                'status': 'success', 'epc': epc.hex().upper(), 'pc': pc.hex().upper(), 'rssi': round(rssi, 1),
+                'reads': reads, 'first_seen': first_seen, 'last_seen': last_seen,
+                'name': texts[0], 'reader_id': texts[1] or None,
+            }))
+        return events
+    except (IndexError, KeyError, struct.error) as e:
+        raise ValueError(f"Malformed event batch: {e}") from e
+
+
+class EventBus:
+    """
+    Args:
+        emit: Called as emit(BATCH_EVENT, data, to=[room, ...]), e.g. socketio.emit.
+        sleep: Sleep function for run(), e.g. socketio.sleep.
+        tick (float): Seconds between batches.
+    """
+    DEFAULT_TICK = 0.03
+    MAX_BATCH_EVENTS = 1024 # Larger batches are split (the count field is 16 bits)
+
+    def __init__(self, emit, sleep=time.sleep, tick=DEFAULT_TICK):
+        self.tick = tick
+        self._emit = emit
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._pending = {} # sequence number -> (tuple of rooms, encoded event), in publish order
+        self._coalesced = {} # EPC -> {rooms: sequence number} of its pending rssi_changed events
+        self._sequence = 0
+
+    def publish(self, event_name, payload, topics):
+        """Queues an event for the clients subscribed to any of `topics`. Thread-safe."""
+        encoded = encode_event(event_name, payload)
+        rooms = tuple(room_for(topic) for topic in topics)
+        EVENTS_PUBLISHED.labels(event_name).inc()
+        with self._lock:
+            self._sequence += 1
+            if event_name in COALESCED_EVENTS:
+                pending = self._coalesced.setdefault(payload['epc'], {})
+                replaced = pending.pop(rooms, None)
+                if replaced is not None:
+                    del self._pending[replaced]
+                    EVENTS_COALESCED.inc()
+                pending[rooms] = self._sequence
+            else:
+                # An arrival or departure supersedes the tag's pending RSSI updates, whatever their rooms
+                for replaced in self._coalesced.pop(payload['epc'], {}).values():
+                    del self._pending[replaced]
+                    EVENTS_COALESCED.inc()
+            self._pending[self._sequence] = (rooms, encoded)
+
+    def flush(self):
+        """
+        Sends everything queued so far.
+        Returns:
+            int: Number of batches sent.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._coalesced = {}
+        batches = [] # (rooms, [encoded event, ...]): runs of consecutive events for the same rooms
+        for rooms, encoded in pending.values():
+            if not batches or batches[-1][0] != rooms or len(batches[-1][1]) == self.MAX_BATCH_EVENTS:
+                batches.append((rooms, []))
+            batches[-1][1].append(encoded)
+        for rooms, events in batches:
+            data = encode_batch(events)
+            self._emit(BATCH_EVENT, data, to=list(rooms))
+            BATCH_BYTES.inc(len(data))
+        if batches:
+            BATCHES_SENT.inc(len(batches))
+        return len(batches)
+
+    def run(self):
+        """Flushes every `tick` seconds, forever (run it as a background task)."""
+        while True:
+            self._sleep(self.tick)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Event bus: Failed to send a batch: {e}")
@@ -0,0 +1,615 @@
+# event_log.py
+# Append-only log of tag reads and visitor progress, with windowed analytics queries.
+#
+# Records are fixed-width (16 bytes, little-endian), so a segment is a plain array that
+# numpy can memory-map:
+#   t (f8, Unix time) | key (u4) | source (u2) | kind (u1) | rssi (u1)
+#   read      - key: EPC index, source: reader index, rssi: raw RSSI
+#   reset     - key: session index (a visitor starts over), source: NO_SOURCE
+#   completed - key: session index, source: evidence item index
+# EPCs, reader ids, session ids and item names are numbered in symbols.tsv (one
+# "namespace<TAB>value" line each, appended before the first record that uses it).
+#
+# Files live in one directory: segment files seg-000001.evt, ... each starting with a
+# 16-byte header (magic b'RFIDEVT\0' | version u16 | header size u16 | record size u32).
+# The active segment is rotated once it holds `segment_records` records or spans
+# `segment_seconds`; a sealed segment gets a seg-*.npz sidecar with its summaries, so
+# startup doesn't re-read weeks of records. A record cut short by a crash is dropped
+# when the log is opened.
+#
+# Appending never blocks the scan loop: append_read() only puts a tuple on a deque and
+# a writer thread writes batches every `flush_interval` seconds. If the writer falls
+# more than `max_pending` records behind, new records are dropped (and counted).
+#
+# Kept in memory for the queries:
+#   time index  - every INDEX_STRIDE-th timestamp per segment (timestamps are written
+#                 non-decreasing), so raw records of a time range are found with two
+#                 binary searches and read straight from the memory-mapped segment;
+#   rollups     - read counts per (minute, reader, EPC) and per (hour, reader, EPC,
+#                 RSSI), which answer reads-per-window and RSSI queries without
+#                 touching the records (their ranges are rounded out to whole windows
+#                 and hours). Rows of buckets that have ended are merged once and kept;
+#   sessions    - every reset / completed record, for time-to-complete.
+import atexit
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from epc_mappings import get_name_for_epc
+import metrics
+
+MAGIC = b'RFIDEVT\x00'
+VERSION = 1
+HEADER_SIZE = 16
+RECORD = np.dtype([('t', '<f8'), ('key', '<u4'), ('source', '<u2'), ('kind', 'u1'), ('rssi', 'u1')])
+
+KIND_READ = 0
+KIND_RESET = 1
+KIND_COMPLETED = 2
+KINDS = {"read": KIND_READ, "reset": KIND_RESET, "completed": KIND_COMPLETED}
+NO_SOURCE = 0xFFFF
+
+BUCKET_SECONDS = 60 # Read count rollup resolution
+RSSI_BUCKET_SECONDS = 3600 # RSSI rollup resolution
+INDEX_STRIDE = 4096 # Records per time index entry
+MAX_WINDOWS = 10000 # Windows per reads_per_item() answer
+LOAD_CHUNK = 1 << 20 # Records summarized at a time when a segment has no sidecar
+
+_COUNT_KEY = np.dtype([('bucket', '<i8'), ('source', '<u2'), ('key', '<u4')])
+_RSSI_KEY = np.dtype([('bucket', '<i8'), ('source', '<u2'), ('key', '<u4'), ('rssi', 'u1')])
+
+RECORDS_WRITTEN = metrics.counter("event_log_records_total", "Records appended to the event log.", ["kind"])
+RECORDS_DROPPED = metrics.counter("event_log_dropped_total", "Records dropped because the event log writer fell behind.")
+WRITE_SECONDS = metrics.histogram("event_log_write_seconds", "Time to write one batch of event log records.")
+
+
+def _aggregate(keys, counts):
+    """Sums the counts of equal keys. Returns: (unique keys, counts)."""
+    if not len(keys):
+        return keys, counts
+    unique, inverse = np.unique(keys, return_inverse=True)
+    return unique, np.bincount(inverse.ravel(), weights=counts, minlength=len(unique)).astype(np.int64)
+
+
+def _rollups(records):
+    """Count and RSSI rollup parts for a batch of records."""
+    reads = records[records['kind'] == KIND_READ]
+    count_keys = np.empty(len(reads), _COUNT_KEY)
+    rssi_keys = np.empty(len(reads), _RSSI_KEY)
+    for keys, bucket_seconds in ((count_keys, BUCKET_SECONDS), (rssi_keys, RSSI_BUCKET_SECONDS)):
+        keys['bucket'] = np.floor(reads['t'] / bucket_seconds)
+        keys['source'] = reads['source']
+        keys['key'] = reads['key']
+    rssi_keys['rssi'] = reads['rssi']
+    ones = np.ones(len(reads), dtype=np.int64)
+    return _aggregate(count_keys, ones), _aggregate(rssi_keys, ones)
+
+
+class _Rollup:
+    """Counts per key (time bucket first) of one segment, built up batch by batch."""
+    MERGE_PARTS = 64 # Batches between merges
+
+    def __init__(self, dtype):
+        self.dtype = dtype
+        self._closed = [] # Merged (keys, counts) of buckets that have ended
+        self._open = [] # Parts that may still share a bucket with the next batch
+        self._rows = None # Cached rows()
+
+    def add(self, part):
+        self._open.append(part)
+        self._rows = None
+        if len(self._open) >= self.MERGE_PARTS:
+            self._merge()
+
+    def load(self, keys, counts):
+        self._closed, self._open, self._rows = [(keys, counts)], [], None
+
+    def rows(self):
+        """All (keys, counts), sorted by key."""
+        if self._rows is None:
+            self._merge()
+            parts = self._closed + self._open
+            if not parts:
+                self._rows = np.zeros(0, self.dtype), np.zeros(0, np.int64)
+            else:
+                self._rows = (np.concatenate([keys for keys, _ in parts]), np.concatenate([counts for _, counts in parts]))
+                self._closed, self._open = [self._rows], []
+        return self._rows
+
+    def _merge(self):
+        # Records arrive in time order, so only the last bucket can still grow
+        if len(self._open) < 2:
+            return
+        keys, counts = _aggregate(np.concatenate([keys for keys, _ in self._open]),
+                                  np.concatenate([counts for _, counts in self._open]))
+        split = int(np.searchsorted(keys['bucket'], keys['bucket'][-1], side='left')) if len(keys) else 0
+        self._closed.append((keys[:split], counts[:split]))
+        self._open = [(keys[split:], counts[split:])]
+
+
+def _weighted_percentile(values, weights, q):
+    cumulative = np.cumsum(weights)
+    return float(values[min(np.searchsorted(cumulative, q * cumulative[-1]), len(values) - 1)])
+
+
+class _Symbols:
+    """Append-only numbering of strings per namespace, persisted in symbols.tsv."""
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._index = {} # namespace -> {value: index}
+        self._values = {} # namespace -> [value, ...]
+        if os.path.exists(file_path):
+            with open(file_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    namespace, _, value = line.rstrip('\n').partition('\t')
+                    if namespace:
+                        self._add(namespace, value)
+        self._file = open(file_path, 'a', encoding='utf-8')
+
+    def _add(self, namespace, value):
+        values = self._values.setdefault(namespace, [])
+        self._index.setdefault(namespace, {})[value] = len(values)
+        values.append(value)
+        return len(values) - 1
+
+    def index(self, namespace, value):
+        """Index of a value, numbering (and persisting) it if it's new. Writer thread only."""
+        value = str(value).replace('\t', ' ').replace('\n', ' ')
+        index = self._index.get(namespace, {}).get(value)
+        if index is None:
+            index = self._add(namespace, value)
+            self._file.write(f"{namespace}\t{value}\n")
+            self._file.flush()
+        return index
+
+    def lookup(self, namespace, value):
+        """Index of a known value, or None."""
+        return self._index.get(namespace, {}).get(str(value))
+
+    def value(self, namespace, index):
+        values = self._values.get(namespace, [])
+        return values[index] if 0 <= index < len(values) else None
+
+    def close(self):
+        self._file.close()
+
+
+class _Segment:
+    """One segment file and its in-memory summaries."""
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self.first_t = None
+        self.last_t = None
+        self.index_t = np.zeros(0) # Timestamp of every INDEX_STRIDE-th record
+        self.sessions = np.zeros(0, RECORD) # Its reset / completed records
+        self.counts = _Rollup(_COUNT_KEY)
+        self.rssi = _Rollup(_RSSI_KEY)
+
+    @property
+    def sidecar_path(self):
+        return os.path.splitext(self.path)[0] + '.npz'
+
+    def add(self, records):
+        """Summarizes records just appended to the file."""
+        if not len(records):
+            return
+        positions = np.arange(self.count, self.count + len(records))
+        self.index_t = np.concatenate([self.index_t, records['t'][positions % INDEX_STRIDE == 0]])
+        if self.first_t is None:
+            self.first_t = float(records['t'][0])
+        self.last_t = float(records['t'][-1])
+        self.count += len(records)
+        self.sessions = np.concatenate([self.sessions, records[records['kind'] != KIND_READ]])
+        counts, rssi = _rollups(records)
+        self.counts.add(counts)
+        self.rssi.add(rssi)
+
+    def records(self, start=0, stop=None):
+        """Records start..stop-1, memory-mapped (read-only)."""
+        stop = self.count if stop is None else min(stop, self.count)
+        if stop <= start:
+            return np.zeros(0, RECORD)
+        return np.memmap(self.path, RECORD, 'r', offset=HEADER_SIZE + start * RECORD.itemsize, shape=(stop - start,))
+
+    def position(self, t):
+        """Index of the first record with timestamp >= t."""
+        block = max(int(np.searchsorted(self.index_t, t, side='left')) - 1, 0)
+        chunk = np.array(self.records(block * INDEX_STRIDE, (block + 1) * INDEX_STRIDE + 1)['t'])
+        return block * INDEX_STRIDE + int(np.searchsorted(chunk, t, side='left'))
+
+    def overlaps(self, start, end):
+        return self.count and self.first_t < end and self.last_t >= start
+
+    def save_sidecar(self):
+        counts, rssi = self.counts.rows(), self.rssi.rows()
+        tmp_path = self.sidecar_path + '.tmp.npz'
+        np.savez(tmp_path, count=np.array([self.count]), index_t=self.index_t, sessions=self.sessions,
+                 count_keys=counts[0], count_values=counts[1], rssi_keys=rssi[0], rssi_values=rssi[1])
+        os.replace(tmp_path, self.sidecar_path)
+
+    def load_sidecar(self, count):
+        """Takes the summaries from the sidecar if it matches `count` records. Returns: bool"""
+        try:
+            with np.load(self.sidecar_path) as data:
+                if int(data['count'][0]) != count:
+                    return False
+                self.count = count
+                self.index_t = data['index_t']
+                self.sessions = data['sessions']
+                self.counts.load(data['count_keys'], data['count_values'])
+                self.rssi.load(data['rssi_keys'], data['rssi_values'])
+        except (OSError, KeyError, ValueError):
+            return False
+        if count:
+            first, last = self.records(0, 1), self.records(count - 1, count)
+            self.first_t, self.last_t = float(first['t'][0]), float(last['t'][0])
+        return True
+
+
+class EventLog:
+    """
+    Args:
+        directory (str): Where the segments and symbols.tsv live (created if missing).
+        segment_records (int): Records per segment before rotating.
+        segment_seconds (float): Longest time span of a segment.
+        flush_interval (float): Seconds between writer batches.
+        max_pending (int): Queued records beyond which new ones are dropped.
+    """
+    DEFAULT_SEGMENT_RECORDS = 4 * 1024 * 1024 # 64 MiB
+    DEFAULT_SEGMENT_SECONDS = 24 * 3600
+    DEFAULT_FLUSH_INTERVAL = 0.25
+    DEFAULT_MAX_PENDING = 100000
+
+    def __init__(self, directory, segment_records=DEFAULT_SEGMENT_RECORDS, segment_seconds=DEFAULT_SEGMENT_SECONDS,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL, max_pending=DEFAULT_MAX_PENDING):
+        self.directory = directory
+        self.segment_records = segment_records
+        self.segment_seconds = segment_seconds
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        os.makedirs(directory, exist_ok=True)
+
+        self._pending = deque() # (kind, t, a, b, rssi) tuples from append_*()
+        self._lock = threading.Lock() # Guards the segment summaries between the writer and queries
+        self._write_lock = threading.Lock() # One batch at a time
+        self._symbols = _Symbols(os.path.join(directory, 'symbols.tsv'))
+        self._segments = self._load()
+        self._file = None
+        self._last_t = self._segments[-1].last_t if self._segments and self._segments[-1].count else 0.0
+        self._closed = threading.Event()
+        self._finished = False # Files closed
+        self._thread = threading.Thread(target=self._run, name='event-log-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    # --- Appending (any thread, never blocks) ---
+    def append_read(self, epc, reader_id, rssi, timestamp=None):
+        """
+        Queues one tag read (raw EPC bytes or hex, reader id, raw RSSI 0-255).
+        Returns:
+            bool: False if it was dropped because the writer is behind.
+        """
+        return self._queue((KIND_READ, time.time() if timestamp is None else timestamp, epc, reader_id, rssi))
+
+    def append_session_event(self, event, session_id, item=None, timestamp=None):
+        """Queues a visitor event: 'reset' (starting over) or 'completed' (with the evidence item's name)."""
+        if event not in KINDS or event == "read":
+            raise ValueError(f"Unknown session event '{event}'")
+        return self._queue((KINDS[event], time.time() if timestamp is None else timestamp, session_id, item, 0))
+
+    def _queue(self, entry):
+        if len(self._pending) >= self.max_pending:
+            RECORDS_DROPPED.inc()
+            return False
+        self._pending.append(entry)
+        return True
+
+    def pending(self):
+        return len(self._pending)
+
+    def flush(self):
+        """Writes everything queued so far (the writer thread does this on its own)."""
+        self._write_pending()
+
+    def close(self):
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._thread.join(5)
+        self._write_pending()
+        with self._write_lock:
+            if self._file is not None:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._file.close()
+                self._file = None
+            self._symbols.close()
+            self._finished = True
+
+    # --- Queries ---
+    def reads_per_item(self, start, end, window=3600, reader=None):
+        """
+        Reads per item (catalog name, or EPC for unknown tags) per time window.
+        Args:
+            start, end (float): Unix time range, rounded out to whole windows.
+            window (int): Window length in seconds, a multiple of 60.
+            reader (str, optional): Only this reader's reads.
+        Returns:
+            dict: {"start", "end", "window", "windows": [window start, ...], "items": {name: [count, ...]}}
+        Raises:
+            ValueError: On a bad window or range.
+        """
+        first, last = self._bucket_range(start, end, BUCKET_SECONDS)
+        if window < BUCKET_SECONDS or window % BUCKET_SECONDS:
+            raise ValueError(f"window must be a positive multiple of {BUCKET_SECONDS} seconds")
+        per_window = int(window // BUCKET_SECONDS)
+        first -= first % per_window
+        window_count = -(-(last - first) // per_window)
+        if window_count > MAX_WINDOWS:
+            raise ValueError(f"More than {MAX_WINDOWS} windows; use a longer window")
+        parts = self._rows('counts', first, last, BUCKET_SECONDS, reader)
+        names, table = self._item_names(parts)
+        cells = np.zeros(len(names) * window_count)
+        for keys, counts in parts:
+            cells += np.bincount(table[keys['key']] * window_count + (keys['bucket'] - first) // per_window,
+                                 weights=counts, minlength=cells.size)
+        cells = cells.reshape(len(names), window_count).astype(np.int64)
+        return {
+            "start": first * BUCKET_SECONDS, "end": last * BUCKET_SECONDS, "window": per_window * BUCKET_SECONDS,
+            "windows": [(first + index * per_window) * BUCKET_SECONDS for index in range(window_count)],
+            "items": {name: row.tolist() for name, row in zip(names, cells)},
+        }
+
+    def rssi_distribution(self, start, end, item=None, reader=None):
+        """
+        RSSI histogram and percentiles per item (raw RSSI, as the reader reports it).
+        Args:
+            start, end (float): Unix time range, rounded out to whole hours.
+            item (str, optional): Only this item (catalog name or EPC).
+            reader (str, optional): Only this reader's reads.
+        Returns:
+            dict: {"start", "end", "items": {name: {"reads", "mean", "p10", "p50", "p90", "histogram": {rssi: count}}}}
+        """
+        first, last = self._bucket_range(start, end, RSSI_BUCKET_SECONDS)
+        parts = self._rows('rssi', first, last, RSSI_BUCKET_SECONDS, reader)
+        names, table = self._item_names(parts)
+        histograms = np.zeros(len(names) * 256)
+        for keys, counts in parts:
+            histograms += np.bincount(table[keys['key']] * 256 + keys['rssi'], weights=counts, minlength=histograms.size)
+        histograms = histograms.reshape(len(names), 256).astype(np.int64)
+        items = {}
+        for name, histogram in zip(names, histograms):
+            if item is not None and name != item:
+                continue
+            values = np.nonzero(histogram)[0]
+            weights = histogram[values]
+            items[name] = {
+                "reads": int(weights.sum()),
+                "mean": round(float(np.average(values, weights=weights)), 2),
+                "p10": _weighted_percentile(values, weights, 0.1),
+                "p50": _weighted_percentile(values, weights, 0.5),
+                "p90": _weighted_percentile(values, weights, 0.9),
+                "histogram": {int(value): int(weight) for value, weight in zip(values, weights)},
+            }
+        return {"start": first * RSSI_BUCKET_SECONDS, "end": last * RSSI_BUCKET_SECONDS, "items": items}
+
+    def completion_times(self, start, end):
+        """
+        Seconds from a session's latest reset to each evidence item's completion, for
+        completions within [start, end). Completions without an earlier reset are only counted.
+        Returns:
+            dict: {"start", "end", "items": {item: {"completed", "measured", "mean", "p50", "p90", "min", "max"}}}
+        """
+        with self._lock:
+            sessions = np.concatenate([segment.sessions for segment in self._segments]) if self._segments else np.zeros(0, RECORD)
+        started = {} # session index -> time of its latest reset
+        durations = {}
+        unmeasured = {}
+        for t, key, source, kind in zip(sessions['t'].tolist(), sessions['key'].tolist(), sessions['source'].tolist(),
+                                        sessions['kind'].tolist()):
+            if kind == KIND_RESET:
+                started[key] = t
+            elif kind == KIND_COMPLETED and start <= t < end:
+                item = self._symbols.value('item', source)
+                if key in started:
+                    durations.setdefault(item, []).append(t - started[key])
+                else:
+                    unmeasured[item] = unmeasured.get(item, 0) + 1
+        items = {}
+        for item in set(durations) | set(unmeasured):
+            values = np.array(durations.get(item, []))
+            stats = {"completed": len(values) + unmeasured.get(item, 0), "measured": len(values)}
+            if len(values):
+                stats.update(mean=round(float(values.mean()), 1), p50=round(float(np.percentile(values, 50)), 1),
+                             p90=round(float(np.percentile(values, 90)), 1), min=round(float(values.min()), 1),
+                             max=round(float(values.max()), 1))
+            items[item] = stats
+        return {"start": start, "end": end, "items": items}
+
+    def events(self, start, end, limit=1000, epc=None):
+        """
+        Raw tag reads within [start, end), oldest first, found through the time index.
+        Returns:
+            dict: {"reads": [{"t", "epc", "reader_id", "rssi"}, ...], "truncated": bool}
+        """
+        epc_index = None
+        if epc is not None:
+            epc_index = self._symbols.lookup('epc', epc.upper())
+            if epc_index is None:
+                return {"reads": [], "truncated": False}
+        with self._lock:
+            segments = [segment for segment in self._segments if segment.overlaps(start, end)]
+        reads = []
+        for segment in segments:
+            records = segment.records(segment.position(start), segment.position(end))
+            records = records[records['kind'] == KIND_READ]
+            if epc_index is not None:
+                records = records[records['key'] == epc_index]
+            for record in records[:limit + 1 - len(reads)]:
+                reads.append({"t": float(record['t']), "epc": self._symbols.value('epc', int(record['key'])),
+                              "reader_id": self._symbols.value('reader', int(record['source'])), "rssi": int(record['rssi'])})
+            if len(reads) > limit:
+                break
+        return {"reads": reads[:limit], "truncated": len(reads) > limit}
+
+    def stats(self):
+        with self._lock:
+            return {"segments": len(self._segments), "records": sum(segment.count for segment in self._segments),
+                    "pending": len(self._pending), "directory": self.directory}
+
+    def _bucket_range(self, start, end, bucket_seconds):
+        if not end > start:
+            raise ValueError("end must be after start")
+        return int(np.floor(start / bucket_seconds)), int(np.ceil(end / bucket_seconds))
+
+    def _rows(self, rollup, first, last, bucket_seconds, reader):
+        """Rollup rows in buckets first..last-1, optionally one reader's, as (keys, counts) per segment."""
+        source = None
+        if reader is not None:
+            source = self._symbols.lookup('reader', reader)
+            if source is None:
+                return []
+        with self._lock:
+            segments = [getattr(segment, rollup).rows() for segment in self._segments
+                        if segment.overlaps(first * bucket_seconds, last * bucket_seconds)]
+        parts = []
+        for keys, counts in segments:
+            begin, stop = np.searchsorted(keys['bucket'], [first, last]) # Rows are sorted by bucket
+            keys, counts = keys[begin:stop], counts[begin:stop]
+            if source is not None:
+                mask = keys['source'] == source
+                keys, counts = keys[mask], counts[mask]
+            parts.append((keys, counts))
+        return parts
+
+    def _item_names(self, parts):
+        """
+        Item names of the EPCs in rollup rows; EPCs sharing a catalog name are merged.
+        Returns:
+            tuple: (names, array mapping EPC index -> position in names)
+        """
+        size = max((int(keys['key'].max()) + 1 for keys, _ in parts if len(keys)), default=0)
+        present = np.zeros(size, dtype=bool)
+        for keys, _ in parts:
+            present[keys['key']] = True
+        table = np.zeros(size, dtype=np.int64)
+        names = []
+        positions = {}
+        for epc_index in np.nonzero(present)[0].tolist():
+            epc = self._symbols.value('epc', epc_index)
+            name = get_name_for_epc(epc) or epc
+            if name not in positions:
+                positions[name] = len(names)
+                names.append(name)
+            table[epc_index] = positions[name]
+        return names, table
+
+    # --- Writing (writer thread) ---
+    def _run(self):
+        while not self._closed.wait(self.flush_interval):
+            try:
+                self._write_pending()
+            except Exception as e:
+                print(f"Event log: Failed to write records: {e}")
+
+    def _write_pending(self):
+        with self._write_lock:
+            if self._finished:
+                return
+            entries = []
+            while self._pending:
+                entries.append(self._pending.popleft())
+            if not entries:
+                return
+            started = time.perf_counter()
+            records = np.zeros(len(entries), RECORD)
+            last_t = self._last_t
+            symbols = self._symbols
+            for position, (kind, t, a, b, rssi) in enumerate(entries):
+                last_t = max(last_t, t) # Keeps the time index sorted
+                if kind == KIND_READ:
+                    epc = a.hex().upper() if isinstance(a, (bytes, bytearray, memoryview)) else str(a).upper()
+                    records[position] = (last_t, symbols.index('epc', epc), symbols.index('reader', b or ''), kind, rssi)
+                else:
+                    source = NO_SOURCE if b is None else symbols.index('item', b)
+                    records[position] = (last_t, symbols.index('session', a), source, kind, 0)
+            self._last_t = last_t
+
+            # A batch may fill the active segment: split it at the segment's record and time limits
+            position = 0
+            while position < len(records):
+                segment = self._segments[-1] if self._segments else None
+                if segment is None or segment.count >= self.segment_records or \
+                        (segment.count and records['t'][position] - segment.first_t >= self.segment_seconds):
+                    segment = self._rotate(segment)
+                elif self._file is None:
+                    self._file = open(segment.path, 'ab')
+                first_t = segment.first_t if segment.count else records['t'][position]
+                stop = min(position + self.segment_records - segment.count,
+                           int(np.searchsorted(records['t'], first_t + self.segment_seconds, side='left')))
+                chunk = records[position:stop]
+                self._file.write(chunk.tobytes())
+                self._file.flush()
+                with self._lock:
+                    segment.add(chunk)
+                position = stop
+            for name, kind in KINDS.items():
+                written = int(np.count_nonzero(records['kind'] == kind))
+                if written:
+                    RECORDS_WRITTEN.labels(name).inc(written)
+            WRITE_SECONDS.observe(time.perf_counter() - started)
+
+    def _rotate(self, segment):
+        """Seals the active segment (if any) and starts the next one."""
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+        if segment is not None and segment.count:
+            with self._lock:
+                segment.save_sidecar()
+        # Numbered after every seg-*.evt file, including ones skipped as not being segments
+        numbers = [int(name[4:10]) for name in os.listdir(self.directory)
+                   if name.startswith('seg-') and name.endswith('.evt') and name[4:10].isdigit()]
+        number = max(numbers, default=0) + 1
+        new_segment = _Segment(os.path.join(self.directory, f'seg-{number:06d}.evt'))
+        self._file = open(new_segment.path, 'wb')
+        self._file.write(MAGIC + np.array([VERSION, HEADER_SIZE], '<u2').tobytes() + np.array([RECORD.itemsize], '<u4').tobytes())
+        self._file.flush()
+        with self._lock:
+            self._segments.append(new_segment)
+        return new_segment
+
+    # --- Loading ---
+    def _load(self):
+        names = sorted(name for name in os.listdir(self.directory) if name.startswith('seg-') and name.endswith('.evt'))
+        segments = []
+        for position, name in enumerate(names):
+            path = os.path.join(self.directory, name)
+            with open(path, 'rb') as f:
+                header = f.read(HEADER_SIZE)
+            if len(header) < HEADER_SIZE or header[:8] != MAGIC:
+                print(f"Event log: Skipping '{path}' (not an event log segment)")
+                continue
+            size = os.path.getsize(path)
+            count = (size - HEADER_SIZE) // RECORD.itemsize
+            if HEADER_SIZE + count * RECORD.itemsize != size:
+                os.truncate(path, HEADER_SIZE + count * RECORD.itemsize) # A record cut short by a crash
+            segment = _Segment(path)
+            sealed = position < len(names) - 1
+            if not (sealed and segment.load_sidecar(count)):
+                records = np.memmap(path, RECORD, 'r', offset=HEADER_SIZE, shape=(count,)) if count else ()
+                for begin in range(0, count, LOAD_CHUNK):
+                    segment.add(np.array(records[begin:begin + LOAD_CHUNK]))
+                del records
+                if sealed:
+                    segment.save_sidecar()
+            segments.append(segment)
+        return segments
@@ -0,0 +1,202 @@
+# fake_serial.py
+# A stand-in for serial.Serial that replays a capture (see capture_log.py), so the scan
+# pipeline can run without the E720 reader or the glove attached.
+#
+#   reader = RFIDReader(serial_factory=ReplaySerial.factory("field.cap", speed=0))
+#
+# Received bytes are delivered with the recorded timing (speed=1.0), faster or slower
+# (speed=N), or as fast as the consumer reads them (speed=0). Recorded disconnects are
+# reproduced, and faults can be injected on top of a clean capture: frames split across
+# reads, corrupted checksums and a disconnect after a given replay time.
+import os
+import random
+import threading
+import time
+
+import serial
+
+from capture_log import CaptureReader, CaptureRecord, RecordingSerial, KIND_SERIAL_RX, KIND_DISCONNECT
+from rfid_frames import FRAME_END
+
+
+def synthetic_records(frames, interval=0.01):
+    """Records delivering each frame (bytes) `interval` seconds apart, e.g. to load-test without a capture."""
+    return [CaptureRecord(int(index * interval * 1e9), KIND_SERIAL_RX, 0, frame) for index, frame in enumerate(frames)]
+
+
+def serial_factory_from_env(capture_writer=None, channel=0):
+    """
+    The RFIDReader serial_factory selected by the environment: RFID_REPLAY=<capture file>
+    replays a capture (RFID_REPLAY_SPEED: 1 = real time, 0 = as fast as possible);
+    otherwise the real port, recorded into `capture_writer` if one is given.
+    `channel` tells readers apart in a capture (one channel per reader).
+    """
+    if os.environ.get('RFID_REPLAY'):
+        return ReplaySerial.factory(os.environ['RFID_REPLAY'], channel=channel,
+                                    speed=float(os.environ.get('RFID_REPLAY_SPEED', '1')))
+    if capture_writer is not None:
+        return RecordingSerial.factory(capture_writer, channel)
+    return None
+
+
+class ReplaySerial:
+    """
+    Serial-port look-alike fed by capture records. Supports what RFIDReader and the
+    reader engine use: read(), write(), in_waiting, timeout, is_open, close().
+    There is no fileno(), so the reader engine falls back to polling in_waiting.
+
+    Args:
+        records: CaptureRecords (or anything with timestamp_ns/kind/payload). Only
+                 KIND_SERIAL_RX and KIND_DISCONNECT records are replayed.
+        speed (float): 1.0 for real time, N for N times faster, 0 for no delays.
+        timeout (float): Read timeout, same meaning as pyserial's (None blocks, 0 never waits).
+        loop (bool): Start over when the capture ends instead of going quiet.
+        split_rate (float): Probability that a chunk is delivered in two parts.
+        corrupt_rate (float): Probability that a chunk ending a frame gets a bad checksum.
+        disconnect_after (float, optional): Fail the port after this many seconds of replay.
+        seed (int, optional): Seed for the fault injection, so incidents are reproducible.
+    """
+    SPLIT_GAP = 0.002 # Seconds between the two halves of a split chunk (when not at speed 0)
+    MAX_BUFFERED = 64 * 1024 # At speed 0, wait for the consumer beyond this many unread bytes
+
+    def __init__(self, records, speed=1.0, timeout=None, loop=False, split_rate=0.0, corrupt_rate=0.0,
+                 disconnect_after=None, seed=None):
+        self.timeout = timeout
+        self.speed = speed
+        self.loop = loop
+        self.split_rate = split_rate
+        self.corrupt_rate = corrupt_rate
+        self.disconnect_after = disconnect_after
+        self.written = bytearray() # Everything the application sent, for inspection
+        self.stats = {"chunks": 0, "bytes": 0, "splits": 0, "corrupted": 0}
+
+        self._records = [record for record in records if record.kind in (KIND_SERIAL_RX, KIND_DISCONNECT)]
+        self._random = random.Random(seed)
+        self._buffer = bytearray()
+        self._cond = threading.Condition()
+        self._error = None # Set when the replay disconnects the port
+        self.is_open = True
+        self._thread = threading.Thread(target=self._replay, name="replay-serial", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def factory(cls, capture_path=None, records=None, channel=None, **options):
+        """
+        A serial_factory for RFIDReader; every connect() starts the replay from the beginning.
+        With `channel`, only that reader's records of a multi-reader capture are replayed.
+        """
+        def open_port(port, baudrate, timeout=None):
+            source = records if records is not None else CaptureReader(capture_path).records()
+            if channel is not None:
+                source = (record for record in source if record.channel == channel)
+            return cls(source, timeout=timeout, **options)
+        return open_port
+
+    # --- pyserial API ---
+    @property
+    def in_waiting(self):
+        with self._cond:
+            self._check_open()
+            return len(self._buffer)
+
+    def read(self, size=1):
+        with self._cond:
+            deadline = None if self.timeout is None else time.monotonic() + self.timeout
+            while not self._buffer:
+                self._check_open()
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return b''
+                self._cond.wait(remaining)
+            data = bytes(self._buffer[:size])
+            del self._buffer[:size]
+            self._cond.notify_all() # Wakes a replay waiting for room
+            return data
+
+    def write(self, data):
+        with self._cond:
+            self._check_open()
+            self.written.extend(data)
+        return len(data)
+
+    def reset_input_buffer(self):
+        with self._cond:
+            self._buffer.clear()
+
+    def close(self):
+        with self._cond:
+            self.is_open = False
+            self._cond.notify_all()
+
+    @property
+    def finished(self):
+        """True once the whole capture has been delivered (never with loop=True)."""
+        return not self._thread.is_alive()
+
+    # --- Replay ---
+    def _check_open(self):
+        # Called with self._cond held
+        if not self.is_open:
+            raise serial.PortNotOpenError()
+        if self._error is not None:
+            raise serial.SerialException(self._error)
+
+    def _replay(self):
+        started = time.monotonic()
+        offset = 0.0 # Replay time of the current pass's first record (grows with each loop)
+        while True:
+            first_ns = self._records[0].timestamp_ns if self._records else 0
+            pass_length = 0.0
+            for record in self._records:
+                at = offset + max(0, record.timestamp_ns - first_ns) / 1e9
+                pass_length = at - offset
+                if self.disconnect_after is not None and at >= self.disconnect_after:
+                    self._fail(f"Injected disconnect after {self.disconnect_after}s of replay")
+                    return
+                if not self._wait_until(started, at):
+                    return
+                if record.kind == KIND_DISCONNECT:
+                    self._fail(bytes(record.payload).decode('utf-8', 'replace') or "Recorded disconnect")
+                    return
+                if not self._deliver(bytes(record.payload)):
+                    return
+            if not self.loop or not self._records:
+                return
+            offset += pass_length + 0.001
+
+    def _wait_until(self, started, at):
+        """Sleeps until replay time `at`. Returns False if the port was closed meanwhile."""
+        if self.speed:
+            delay = started + at / self.speed - time.monotonic()
+            if delay > 0:
+                with self._cond:
+                    self._cond.wait_for(lambda: not self.is_open, delay)
+        return self.is_open
+
+    def _deliver(self, chunk):
+        if self.corrupt_rate and chunk.endswith(bytes([FRAME_END])) and len(chunk) >= 2 \
+                and self._random.random() < self.corrupt_rate:
+            chunk = chunk[:-2] + bytes([chunk[-2] ^ 0xFF]) + chunk[-1:] # Checksum of the chunk's last frame
+            self.stats["corrupted"] += 1
+        parts = [chunk]
+        if self.split_rate and len(chunk) > 1 and self._random.random() < self.split_rate:
+            cut = self._random.randrange(1, len(chunk))
+            parts = [chunk[:cut], chunk[cut:]]
+            self.stats["splits"] += 1
+        for index, part in enumerate(parts):
+            if index and self.speed:
+                time.sleep(self.SPLIT_GAP)
+            with self._cond:
+                self._cond.wait_for(lambda: len(self._buffer) < self.MAX_BUFFERED or not self.is_open)
+                if not self.is_open:
+                    return False
+                self._buffer.extend(part)
+                self._cond.notify_all()
+        self.stats["chunks"] += 1
+        self.stats["bytes"] += len(chunk)
+        return True
+
+    def _fail(self, message):
+        with self._cond:
+            self._error = message
+            self._cond.notify_all()
@@ -0,0 +1,391 @@
+# gesture_calibration.py
+# Offline calibration of the gesture scoring (gesture_matching.py / gesture.js) from
+# recorded attempts. Writes data/gesture_scoring.json, which GestureMatcher loads.
+#
+#   python gesture_calibration.py recordings/*.json
+#   python gesture_calibration.py knife.json cup.json --workers 8 --accel-weights 0.5 0.6 0.7 0.8 0.9
+#
+# Datasets are JSON files holding labelled attempts, in any of these shapes:
+#   {"action": "knife", "attempts": [attempt, ...]}   - one knife_gesture_collector.html session
+#                                                       (its allTestsData array), the same body
+#                                                       /api/gesture/templates accepts
+#   {"attempts": {"knife": [attempt, ...], ...}}
+#   [attempt, ...]                                    - the action is the file name ("knife.json")
+# or a list of the first two. Attempts are anything gesture_matching.to_sequence() accepts.
+# Recordings that were also added as templates match themselves exactly; use separate ones.
+#
+# Every attempt is scored against the templates of every action: against its own action
+# it should score high, against the others (a visitor doing the wrong gesture) low.
+#   1. Only the accel / gyro weight ratio changes which DTW alignment is best (diff_scale
+#      and decay just scale the distance), so DTW runs once per candidate accel weight.
+#      That is the expensive part: it is split over a process pool whose workers read the
+#      attempts and templates from shared memory and write nearest-template distances
+#      into a shared result array, so nothing but task indices is pickled.
+#   2. Per weight, the distance cutoff with the best balanced accuracy (mean of correct
+#      attempts accepted and wrong ones rejected) is searched over every observed
+#      distance; the weight with the best accuracy (then ROC AUC) wins.
+#   3. decay is set so that cutoff lands on the passing level's threshold (70, where
+#      gesture.js's high-match tier starts). The top level starts at the median score of
+#      the correct attempts that pass, the lowest named level at the median of the wrong
+#      attempts that fail, and the level in between halfway to the passing threshold.
+# Steps 2 and 3 only touch the cached distance arrays, so they take milliseconds.
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from gesture_matching import (DEFAULT_BAND_RATIO, DEFAULT_SCORING_CONFIG, SCORING_FILE_PATH, SCORING_FILE_VERSION,
+                              TEMPLATES_FILE_PATH, TemplateLibrary, load_templates, match_level, match_percentage,
+                              to_sequence)
+
+DEFAULT_ACCEL_WEIGHTS = tuple(round(weight, 2) for weight in np.arange(0.4, 1.0001, 0.05))
+PASS_LEVEL = 1 # Index in "levels" of the lowest level counted as a match (gesture.js's high tier)
+TOP_LEVEL_QUANTILE = 0.5 # Share of the passing correct attempts that stay below the top level
+LOWEST_LEVEL_QUANTILE = 0.5 # Share of the failing wrong attempts that stay below the lowest named level
+TOP_LEVEL_MAX = 95.0 # The remap saturates at 100, so a median of 100 is common; keep the top level reachable
+CHUNKS_PER_WORKER = 4 # Tasks per worker and weight, so a slow chunk doesn't hold up the rest
+
+
+def load_dataset(paths):
+    """
+    Reads labelled attempts from dataset files (see the module comment).
+    Returns:
+        dict: action -> [(T, 6) array, ...]; empty attempts are dropped.
+    Raises:
+        ValueError: If a file has an unknown layout.
+    """
+    dataset = {}
+
+    def add(action, attempts):
+        sequences = [to_sequence(attempt) for attempt in attempts]
+        dataset.setdefault(str(action), []).extend(sequence for sequence in sequences if len(sequence))
+
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        entries = data if isinstance(data, list) and data and isinstance(data[0], dict) and 'attempts' in data[0] else [data]
+        for entry in entries:
+            if isinstance(entry, list):
+                add(os.path.splitext(os.path.basename(path))[0], entry)
+            elif isinstance(entry, dict) and isinstance(entry.get('attempts'), dict):
+                for action, attempts in entry['attempts'].items():
+                    add(action, attempts)
+            elif isinstance(entry, dict) and entry.get('action') and isinstance(entry.get('attempts'), list):
+                add(entry['action'], entry['attempts'])
+            else:
+                raise ValueError(f"'{path}': expected {{'action', 'attempts'}}, {{'attempts': {{action: [...]}}}} or a list of attempts")
+    return dataset
+
+
+# --- Shared arrays ---
+def _share(array):
+    """Copies an array into a new shared memory block. Returns: (SharedMemory, spec for _attach())."""
+    block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+    np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+    return block, (block.name, array.shape, array.dtype.str)
+
+
+def _attach(spec):
+    name, shape, dtype = spec
+    block = shared_memory.SharedMemory(name=name) # Pool workers share the parent's resource tracker; it unlinks
+    return block, np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+
+
+def _pack(sequences):
+    """Concatenates (T, 6) arrays. Returns: (flat (sum T, 6) array, offsets (len + 1,))."""
+    offsets = np.zeros(len(sequences) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(sequence) for sequence in sequences])
+    flat = np.concatenate(sequences) if sequences else np.zeros((0, 6))
+    return flat.astype(np.float64), offsets
+
+
+# --- Workers ---
+_worker = {} # Set by _init_worker() in every process that runs _score_chunk()
+
+
+def _init_worker(specs, actions, template_actions, accel_weights, band_ratio, base_config):
+    blocks = {}
+    arrays = {}
+    for key, spec in specs.items():
+        blocks[key], arrays[key] = _attach(spec)
+    _worker.update(blocks=blocks, arrays=arrays, actions=actions, template_actions=template_actions,
+                   accel_weights=accel_weights, band_ratio=band_ratio, base_config=base_config, libraries={})
+
+
+def _library(weight_index):
+    """The templates as a TemplateLibrary scoring with one candidate accel weight (built once per process)."""
+    library = _worker["libraries"].get(weight_index)
+    if library is None:
+        arrays = _worker["arrays"]
+        flat, offsets = arrays["templates"], arrays["template_offsets"]
+        templates = {}
+        for index, action in enumerate(_worker["template_actions"]):
+            templates.setdefault(action, []).append(flat[offsets[index]:offsets[index + 1]])
+        weight = _worker["accel_weights"][weight_index]
+        config = dict(_worker["base_config"], accel_weight=weight, gyro_weight=round(1.0 - weight, 6))
+        library = _worker["libraries"][weight_index] = TemplateLibrary(templates, _worker["band_ratio"], config)
+    return library
+
+
+def _score_chunk(weight_index, start, stop):
+    """Writes the nearest-template distance of attempts start..stop-1 to every action into the result array."""
+    arrays = _worker["arrays"]
+    library = _library(weight_index)
+    flat, offsets, results = arrays["attempts"], arrays["attempt_offsets"], arrays["distances"]
+    chunk = [flat[offsets[attempt]:offsets[attempt + 1]] for attempt in range(start, stop)]
+    for action_index, action in enumerate(_worker["actions"]):
+        nearest = library.nearest_batch(action, chunk)
+        results[weight_index, start:stop, action_index] = [distance for distance, _template_index in nearest]
+    return stop - start
+
+
+def score_all(templates, dataset, accel_weights=DEFAULT_ACCEL_WEIGHTS, workers=None, band_ratio=DEFAULT_BAND_RATIO,
+              base_config=None, progress=None):
+    """
+    Nearest-template distance of every attempt to every action, per accel weight.
+
+    Args:
+        templates (dict): action -> [(T, 6) array, ...].
+        dataset (dict): action -> attempts, from load_dataset(); only actions with templates are used.
+        workers (int, optional): Processes to use (default: CPU count); 1 scores in this process.
+        progress (callable, optional): Called as progress(attempts done, attempts total).
+    Returns:
+        tuple: (actions, labels (A,) action index per attempt, distances (W, A, n_actions) array)
+    Raises:
+        ValueError: If no dataset action has templates.
+    """
+    actions = [action for action in templates if templates[action]]
+    labelled = [(actions.index(action), attempt) for action, attempts in dataset.items() if action in actions
+                for attempt in attempts]
+    if not labelled:
+        raise ValueError(f"No attempts for an action with templates ({', '.join(actions) or 'none'})")
+    labels = np.array([label for label, _ in labelled], dtype=np.int64)
+    attempts, attempt_offsets = _pack([attempt for _, attempt in labelled])
+    template_actions = [action for action in actions for _ in templates[action]]
+    template_flat, template_offsets = _pack([template for action in actions for template in templates[action]])
+    distances = np.zeros((len(accel_weights), len(labelled), len(actions)))
+
+    blocks = []
+    specs = {}
+    try:
+        for key, array in (("attempts", attempts), ("attempt_offsets", attempt_offsets), ("templates", template_flat),
+                           ("template_offsets", template_offsets), ("distances", distances)):
+            block, specs[key] = _share(array)
+            blocks.append(block)
+        init_args = (specs, actions, template_actions, tuple(accel_weights), band_ratio,
+                     dict(DEFAULT_SCORING_CONFIG, **(base_config or {})))
+        workers = max(1, workers or os.cpu_count() or 1)
+        chunk = max(1, math.ceil(len(labelled) / (workers * CHUNKS_PER_WORKER)))
+        tasks = [(weight_index, start, min(start + chunk, len(labelled)))
+                 for weight_index in range(len(accel_weights)) for start in range(0, len(labelled), chunk)]
+        total = len(accel_weights) * len(labelled)
+        done = 0
+        if workers == 1:
+            _init_worker(*init_args)
+            try:
+                for task in tasks:
+                    done += _score_chunk(*task)
+                    if progress is not None:
+                        progress(done, total)
+            finally:
+                _worker.clear()
+        else:
+            with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=init_args) as pool:
+                for count in pool.map(_score_chunk, *zip(*tasks)):
+                    done += count
+                    if progress is not None:
+                        progress(done, total)
+        result = np.ndarray(distances.shape, distances.dtype, buffer=blocks[-1].buf).copy()
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+    return actions, labels, result
+
+
+# --- Fitting ---
+def split_distances(labels, distances):
+    """Distances of attempts to their own action (genuine) and to every other action (impostor)."""
+    rows = np.arange(len(labels))
+    genuine = distances[rows, labels]
+    mask = np.ones(distances.shape, dtype=bool)
+    mask[rows, labels] = False
+    return genuine, distances[mask]
+
+
+def roc_auc(genuine, impostor):
+    """Probability that a correct attempt is closer than a wrong one (ties count half)."""
+    if not len(genuine) or not len(impostor):
+        return float('nan')
+    impostor = np.sort(impostor)
+    below = np.searchsorted(impostor, genuine, side='left')
+    not_above = np.searchsorted(impostor, genuine, side='right')
+    return float(np.mean((len(impostor) - not_above) + 0.5 * (not_above - below)) / len(impostor))
+
+
+def best_cutoff(genuine, impostor):
+    """
+    The distance cutoff (accept when distance <= cutoff) with the best balanced accuracy,
+    searched over every observed distance. Returns: (cutoff, balanced accuracy)
+    """
+    genuine, impostor = np.sort(genuine), np.sort(impostor)
+    if not len(impostor):
+        return float(genuine[-1]), 1.0
+    candidates = np.unique(np.concatenate([genuine, impostor]))
+    accepted = np.searchsorted(genuine, candidates, side='right') / len(genuine)
+    rejected = 1.0 - np.searchsorted(impostor, candidates, side='right') / len(impostor)
+    accuracy = (accepted + rejected) / 2
+    best = int(np.argmax(accuracy))
+    # Midway to the next observed distance, so a slightly different attempt lands on the same side
+    cutoff = candidates[best] if best + 1 == len(candidates) else (candidates[best] + candidates[best + 1]) / 2
+    return float(cutoff), float(accuracy[best])
+
+
+def _percentage_to_raw(percentage, config):
+    """Inverse of the remap above the knee in match_percentage()."""
+    if percentage >= config["remap_knee"]:
+        return config["remap_knee"] + (percentage - config["remap_knee"]) / config["remap_slope"]
+    return percentage
+
+
+def fit_config(genuine, impostor, accel_weight, base_config=None):
+    """
+    Scoring config for one accel weight's distances: decay from the best cutoff, level
+    thresholds from the genuine / impostor distributions (see the module comment).
+    """
+    config = dict(DEFAULT_SCORING_CONFIG, **(base_config or {}))
+    config.update(accel_weight=accel_weight, gyro_weight=round(1.0 - accel_weight, 6))
+    config.pop("revision", None)
+    cutoff, _ = best_cutoff(genuine, impostor)
+    levels = [list(level) for level in config["levels"]]
+    pass_threshold = levels[PASS_LEVEL][0]
+    config["decay"] = -math.log(_percentage_to_raw(pass_threshold, config) / 100.0) / max(cutoff, 1e-9)
+
+    def percentages(distances):
+        return np.array([match_percentage(float(distance), config) for distance in distances])
+
+    passing = percentages(genuine[genuine <= cutoff])
+    failing = percentages(impostor[impostor > cutoff])
+    top = float(np.quantile(passing, TOP_LEVEL_QUANTILE)) if len(passing) else levels[0][0]
+    lowest = float(np.quantile(failing, LOWEST_LEVEL_QUANTILE)) if len(failing) else levels[-1][0]
+    top = min(TOP_LEVEL_MAX, max(top, pass_threshold + 1))
+    lowest = max(0.1, min(lowest, pass_threshold - 2))
+    thresholds = [top, pass_threshold, (lowest + pass_threshold) / 2, lowest]
+    for level, threshold in zip(levels, thresholds): # gesture.js's four levels
+        level[0] = round(float(threshold), 1)
+    config["levels"] = levels
+    return config
+
+
+def evaluate(config, genuine, impostor):
+    """How correct and wrong attempts spread over the levels with a config."""
+    names = [level for _, level in config["levels"]] + [config["lowest_level"]]
+    passing = set(names[:PASS_LEVEL + 1])
+
+    def spread(distances):
+        counts = dict.fromkeys(names, 0)
+        for distance in distances:
+            counts[match_level(match_percentage(float(distance), config), config)] += 1
+        return counts
+
+    genuine_levels, impostor_levels = spread(genuine), spread(impostor)
+    return {
+        "correct_passed": sum(genuine_levels[name] for name in passing) / max(1, len(genuine)),
+        "wrong_passed": sum(impostor_levels[name] for name in passing) / max(1, len(impostor)),
+        "correct_levels": genuine_levels,
+        "wrong_levels": impostor_levels,
+    }
+
+
+def calibrate(templates, dataset, accel_weights=DEFAULT_ACCEL_WEIGHTS, workers=None, band_ratio=DEFAULT_BAND_RATIO,
+              base_config=None, progress=None):
+    """
+    Scores the dataset for every accel weight and fits the scoring config.
+    Returns:
+        dict: {"config", "evaluation", "baseline", "grid", "dataset"}; "baseline" evaluates
+              `base_config` (default: gesture.js's constants) on the same attempts.
+    """
+    base_config = dict(DEFAULT_SCORING_CONFIG, **(base_config or {}))
+    actions, labels, distances = score_all(templates, dataset, accel_weights, workers, band_ratio, base_config, progress)
+    grid = []
+    for weight_index, weight in enumerate(accel_weights):
+        genuine, impostor = split_distances(labels, distances[weight_index])
+        cutoff, accuracy = best_cutoff(genuine, impostor)
+        grid.append({"accel_weight": weight, "balanced_accuracy": round(accuracy, 4),
+                     "auc": round(roc_auc(genuine, impostor), 4), "cutoff": cutoff})
+    best_index = max(range(len(grid)), key=lambda index: (grid[index]["balanced_accuracy"], grid[index]["auc"]))
+    genuine, impostor = split_distances(labels, distances[best_index])
+    config = fit_config(genuine, impostor, accel_weights[best_index], base_config)
+
+    baseline = None
+    if base_config["accel_weight"] in accel_weights: # The baseline's distances are in the grid
+        base_genuine, base_impostor = split_distances(labels, distances[list(accel_weights).index(base_config["accel_weight"])])
+        baseline = evaluate(base_config, base_genuine, base_impostor)
+    return {
+        "config": config,
+        "evaluation": dict(evaluate(config, genuine, impostor), **grid[best_index]),
+        "baseline": baseline,
+        "grid": grid,
+        "dataset": {"actions": actions, "attempts": {action: int(np.sum(labels == index)) for index, action in enumerate(actions)},
+                    "exact_matches": int(np.sum(genuine == 0))},
+    }
+
+
+def save_scoring_config(result, file_path=SCORING_FILE_PATH):
+    """Writes a calibration result as the next revision of the scoring file (temp file + atomic rename)."""
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            revision = int(json.load(f).get("revision") or 0) + 1
+    except (FileNotFoundError, ValueError, AttributeError):
+        revision = 1
+    data = {"version": SCORING_FILE_VERSION, "revision": revision, "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            **result}
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, file_path)
+    return revision
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fit the gesture scoring weights and level thresholds to recorded attempts.")
+    parser.add_argument("datasets", nargs="+", help="JSON files with labelled attempts")
+    parser.add_argument("--templates", default=TEMPLATES_FILE_PATH, help="templates JSON file (default: the live one)")
+    parser.add_argument("--accel-weights", nargs="+", type=float, default=DEFAULT_ACCEL_WEIGHTS,
+                        help="accel weights to try (gyro weight = 1 - accel weight)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="processes (default: CPU count)")
+    parser.add_argument("--output", default=SCORING_FILE_PATH, help="scoring config to write")
+    parser.add_argument("--dry-run", action="store_true", help="print the result without writing it")
+    args = parser.parse_args(argv)
+
+    if any(not 0 <= weight <= 1 for weight in args.accel_weights):
+        parser.error("accel weights must be between 0 and 1")
+    dataset = load_dataset(args.datasets)
+    print(f"{sum(map(len, dataset.values()))} attempts: " + ", ".join(f"{action} {len(attempts)}" for action, attempts in dataset.items()),
+          file=sys.stderr)
+    started = time.perf_counter()
+
+    def report(done, total):
+        print(f"\rScored {done}/{total} attempt x weight pairs", end="", file=sys.stderr)
+
+    result = calibrate(load_templates(args.templates), dataset, tuple(args.accel_weights), args.workers, progress=report)
+    print(f"\nDone in {time.perf_counter() - started:.1f} s", file=sys.stderr)
+    if result["dataset"]["exact_matches"]:
+        print(f"Warning: {result['dataset']['exact_matches']} attempts are identical to a template", file=sys.stderr)
+    print(json.dumps({key: result[key] for key in ("config", "evaluation", "baseline")}, indent=2, ensure_ascii=False))
+    if not args.dry_run:
+        revision = save_scoring_config(result, args.output)
+        print(f"Saved revision {revision} to {args.output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,471 @@
+# gesture_matching.py
+# Server-side gesture scoring for the MPU6050 glove (Stage 4 gesture replays).
+#
+# Mirrors the scoring in frontend/js/gesture.js (calculateDistance / getMatchLevel),
+# but aligns the attempt to the template with Dynamic Time Warping instead of
+# comparing sample i with sample i, so a correct gesture done a little faster or
+# slower still scores well. DTW is restricted to a Sakoe-Chiba band.
+#
+# Each action can have many templates (e.g. recorded with knife_gesture_collector.html).
+# TemplateLibrary precomputes every template's envelopes and normalizers and answers
+# nearest-template queries with cheap lower bounds first (LB_Kim, then LB_Keogh), so
+# most templates are ruled out without running DTW. The (attempt, template) pairs that
+# survive are scored together: dtw_batch() runs one vectorized anti-diagonal sweep over
+# every pair of the same shape, for a whole batch of attempts at once.
+#
+# The scoring constants default to gesture.js's hand-tuned ones; data/gesture_scoring.json,
+# written by gesture_calibration.py from recorded attempts, replaces them when present.
+#
+# Samples are 6-axis rows: [ax, ay, az, gx, gy, gz].
+import json
+import math
+import os
+import threading
+
+import numpy as np
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+TEMPLATES_FILE_PATH = os.path.join(DATA_DIR, 'gesture_templates.json')
+SCORING_FILE_PATH = os.path.join(DATA_DIR, 'gesture_scoring.json')
+SCORING_FILE_VERSION = 1
+
+# Same constants as gesture.js
+DEFAULT_SCORING_CONFIG = {
+    "accel_weight": 0.8, # Weight of the (normalized) acceleration difference per sample
+    "gyro_weight": 0.2, # Weight of the gyroscope difference per sample
+    "diff_scale": 10.0,
+    "decay": 0.5, # matchPercentage = 100 * exp(-decay * normalizedTotalDiff)
+    "remap_knee": 40.0, # Percentages above the knee are stretched by remap_slope
+    "remap_slope": 1.5,
+    # (minimum percentage, level), checked in order
+    "levels": [[85, "完美匹配"], [70, "非常接近"], [55, "基本接近"], [35, "有些差异"]],
+    "lowest_level": "差异较大",
+}
+DEFAULT_BAND_RATIO = 0.25 # Sakoe-Chiba band half-width, as a fraction of the template length
+DTW_BATCH_PAIRS = 128 # (attempt, template) pairs per dtw_batch() call; bounds its (B, n, m) arrays
+
+SAMPLE_FIELDS = ("ax", "ay", "az", "gx", "gy", "gz")
+
+
+def to_sequence(samples):
+    """
+    Converts one recorded attempt into a (T, 6) float array. Accepts rows of six
+    numbers, flat dicts ({'ax': .., 'gz': ..}) or the frontend's nested
+    {'accel': {'x'..}, 'gyro': {'x'..}} objects. Missing values count as 0, like gesture.js.
+    """
+    if isinstance(samples, np.ndarray):
+        return np.asarray(samples, dtype=np.float64).reshape(-1, 6)
+    rows = []
+    for sample in samples:
+        if isinstance(sample, dict):
+            if 'accel' in sample or 'gyro' in sample:
+                accel = sample.get('accel') or {}
+                gyro = sample.get('gyro') or {}
+                rows.append([accel.get('x') or 0, accel.get('y') or 0, accel.get('z') or 0,
+                             gyro.get('x') or 0, gyro.get('y') or 0, gyro.get('z') or 0])
+            else:
+                rows.append([sample.get(field) or 0 for field in SAMPLE_FIELDS])
+        else:
+            rows.append(list(sample)[:6])
+    return np.asarray(rows, dtype=np.float64).reshape(-1, 6)
+
+
+def load_templates(file_path=TEMPLATES_FILE_PATH):
+    """Loads {action: [template (T, 6) array, ...]} from the templates JSON file."""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return {action: [to_sequence(template) for template in templates]
+            for action, templates in data["templates"].items()}
+
+
+def load_scoring_config(file_path=SCORING_FILE_PATH):
+    """
+    The "config" of a calibrated scoring file, or None if there is none (or it can't be
+    used), in which case DEFAULT_SCORING_CONFIG applies.
+    """
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None
+    except ValueError as e:
+        print(f"Error loading gesture scoring config '{file_path}': {e}. Using the default scoring.")
+        return None
+    if data.get("version") != SCORING_FILE_VERSION:
+        print(f"Gesture scoring config '{file_path}' has version {data.get('version')}, "
+              f"expected {SCORING_FILE_VERSION}. Using the default scoring.")
+        return None
+    unknown = set(data.get("config") or {}) - set(DEFAULT_SCORING_CONFIG)
+    if unknown:
+        print(f"Gesture scoring config '{file_path}' has unknown settings {sorted(unknown)}. Using the default scoring.")
+        return None
+    return dict(data.get("config") or {}, revision=data.get("revision"))
+
+
+def match_percentage(normalized_distance, config=DEFAULT_SCORING_CONFIG):
+    """gesture.js's match percentage for a normalized distance: exp decay, then the remap above the knee."""
+    percentage = 100.0 * math.exp(-config["decay"] * normalized_distance)
+    if percentage >= config["remap_knee"]:
+        percentage = config["remap_knee"] + (percentage - config["remap_knee"]) * config["remap_slope"]
+    return min(100.0, percentage)
+
+
+def match_level(percentage, config=DEFAULT_SCORING_CONFIG):
+    for threshold, level in config["levels"]:
+        if percentage >= threshold:
+            return level
+    return config["lowest_level"]
+
+
+def template_features(template):
+    """Per-template normalizers, as computed for the reference in gesture.js."""
+    accel_mag = np.linalg.norm(template[:, :3], axis=1)
+    max_accel = max(0.001, float(accel_mag.max())) if len(accel_mag) else 0.001
+    avg_accel = float(accel_mag.mean()) if len(accel_mag) else 0.0
+    return max_accel, (avg_accel or 0.001)
+
+
+def sample_costs(diff, max_accel, config=DEFAULT_SCORING_CONFIG):
+    """Per-sample cost (gesture.js formula) of 6-axis differences shaped (..., 6)."""
+    accel_diff = np.sqrt(np.einsum('...k,...k->...', diff[..., :3], diff[..., :3]))
+    gyro_diff = np.sqrt(np.einsum('...k,...k->...', diff[..., 3:], diff[..., 3:]))
+    return (accel_diff / max_accel * config["accel_weight"] + gyro_diff * config["gyro_weight"]) * config["diff_scale"]
+
+
+def cost_matrices(queries, template, max_accel, config=DEFAULT_SCORING_CONFIG):
+    """
+    Local distance between every query sample and every template sample.
+    Args:
+        queries: (B, N, 6) array of equal-length attempts.
+        template: (M, 6) array, or (B, M, 6) for a different template per query.
+        max_accel: The template's normalizer, or (B,) normalizers for (B, M, 6) templates.
+    Returns:
+        (B, N, M) array of per-pair costs (same formula as gesture.js).
+    """
+    templates = template if template.ndim == 3 else template[None]
+    max_accel = np.asarray(max_accel, dtype=np.float64).reshape(-1, 1, 1)
+    return sample_costs(queries[:, :, None, :] - templates[:, None, :, :], max_accel, config)
+
+
+def band_radius(n, m, band_ratio):
+    """
+    Sakoe-Chiba half-width in template samples. Never narrower than one sample, nor
+    than one query step (m / n), so a path through the band always exists.
+    """
+    return max(1, int(math.ceil(band_ratio * m)), int(math.ceil(m / n)))
+
+
+def band_window(n, m, band_ratio):
+    """
+    The band as 0-based, inclusive template index ranges per query sample: row i may
+    align with template samples lo[i]..hi[i]. Same band as dtw_batch() uses.
+    """
+    radius = band_radius(n, m, band_ratio)
+    center = np.arange(1, n + 1) * (m / n) # 1-based diagonal, as in dtw_batch()
+    lo = np.maximum(np.ceil(center - radius), 1).astype(int) - 1
+    hi = np.minimum(np.floor(center + radius), m).astype(int) - 1
+    return lo, hi
+
+
+def dtw_batch(costs, band_ratio=DEFAULT_BAND_RATIO):
+    """
+    DTW distance for a batch of equal-size cost matrices, restricted to a Sakoe-Chiba
+    band around the (length-scaled) diagonal. Cells on one anti-diagonal only depend
+    on the two previous anti-diagonals, so each step is one vectorized update over
+    the whole batch.
+    Args:
+        costs: (B, N, M) array from cost_matrices().
+    Returns:
+        (B,) array of accumulated path costs.
+    """
+    batch, n, m = costs.shape
+    radius = band_radius(n, m, band_ratio)
+    acc = np.full((batch, n + 1, m + 1), np.inf)
+    acc[:, 0, 0] = 0.0
+    for k in range(2, n + m + 1):
+        i = np.arange(max(1, k - m), min(n, k - 1) + 1)
+        j = k - i
+        in_band = np.abs(j - i * (m / n)) <= radius
+        i, j = i[in_band], j[in_band]
+        if not len(i):
+            continue
+        best_prev = np.minimum(np.minimum(acc[:, i - 1, j - 1], acc[:, i - 1, j]), acc[:, i, j - 1])
+        acc[:, i, j] = costs[:, i - 1, j - 1] + best_prev
+    return acc[:, n, m]
+
+
+class _TemplateGroup:
+    """All templates of one action that have the same length, stacked for vectorized bounds."""
+    __slots__ = ("indices", "data", "max_accel", "avg_accel", "windows")
+
+    def __init__(self, indices, data):
+        self.indices = indices # Index of each template in the action's template list
+        self.data = data # (K, m, 6)
+        features = np.array([template_features(template) for template in data]).reshape(-1, 2)
+        self.max_accel = features[:, 0]
+        self.avg_accel = features[:, 1]
+        self.windows = {} # query length n -> (lo, hi, lower envelope (K, n, 6), upper envelope (K, n, 6))
+
+    @property
+    def length(self):
+        return self.data.shape[1]
+
+
+class TemplateLibrary:
+    """
+    Templates per action, with what nearest-template queries need precomputed: the
+    normalizers of every template and, per query length, the band and the templates'
+    min/max envelopes over it. Thread-safe; add() swaps in rebuilt groups so running
+    queries keep a consistent view.
+    """
+
+    def __init__(self, templates=None, band_ratio=DEFAULT_BAND_RATIO, config=None):
+        self.band_ratio = band_ratio
+        # A calibrated config may carry a "revision" besides the scoring constants
+        self.config = dict(DEFAULT_SCORING_CONFIG, **(config or {}))
+        self._lock = threading.Lock()
+        self._templates = {} # action -> [(T, 6) array, ...]
+        self._groups = {} # action -> [_TemplateGroup, ...] by template length
+        # How nearest() got through the templates; the ratios show how well pruning works
+        self.stats = {"queries": 0, "lb_kim_pruned": 0, "lb_keogh_pruned": 0, "dtw_completed": 0}
+        for action, sequences in (templates or {}).items():
+            self._templates[action] = [to_sequence(template) for template in sequences]
+            self._groups[action] = self._build_groups(self._templates[action])
+
+    @classmethod
+    def from_file(cls, file_path=TEMPLATES_FILE_PATH, **kwargs):
+        return cls(load_templates(file_path), **kwargs)
+
+    @property
+    def actions(self):
+        return list(self._templates)
+
+    def templates(self, action):
+        return list(self._templates.get(action, []))
+
+    def counts(self):
+        """Number of templates per action."""
+        return {action: len(templates) for action, templates in self._templates.items()}
+
+    def add(self, action, samples):
+        """
+        Adds a recorded template (any format to_sequence() accepts) to an action.
+        Returns:
+            int: The new template's index within the action.
+        Raises:
+            ValueError: If the template has no samples.
+        """
+        template = to_sequence(samples)
+        if len(template) == 0:
+            raise ValueError("template has no samples")
+        with self._lock:
+            templates = self._templates.get(action, []) + [template]
+            groups = self._build_groups(templates)
+            self._templates[action] = templates
+            self._groups[action] = groups
+            return len(templates) - 1
+
+    def save(self, file_path=TEMPLATES_FILE_PATH):
+        """Writes every template to the templates JSON file (temp file + atomic rename)."""
+        with self._lock:
+            data = {
+                "version": 1,
+                "fields": list(SAMPLE_FIELDS),
+                "templates": {action: [np.round(template, 4).tolist() for template in templates]
+                              for action, templates in self._templates.items()},
+            }
+        tmp_path = file_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+
+    def nearest(self, action, samples):
+        """Nearest template of `action` for one attempt; see nearest_batch()."""
+        return self.nearest_batch(action, [samples])[0]
+
+    def nearest_batch(self, action, attempts):
+        """
+        Finds, for every attempt, the template of `action` with the smallest normalized DTW distance.
+
+        Every (attempt, template) pair first gets a lower bound (the larger of LB_Kim and
+        LB_Keogh). Each attempt's lowest-bound template is scored first; its distance rules
+        out every template whose bound is no smaller. The pairs left over from the whole
+        batch are then scored together with dtw_batch().
+        Returns:
+            list: (normalized distance, template index) per attempt, in input order;
+                  None for an empty attempt.
+        Raises:
+            KeyError: If the action has no templates.
+        """
+        groups = self._groups[action]
+        queries = [to_sequence(samples) for samples in attempts]
+        results = [None] * len(queries)
+        stats = dict.fromkeys(self.stats, 0)
+        stats["queries"] = len(queries)
+
+        candidates = {attempt: self._candidates(groups, query) for attempt, query in enumerate(queries) if len(query)}
+        first = [(attempt, group, k) for attempt, ((_bound, _kim, group, k), *_rest) in candidates.items()]
+        for (attempt, group, k), distance in zip(first, self._dtw_pairs(queries, first)):
+            results[attempt] = (distance, group.indices[k])
+
+        survivors = []
+        for attempt, (_first, *rest) in candidates.items():
+            best = results[attempt][0]
+            for bound, kim_bound, group, k in rest:
+                if bound < best:
+                    survivors.append((attempt, group, k))
+                else:
+                    stats["lb_kim_pruned" if kim_bound >= best else "lb_keogh_pruned"] += 1
+        for (attempt, group, k), distance in zip(survivors, self._dtw_pairs(queries, survivors)):
+            if distance < results[attempt][0]:
+                results[attempt] = (distance, group.indices[k])
+        stats["dtw_completed"] = len(first) + len(survivors)
+
+        with self._lock:
+            for key, value in stats.items():
+                self.stats[key] += value
+        return results
+
+    def _candidates(self, groups, query):
+        """(bound, LB_Kim bound, group, k) for every template, lowest bound first. Bounds are normalized like distances."""
+        n = len(query)
+        candidates = []
+        for group in groups:
+            _lo, _hi, lower, upper = self._window(group, n)
+            scale = group.length * group.avg_accel # Same normalization as the distance
+
+            # LB_Kim: every path starts at the first pair of samples and ends at the last pair
+            kim = sample_costs(query[0] - group.data[:, 0], group.max_accel, self.config)
+            if n > 1 or group.length > 1:
+                kim = kim + sample_costs(query[-1] - group.data[:, -1], group.max_accel, self.config)
+
+            # LB_Keogh: each query sample is at least as far as the box its band window spans
+            gap = np.maximum(lower - query, 0) + np.maximum(query - upper, 0)
+            keogh = sample_costs(gap, group.max_accel[:, None], self.config).sum(axis=1)
+
+            kim_norm = kim / scale
+            bound_norm = np.maximum(kim_norm, keogh / scale)
+            candidates.extend(zip(bound_norm.tolist(), kim_norm.tolist(), [group] * len(group.indices),
+                                  range(len(group.indices))))
+        candidates.sort(key=lambda candidate: candidate[0])
+        return candidates
+
+    def _dtw_pairs(self, queries, pairs):
+        """Normalized DTW distance of (attempt, group, k) pairs, batched by (attempt length, template length)."""
+        distances = np.empty(len(pairs))
+        by_shape = {}
+        for position, (attempt, group, _k) in enumerate(pairs):
+            by_shape.setdefault((len(queries[attempt]), group.length), []).append(position)
+        for positions in by_shape.values():
+            for start in range(0, len(positions), DTW_BATCH_PAIRS):
+                chunk = positions[start:start + DTW_BATCH_PAIRS]
+                chunk_pairs = [pairs[position] for position in chunk]
+                query_stack = np.stack([queries[attempt] for attempt, _group, _k in chunk_pairs])
+                template_stack = np.stack([group.data[k] for _attempt, group, k in chunk_pairs])
+                max_accel = np.array([group.max_accel[k] for _attempt, group, k in chunk_pairs])
+                scale = np.array([group.length * group.avg_accel[k] for _attempt, group, k in chunk_pairs])
+                costs = cost_matrices(query_stack, template_stack, max_accel, self.config)
+                distances[chunk] = dtw_batch(costs, self.band_ratio) / scale
+        return distances.tolist()
+
+    def _build_groups(self, templates):
+        by_length = {}
+        for index, template in enumerate(templates):
+            by_length.setdefault(len(template), []).append(index)
+        return [_TemplateGroup(indices, np.stack([templates[index] for index in indices]))
+                for indices in by_length.values()]
+
+    def _window(self, group, n):
+        """Band and envelopes for queries of length n, computed once per length."""
+        window = group.windows.get(n)
+        if window is None:
+            lo, hi = band_window(n, group.length, self.band_ratio)
+            lower = np.stack([group.data[:, lo[i]:hi[i] + 1].min(axis=1) for i in range(n)], axis=1)
+            upper = np.stack([group.data[:, lo[i]:hi[i] + 1].max(axis=1) for i in range(n)], axis=1)
+            window = group.windows[n] = (lo, hi, lower, upper)
+        return window
+
+
+class GestureMatcher:
+    """
+    Scores recorded attempts against the templates of an action. Without `config` the
+    calibrated scoring file is used if there is one (see load_scoring_config()). Without
+    `templates` they are loaded from `file_path`, where add_templates() saves them.
+    """
+
+    def __init__(self, templates=None, band_ratio=DEFAULT_BAND_RATIO, config=None, library=None,
+                 file_path=TEMPLATES_FILE_PATH):
+        if library is None:
+            if config is None:
+                config = load_scoring_config()
+            library = TemplateLibrary(templates if templates is not None else load_templates(file_path), band_ratio,
+                                      config)
+        self.library = library
+        self.file_path = file_path
+        self.config = library.config
+
+    @property
+    def actions(self):
+        return self.library.actions
+
+    def has_action(self, action):
+        """True if the action has templates (a method, so it also works through message_hub.RemoteProxy)."""
+        return action in self.library.actions
+
+    def template_info(self):
+        """Template counts per action, the library's pruning stats and the scoring revision in use."""
+        return {'counts': self.library.counts(), 'stats': dict(self.library.stats),
+                'scoring_revision': self.config.get('revision')}
+
+    def add_templates(self, action, recordings):
+        """
+        Adds recorded templates to an action and saves the library to the matcher's file_path.
+        Returns:
+            dict: 'action', 'added' (the new templates' indices) and 'counts'.
+        Raises:
+            ValueError: If a recording has no samples (nothing is added then).
+        """
+        recordings = [to_sequence(samples) for samples in recordings]
+        if any(len(samples) == 0 for samples in recordings):
+            raise ValueError("A recording has no samples")
+        indices = [self.library.add(action, samples) for samples in recordings]
+        self.library.save(self.file_path)
+        return {'action': action, 'added': indices, 'counts': self.library.counts()}
+
+    def score(self, action, samples):
+        """Scores one attempt. See score_batch() for the result format."""
+        return self.score_batch(action, [samples])[0]
+
+    def score_batch(self, action, attempts):
+        """
+        Scores many attempts of one action in one call.
+        Returns:
+            list: One dict per attempt with 'matchPercentage', 'level', 'distance' and
+                  'template_index' (the best matching template), in input order.
+        Raises:
+            KeyError: If there are no templates for the action.
+        """
+        if action not in self.library.actions:
+            raise KeyError(action)
+        results = []
+        for nearest in self.library.nearest_batch(action, attempts):
+            if nearest is None:
+                results.append({"matchPercentage": 50, "level": "数据不足", "distance": None, "template_index": None})
+                continue
+            distance, template_index = nearest
+            percentage = self.percentage(distance)
+            results.append({
+                "matchPercentage": percentage,
+                "level": self.level(percentage),
+                "distance": float(distance),
+                "template_index": template_index,
+            })
+        return results
+
+    def percentage(self, normalized_distance):
+        return match_percentage(normalized_distance, self.config)
+
+    def level(self, percentage):
+        return match_level(percentage, self.config)
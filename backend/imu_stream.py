@@ -0,0 +1,264 @@
+# imu_stream.py
+# Streaming ingestion of MPU6050 samples from the glove, with automatic gesture segmentation.
+#
+# Instead of recording a fixed 20 samples from the moment recording is armed (gesture.js
+# MAX_SAMPLES), samples are appended to a preallocated ring buffer as they arrive and an
+# online segmenter watches the motion energy: a gesture starts when the energy stays above
+# a start threshold and ends when it stays below a (lower) end threshold. Only that window,
+# plus a little pre-roll, is scored, so idle frames before and after the motion no longer
+# pad the comparison.
+#
+# Accepted sample encodings:
+#   - binary: little-endian float32, 6 per sample (ax, ay, az, gx, gy, gz), 24 bytes each
+#   - text:   the ESP32's 'ax:10.01,ay:-0.69,az:3.05,gx:-0.44,gy:0.33,gz:-0.94' records,
+#             one per line (or separated by ';')
+#   - anything gesture_matching.to_sequence() accepts (rows, flat or nested dicts)
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from gesture_matching import SAMPLE_FIELDS, to_sequence
+
+BINARY_SAMPLE_DTYPE = np.dtype('<f4')
+BINARY_SAMPLE_SIZE = 6 * BINARY_SAMPLE_DTYPE.itemsize # 24 bytes
+
+
+def parse_binary_samples(data):
+    """
+    Decodes packed little-endian float32 samples into an (N, 6) array.
+    Raises:
+        ValueError: If the payload is not a whole number of samples.
+    """
+    if len(data) % BINARY_SAMPLE_SIZE:
+        raise ValueError(f"binary payload of {len(data)} bytes is not a multiple of {BINARY_SAMPLE_SIZE}")
+    return np.frombuffer(data, dtype=BINARY_SAMPLE_DTYPE).astype(np.float64).reshape(-1, 6)
+
+
+def parse_text_samples(text):
+    """
+    Parses 'ax:..,ay:..,az:..,gx:..,gy:..,gz:..' records into an (N, 6) array.
+    Missing fields count as 0, like gesture.js. Blank records are skipped.
+    Raises:
+        ValueError: If a value is not a number.
+    """
+    rows = []
+    for record in text.replace(';', '\n').splitlines():
+        record = record.strip()
+        if not record:
+            continue
+        values = {}
+        for part in record.split(','):
+            key, _, value = part.partition(':')
+            values[key.strip()] = float(value)
+        rows.append([values.get(field, 0.0) for field in SAMPLE_FIELDS])
+    return np.asarray(rows, dtype=np.float64).reshape(-1, 6)
+
+
+def parse_samples(payload):
+    """Decodes any supported encoding (bytes = binary, str = text, else JSON-style samples)."""
+    if isinstance(payload, (bytes, bytearray, memoryview)):
+        return parse_binary_samples(bytes(payload))
+    if isinstance(payload, str):
+        return parse_text_samples(payload)
+    return to_sequence(payload)
+
+
+class IMURingBuffer:
+    """
+    Fixed-size buffer of the most recent samples. Every sample gets a sequence number
+    (0, 1, 2, ...) so windows can be addressed even after the buffer has wrapped.
+    """
+
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self._samples = np.zeros((capacity, 6))
+        self._timestamps = np.zeros(capacity)
+        self.total = 0 # Samples ever appended; the next sample's sequence number
+
+    @property
+    def oldest(self):
+        """Sequence number of the oldest sample still in the buffer."""
+        return max(0, self.total - self.capacity)
+
+    def extend(self, samples, timestamp=None):
+        """Appends an (N, 6) array. Returns the sequence number of its first sample."""
+        first = self.total
+        count = len(samples)
+        if count > self.capacity: # Only the newest samples fit
+            samples = samples[-self.capacity:]
+            self.total += count - self.capacity
+            count = self.capacity
+        positions = np.arange(self.total, self.total + count) % self.capacity
+        self._samples[positions] = samples
+        self._timestamps[positions] = time.time() if timestamp is None else timestamp
+        self.total += count
+        return first
+
+    def window(self, start, end):
+        """Copy of samples [start, end) (sequence numbers), clipped to what is still buffered."""
+        start = max(start, self.oldest)
+        end = min(end, self.total)
+        if end <= start:
+            return np.zeros((0, 6))
+        return self._samples[np.arange(start, end) % self.capacity]
+
+    def clear(self):
+        self.total = 0
+
+
+class GestureSegmenter:
+    """
+    Online start/end detection with hysteresis.
+
+    Motion energy per sample is the standard deviation of |accel| over the last
+    `energy_window` samples (gravity cancels out) plus `gyro_weight` times the mean |gyro|
+    over the same samples. A gesture starts after `start_samples` consecutive samples at
+    or above `start_threshold` and ends after `end_samples` consecutive samples below
+    `end_threshold`, or when it reaches `max_samples`.
+    """
+    DEFAULT_START_THRESHOLD = 0.6
+    DEFAULT_END_THRESHOLD = 0.3
+
+    def __init__(self, start_threshold=DEFAULT_START_THRESHOLD, end_threshold=DEFAULT_END_THRESHOLD,
+                 energy_window=5, gyro_weight=0.5, start_samples=2, end_samples=4,
+                 pre_roll=3, min_samples=8, max_samples=200):
+        self.start_threshold = start_threshold
+        self.end_threshold = min(end_threshold, start_threshold)
+        self.energy_window = energy_window
+        self.gyro_weight = gyro_weight
+        self.start_samples = start_samples
+        self.end_samples = end_samples
+        self.pre_roll = pre_roll
+        self.min_samples = min_samples
+        self.max_samples = max_samples
+        self.reset()
+
+    def reset(self):
+        self.active = False
+        self.start = None # Sequence number of the current gesture's first sample
+        self._above = 0
+        self._below = 0
+
+    def energy(self, buffer, seq):
+        window = buffer.window(seq - self.energy_window + 1, seq + 1)
+        accel = np.linalg.norm(window[:, :3], axis=1)
+        gyro = np.linalg.norm(window[:, 3:], axis=1)
+        return float(accel.std() + self.gyro_weight * gyro.mean())
+
+    def update(self, buffer, first, count):
+        """
+        Advances over samples [first, first + count) of `buffer`.
+        Returns:
+            list: (start, end) sequence ranges of gestures that ended within these samples.
+        """
+        segments = []
+        for seq in range(first, first + count):
+            energy = self.energy(buffer, seq)
+            if not self.active:
+                self._above = self._above + 1 if energy >= self.start_threshold else 0
+                if self._above >= self.start_samples:
+                    self.active = True
+                    self.start = max(buffer.oldest, seq - self._above + 1 - self.pre_roll)
+                    self._below = 0
+                continue
+
+            self._below = self._below + 1 if energy < self.end_threshold else 0
+            length = seq + 1 - self.start
+            if self._below >= self.end_samples or length >= self.max_samples:
+                end = seq + 1 - self._below if self._below >= self.end_samples else seq + 1
+                if end - self.start >= self.min_samples:
+                    segments.append((self.start, end))
+                self.reset()
+        return segments
+
+
+class IMUStream:
+    """One glove's stream: ring buffer + segmenter, scoring each detected gesture."""
+
+    def __init__(self, matcher, capacity=1024, **segmenter_options):
+        self.matcher = matcher
+        self.buffer = IMURingBuffer(capacity)
+        segmenter_options.setdefault('max_samples', capacity // 2) # A gesture must still be buffered when it ends
+        self.segmenter = GestureSegmenter(**segmenter_options)
+        self.lock = threading.Lock()
+
+    def feed(self, samples, action=None):
+        """
+        Appends decoded samples and scores every gesture that ended within them.
+        Returns:
+            list: One dict per detected gesture: 'start', 'end', 'samples' and, if `action`
+                  is given, the matcher's score fields.
+        """
+        with self.lock:
+            first = self.buffer.extend(samples)
+            first = max(first, self.buffer.oldest)
+            segments = self.segmenter.update(self.buffer, first, self.buffer.total - first)
+            windows = [(start, end, self.buffer.window(start, end)) for start, end in segments]
+
+        results = []
+        for start, end, window in windows:
+            result = {"start": start, "end": end, "samples": len(window)}
+            if action is not None:
+                result.update(self.matcher.score(action, window))
+            results.append(result)
+        return results
+
+    def state(self):
+        with self.lock:
+            return {
+                "recording": self.segmenter.active,
+                "gesture_start": self.segmenter.start,
+                "received": self.buffer.total,
+            }
+
+    def reset(self):
+        with self.lock:
+            self.buffer.clear()
+            self.segmenter.reset()
+
+
+class IMUStreams:
+    """
+    IMUStream per session id, least recently used evicted beyond `max_streams`.
+    feed() / state() / reset() take the session id, so the streams can be shared
+    through message_hub.RemoteProxy.
+    """
+
+    def __init__(self, matcher, max_streams=32, on_samples=None, **stream_options):
+        self.matcher = matcher
+        self.max_streams = max_streams
+        self.on_samples = on_samples # Called with every non-empty batch fed, e.g. CaptureWriter.imu
+        self.stream_options = stream_options
+        self._streams = OrderedDict()
+        self._lock = threading.Lock()
+
+    def feed(self, session_id, samples, action=None):
+        """
+        Feeds decoded samples into the session's stream.
+        Returns:
+            dict: The stream's state() plus 'segments' (see IMUStream.feed()).
+        """
+        if self.on_samples is not None and len(samples):
+            self.on_samples(samples)
+        stream = self.get(session_id)
+        segments = stream.feed(samples, action)
+        return dict(stream.state(), segments=segments)
+
+    def state(self, session_id):
+        return self.get(session_id).state()
+
+    def reset(self, session_id):
+        self.get(session_id).reset()
+
+    def get(self, session_id):
+        with self._lock:
+            stream = self._streams.get(session_id)
+            if stream is None:
+                stream = self._streams[session_id] = IMUStream(self.matcher, **self.stream_options)
+                while len(self._streams) > self.max_streams:
+                    self._streams.popitem(last=False)
+            else:
+                self._streams.move_to_end(session_id)
+            return stream
@@ -1,29 +1,90 @@
 # backend/main_server.py
+import contextlib
 import os
-from flask import Flask, send_from_directory, request
-from flask_socketio import SocketIO, emit
 import threading
 import time
 
+import serial
+from flask import Flask, Response, request
+from flask_socketio import SocketIO, emit, join_room, leave_room
+
 # Adjust the import path if rfid_reader and epc_mappings are in the same directory (backend)
 # For example, if main_server.py is in 'backend' and rfid_reader.py is also in 'backend'
-from rfid_reader import RFIDReader
-from epc_mappings import get_name_for_epc
-import json
-
-
-app = Flask(__name__, static_folder='../frontend/assets')
+from reader_manager import ReaderManager, load_reader_config
+from presence_tracker import PresenceTracker
+from scan_status_store import ScanStatusStore, DEFAULT_SESSION
+from static_assets import StaticAssetServer
+from stage_manifest import build_stage_manifest, preload_link_header
+from capture_log import CaptureWriter
+from fake_serial import serial_factory_from_env
+from imu_stream import IMUStreams, parse_samples
+from gesture_matching import GestureMatcher, to_sequence
+from epc_mappings import get_name_for_epc, CATALOG as epc_catalog
+from event_bus import EventBus, room_for
+from event_log import EventLog
+from message_hub import HubClient, LocalPubSubManager, RemoteProxy, parse_address
+from rf_calibration import (calibrate, load_calibrations, resolve_known_tags, save_calibration, validate_rf_settings,
+                            DEFAULT_DWELL, DEFAULT_POWERS, DEFAULT_Q_VALUES)
+import metrics
+
+
+# Flask's own static route is disabled; StaticAssetServer serves the whole frontend
+# (including /assets) with ETags, Range support, hashed URLs and precompression.
+app = Flask(__name__, static_folder=None)
 # Use a secret key for session management, although not strictly necessary for this specific SocketIO setup
 app.config['SECRET_KEY'] = 'your_very_secret_key_here!'
-socketio = SocketIO(app, cors_allowed_origins="*") # Allow all origins for simplicity in development
+
+# --- Server role ---
+# `python main_server.py` runs everything in one process (development). serve.py runs the
+# production layout instead and sets SERVER_ROLE for each process it starts:
+#   reader - owns the serial ports, presence tracking and scan progress, and hosts the
+#            message hub at RFID_HUB_ADDRESS;
+#   worker - serves HTTP/Socket.IO and calls the reader process through the hub.
+# Emits and room membership are shared between the processes through the hub.
+SERVER_ROLE = os.environ.get('SERVER_ROLE', '')
+client_manager = None
+hub_client = None # Set in workers; scan controls and progress then live in the reader process
+if SERVER_ROLE:
+    hub_address = parse_address(os.environ['RFID_HUB_ADDRESS'])
+    hub_authkey = bytes.fromhex(os.environ['RFID_HUB_AUTHKEY'])
+    client_manager = LocalPubSubManager(hub_address, hub_authkey, write_only=(SERVER_ROLE == 'reader'))
+    if SERVER_ROLE == 'worker':
+        hub_client = HubClient(hub_address, hub_authkey)
+socketio = SocketIO(app, cors_allowed_origins="*", # Allow all origins for simplicity in development
+                    client_manager=client_manager, async_mode=os.environ.get('SOCKETIO_ASYNC_MODE') or None)
 
 # --- RFID Scanner Setup ---
-# Use the COM port defined in rfid_reader.py or specify one here
-# Ensure this COM port is correct for your RFID reader
-rfid_reader_instance = RFIDReader(port="COM4")
-scanning_thread = None
-stop_scanning_event = threading.Event()
-is_scanning_active = False # Global flag to track if scanning is active
+# Readers (one per pedestal / antenna) and their COM ports are listed in data/readers.json;
+# without that file a single reader on COM4 is used. Ensure the COM ports are correct.
+# RFID_REPLAY=<capture file> runs against a recorded session instead of the readers
+# (RFID_REPLAY_SPEED: 1 = real time, 0 = as fast as possible). RFID_CAPTURE=<file>
+# records the readers' serial traffic and the glove samples for later replay.
+# Calibrated transmit power / Q per reader (data/rf_calibration.json) are applied on connect.
+READERS_FILE_PATH = os.path.join(os.path.dirname(__file__), 'data', 'readers.json')
+# Under serve.py only the reader process records (workers would interleave into the same file).
+capture_writer = CaptureWriter(os.environ['RFID_CAPTURE']) \
+    if os.environ.get('RFID_CAPTURE') and SERVER_ROLE != 'worker' else None
+# Each reader runs in its own engine (start()/stop() are thread-safe), so an unplugged
+# reader never stalls the others; reads are merged and de-duplicated across readers.
+reader_manager = ReaderManager.from_config(load_reader_config(READERS_FILE_PATH),
+                                           serial_factory=lambda index: serial_factory_from_env(capture_writer, index),
+                                           calibrations=load_calibrations())
+# Sits between the engine and Socket.IO so clients only hear about transitions
+# (tag_arrived / tag_left / rssi_changed), not every raw read.
+presence_tracker = PresenceTracker()
+# Presence events reach clients in binary batches every EVENT_BUS_TICK seconds, and only
+# clients subscribed to one of the event's topics get them (see event_topics()).
+event_bus = EventBus(socketio.emit, sleep=socketio.sleep,
+                     tick=float(os.environ.get('EVENT_BUS_TICK', EventBus.DEFAULT_TICK)))
+MAX_SUBSCRIPTIONS = 32 # Topics per subscribe request
+# --- Metrics (served on /metrics; reader, decoder and status store metrics live in their modules) ---
+EVENTS_EMITTED = metrics.counter("socketio_events_emitted_total", "Socket.IO events broadcast by the server.", ["event"])
+CONNECTED_CLIENTS = metrics.gauge("socketio_connected_clients", "Currently connected Socket.IO clients.")
+metrics.gauge("rfid_engine_queue_depth", "Reader events waiting for the consumer.", function=reader_manager.queue_depth)
+metrics.gauge("rfid_engine_running", "1 while any reader is scanning.", function=lambda: int(reader_manager.is_running))
+
+PRESENCE_SWEEP_INTERVAL = 0.25 # seconds between checks for tags that have left the field
+background_tasks_started = False
 
 # --- Scan Status Management ---
 SCAN_STATUS_FILENAME = "scanned_tags_status.json"
@@ -37,75 +98,169 @@ TARGET_TAGS_FOR_COMPLETION = {
     "monitor": "monitor_completed"
 }
 
-def initialize_scan_status_file():
-    os.makedirs(DATA_DIR, exist_ok=True) # Ensure data directory exists
-    if not os.path.exists(SCAN_STATUS_FILE_PATH):
-        print(f"'{SCAN_STATUS_FILE_PATH}' not found. Initializing a new one.")
-        default_status = {key: False for key in TARGET_TAGS_FOR_COMPLETION.values()}
-        save_scan_status(default_status)
-    else:
-        # Verify existing file content
-        try:
-            status = load_scan_status()
-            # Check if all expected keys are present
-            if not all(key in status for key in TARGET_TAGS_FOR_COMPLETION.values()):
-                print("Scan status file is missing keys. Re-initializing.")
-                default_status = {key: False for key in TARGET_TAGS_FOR_COMPLETION.values()}
-                save_scan_status(default_status)
-        except json.JSONDecodeError:
-            print("Scan status file is corrupted. Re-initializing.")
-            default_status = {key: False for key in TARGET_TAGS_FOR_COMPLETION.values()}
-            save_scan_status(default_status)
-
-def load_scan_status():
+# Progress lives in memory, one document per session (booth / visitor); the store
+# persists it to SCAN_STATUS_FILE_PATH in the background (debounced, temp file +
+# fsync + atomic rename) and evicts sessions that have been idle for a while.
+if hub_client is None:
+    scan_status_store = ScanStatusStore(SCAN_STATUS_FILE_PATH, TARGET_TAGS_FOR_COMPLETION.values())
+else:
+    scan_status_store = RemoteProxy(hub_client, 'scan_status_store') # One store for all workers
+
+# --- Event Log ---
+# Every tag read and every reset / completed item is appended to data/event_log (see
+# event_log.py) for the /api/analytics queries. Appends only queue the record.
+EVENT_LOG_DIR = os.path.join(DATA_DIR, 'event_log')
+if hub_client is None:
+    event_log = EventLog(EVENT_LOG_DIR)
+else:
+    event_log = RemoteProxy(hub_client, 'event_log') # Written by the reader process only
+
+def get_request_session_id(data=None):
+    """Session id from the JSON body, query string or X-Session-Id header; DEFAULT_SESSION if none."""
+    session_id = (data or {}).get('session_id') or request.args.get('session_id') or request.headers.get('X-Session-Id')
+    return str(session_id) if session_id else DEFAULT_SESSION
+
+# --- Gesture Scoring ---
+# Stage 4 attempts are scored here with DTW against data/gesture_templates.json,
+# so a gesture done at a different speed than the reference still matches. Each
+# action can have many templates; new recordings are added via /api/gesture/templates.
+# Live glove samples, per session: a ring buffer plus a segmenter that finds where each
+# gesture starts and ends, so only the motion itself is scored.
+# Under serve.py both live in the reader process: a template upload reaches every
+# worker, and a glove's batches all land in one buffer whichever worker receives them.
+if hub_client is None:
+    gesture_matcher = GestureMatcher()
+    imu_streams = IMUStreams(gesture_matcher, on_samples=capture_writer.imu if capture_writer is not None else None)
+else:
+    gesture_matcher = RemoteProxy(hub_client, 'gesture_matcher')
+    imu_streams = RemoteProxy(hub_client, 'imu_streams')
+
+def score_gesture_request(data):
+    """
+    Scores {'action', 'samples'} (one attempt) or {'action', 'attempts'} (a list of them).
+    Returns:
+        tuple: (response dict, HTTP status code)
+    """
+    action = data.get('action')
+    if not gesture_matcher.has_action(action):
+        return {'error': f'Unknown action: {action}'}, 400
+    attempts = data.get('attempts')
+    if attempts is None:
+        if data.get('samples') is None:
+            return {'error': 'samples or attempts not provided'}, 400
+        attempts = [data['samples']]
+    try:
+        attempts = [to_sequence(samples) for samples in attempts] # Rejected here rather than in the reader process
+    except (TypeError, ValueError) as e:
+        return {'error': f'Invalid samples: {e}'}, 400
+    results = gesture_matcher.score_batch(action, attempts)
+    if 'attempts' in data:
+        return {'action': action, 'results': results}, 200
+    return dict(results[0], action=action), 200
+
+def ingest_imu_samples(payload, action, session_id):
+    """
+    Feeds one batch (binary, text or JSON samples) into the session's stream.
+    Returns:
+        tuple: (response dict, HTTP status code)
+    """
+    if action is not None and not gesture_matcher.has_action(action):
+        return {'error': f'Unknown action: {action}'}, 400
     try:
-        with open(SCAN_STATUS_FILE_PATH, 'r') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        print(f"Warning: Scan status file '{SCAN_STATUS_FILE_PATH}' not found during load. Initializing.")
-        initialize_scan_status_file() # Initialize if not found
-        return {key: False for key in TARGET_TAGS_FOR_COMPLETION.values()} # Return default after init
-    except json.JSONDecodeError as e:
-        print(f"Error decoding JSON from '{SCAN_STATUS_FILE_PATH}': {e}. Re-initializing file.")
-        initialize_scan_status_file() # Re-initialize if corrupted
-        return {key: False for key in TARGET_TAGS_FOR_COMPLETION.values()} # Return default after init
-
-def save_scan_status(status_data):
-    # Calculate all_completed status based on the individual items
-    # TARGET_TAGS_FOR_COMPLETION must be accessible here (it's global in the script)
-    all_items_done = all(status_data.get(key, False) for key in TARGET_TAGS_FOR_COMPLETION.values())
-    status_data['all_completed'] = all_items_done # Add/update the all_completed key
-
-    with open(SCAN_STATUS_FILE_PATH, 'w') as f:
-        json.dump(status_data, f, indent=4)
-    print(f"Scan status saved. File now contains all_completed: {all_items_done}")
-
-def check_all_completed(status_data):
-    return all(status_data.get(key, False) for key in TARGET_TAGS_FOR_COMPLETION.values())
+        samples = parse_samples(payload)
+    except (TypeError, ValueError) as e:
+        return {'error': f'Invalid samples: {e}'}, 400
+    result = imu_streams.feed(session_id, samples, action)
+    return dict(result, session_id=session_id, accepted=len(samples)), 200
 
 # --- Frontend Serving ---
+FRONTEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'frontend')
+asset_server = StaticAssetServer(FRONTEND_DIR)
+
 @app.route('/')
 def index():
     # Serves index.html from the frontend directory
-    return send_from_directory('../frontend', 'index.html')
+    return asset_server.send('index.html')
+
+@app.route('/asset-manifest.json')
+def asset_manifest():
+    # Maps every frontend file to its content-hashed URL (served with Cache-Control: immutable)
+    return asset_server.manifest()
+
+@app.route('/api/preload_manifest')
+def preload_manifest():
+    # ?stage=<currentStage>: that stage's media plus everything the next stage(s) need,
+    # with a Link: rel=preload header for the latter. Without a stage: all stages.
+    stage = request.args.get('stage')
+    if stage is not None and not stage.strip():
+        return {'error': 'stage must not be empty'}, 400
+    manifest = build_stage_manifest(asset_server, stage)
+    if manifest is None:
+        return {'error': f'Unknown stage: {stage}'}, 404
+    headers = {}
+    if stage:
+        link_header = preload_link_header(manifest)
+        if link_header:
+            headers['Link'] = link_header
+    return manifest, 200, headers
+
+@app.route('/api/readers')
+def readers_route():
+    # Per-reader port, state, read/suppressed/error counters and poll rate
+    return {'readers': reader_status()}
+
+@app.route('/api/readers/<reader_id>/rf', methods=['GET'])
+def get_reader_rf_route(reader_id):
+    # Reads power, region, channel and Q from the reader (it must not be scanning)
+    return reader_rf_settings(reader_id)
+
+@app.route('/api/readers/<reader_id>/rf', methods=['POST'])
+def set_reader_rf_route(reader_id):
+    # {'power_dbm', 'q', 'region', 'channel', 'hopping'} (any subset), plus 'save': true to keep them
+    data = dict(request.get_json(silent=True) or {})
+    save = bool(data.pop('save', False))
+    return tune_reader(reader_id, data, save)
+
+@app.route('/api/readers/<reader_id>/calibration', methods=['POST'])
+def start_calibration_route(reader_id):
+    return start_calibration(reader_id, request.get_json(silent=True) or {})
+
+@app.route('/api/readers/<reader_id>/calibration', methods=['GET'])
+def calibration_status_route(reader_id):
+    return calibration_status(reader_id)
+
+@app.route('/api/readers/<reader_id>/calibration', methods=['DELETE'])
+def cancel_calibration_route(reader_id):
+    return cancel_calibration(reader_id)
+
+@app.route('/api/epc_catalog')
+def epc_catalog_route():
+    # Rule counts and load time of the EPC catalog (reloaded automatically when its file changes)
+    return epc_catalog.stats()
+
+@app.route('/metrics')
+def metrics_route():
+    # Prometheus text format
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/metrics/reader')
+def reader_metrics_route():
+    # Under serve.py the reader, decoder and presence metrics are in the reader process
+    text = metrics.REGISTRY.render() if hub_client is None else hub_client.call('metrics.render')
+    return Response(text, content_type=metrics.CONTENT_TYPE)
 
 @app.route('/<path:path>')
 def serve_static_files(path):
     # Serves other static files (css, js, assets) from the frontend directory
-    if path.startswith('assets/'):
-        return send_from_directory('../frontend/assets', path.replace('assets/', '', 1))
-    # Serve other files like .js, .css from ../frontend
-    if path.endswith(('.js', '.css', '.json', '.ico', '.png', '.jpg', '.mp4', '.webm', '.ogg')): # Add other file types if needed
-         return send_from_directory('../frontend', path)
-    # Fallback or specific handling for other paths if necessary
-    return send_from_directory('../frontend', path) # Default for any other path
+    return asset_server.send(path)
 
 
 # --- Scan Status Routes ---
 @app.route('/mark_tag_completed', methods=['POST'])
 def mark_tag_completed():
-    data = request.get_json()
+    data = request.get_json(silent=True) or {}
     tag_name_from_frontend = data.get('tag_name')
+    session_id = get_request_session_id(data)
 
     if not tag_name_from_frontend:
         return {'error': 'tag_name not provided'}, 400
@@ -115,158 +270,442 @@ def mark_tag_completed():
     if not status_key:
         return {'error': f'Unknown tag_name: {tag_name_from_frontend}'}, 400
 
-    current_status = load_scan_status()
-    if current_status.get(status_key) is True:
-        print(f"Tag '{tag_name_from_frontend}' ({status_key}) was already marked as completed.")
+    changed, current_status = scan_status_store.mark_completed(status_key, session_id)
+    if changed:
+        event_log.append_session_event('completed', session_id, tag_name_from_frontend)
+        print(f"Tag '{tag_name_from_frontend}' ({status_key}) marked as completed for session '{session_id}'.")
+        if current_status['all_completed']:
+            # Push to the session's room instead of making its clients poll /get_scan_status
+            EVENTS_EMITTED.labels('all_completed').inc()
+            socketio.emit('all_completed', {'session_id': session_id, 'current_status': current_status}, to=session_id)
     else:
-        current_status[status_key] = True
-        save_scan_status(current_status)
-        print(f"Tag '{tag_name_from_frontend}' ({status_key}) marked as completed.")
+        print(f"Tag '{tag_name_from_frontend}' ({status_key}) was already marked as completed for session '{session_id}'.")
 
-    # After save_scan_status, current_status dictionary in memory now has 'all_completed' updated.
-    # So, we can directly use its value for the response.
-    all_done_for_response = current_status.get('all_completed', False) # Safely get it
-    return {'all_completed': all_done_for_response, 'updated_status': current_status}
+    return {'all_completed': current_status['all_completed'], 'updated_status': current_status}
 
 @app.route('/reset_scan_status', methods=['POST'])
 def reset_scan_status_route():
-    default_status = {key: False for key in TARGET_TAGS_FOR_COMPLETION.values()}
-    save_scan_status(default_status)
-    print("Scan status has been reset.")
+    session_id = get_request_session_id(request.get_json(silent=True))
+    default_status = scan_status_store.reset(session_id)
+    event_log.append_session_event('reset', session_id)
+    print(f"Scan status has been reset for session '{session_id}'.")
     return {'message': 'Scan status reset successfully', 'new_status': default_status}
 
 @app.route('/get_scan_status', methods=['GET'])
 def get_scan_status_route():
-    current_status = load_scan_status()
-    all_done = check_all_completed(current_status)
-    return {'current_status': current_status, 'all_completed': all_done}
+    current_status = scan_status_store.get(get_request_session_id())
+    return {'current_status': current_status, 'all_completed': current_status['all_completed']}
+
+
+# --- Analytics Routes ---
+# Query string: start / end (Unix seconds, default: the last 24 hours), plus
+#   /reads      window (seconds, a multiple of 60; default 3600), reader
+#   /rssi       item, reader
+#   /events     limit (default 1000), epc
+@app.route('/api/analytics/<query>', methods=['GET'])
+def analytics_route(query):
+    return query_event_log(query, request.args.to_dict())
+
+@app.route('/api/analytics/log', methods=['GET'])
+def analytics_log_route():
+    # Segment and record counts of the event log
+    return query_event_log('stats', {})
+
+
+# --- Gesture Scoring Routes ---
+@app.route('/api/gesture/score', methods=['POST'])
+def score_gesture_route():
+    return score_gesture_request(request.get_json(silent=True) or {})
+
+@app.route('/api/gesture/templates', methods=['GET'])
+def get_gesture_templates_route():
+    # scoring_revision: revision of data/gesture_scoring.json in use (None: gesture.js's constants)
+    return gesture_matcher.template_info()
+
+@app.route('/api/gesture/templates', methods=['POST'])
+def add_gesture_templates_route():
+    # {'action', 'samples'} for one recording, or {'action', 'attempts'} for a whole
+    # session from knife_gesture_collector.html (its allTestsData array)
+    data = request.get_json(silent=True) or {}
+    action = data.get('action')
+    if not action:
+        return {'error': 'action not provided'}, 400
+    recordings = data.get('attempts') if data.get('attempts') is not None else [data.get('samples') or []]
+    try:
+        recordings = [to_sequence(samples) for samples in recordings]
+    except (TypeError, ValueError) as e:
+        return {'error': f'Invalid samples: {e}'}, 400
+    if any(len(samples) == 0 for samples in recordings):
+        return {'error': 'A recording has no samples'}, 400 # Reject the batch before adding any of it
+    return gesture_matcher.add_templates(action, recordings)
+
+
+@app.route('/api/imu/stream', methods=['POST'])
+def imu_stream_route():
+    # Body: packed float32 samples (application/octet-stream), ESP32 text records
+    # (text/plain), or JSON {'samples': [...], 'action': ...}. ?action= selects the templates.
+    action = request.args.get('action')
+    if request.is_json:
+        data = request.get_json(silent=True) or {}
+        return ingest_imu_samples(data.get('samples') or [], data.get('action') or action, get_request_session_id(data))
+    if request.mimetype == 'application/octet-stream':
+        payload = request.get_data()
+    else:
+        payload = request.get_data(as_text=True)
+    return ingest_imu_samples(payload, action, get_request_session_id())
 
+@app.route('/api/imu/reset', methods=['POST'])
+def imu_reset_route():
+    session_id = get_request_session_id(request.get_json(silent=True))
+    imu_streams.reset(session_id)
+    return {'session_id': session_id, 'message': 'IMU stream reset'}
 
-# --- RFID Scanning Logic ---
-def rfid_scan_loop():
-    global is_scanning_active
-    print("RFID scan loop thread invoked.") # Changed log slightly
-    if not is_scanning_active:
-        print("RFID scan loop invoked, but is_scanning_active is False. Exiting loop immediately.")
-        return # Exit if not explicitly activated
-    print("RFID scan loop started (is_scanning_active is True).")
-    
-    if not rfid_reader_instance.connect(): # Connect once at the start of the loop
-        print("RFID Reader: Failed to connect in scan loop.")
-        socketio.emit('rfid_error', {'message': 'Failed to connect to RFID reader.'})
-        is_scanning_active = False
-        return
 
+# --- RFID Scanning Logic ---
+# start_scanning / stop_scanning / reader_status run in the process owning the readers;
+# workers forward them through the hub (the reader process registers them as 'server.*').
+def start_scanning():
+    """
+    Starts every reader; presence tracking starts over.
+    Returns:
+        bool: False if scanning was already active.
+    """
+    if hub_client is not None:
+        return hub_client.call('server.start_scanning')
+    ensure_background_tasks()
+    if reader_manager.is_running:
+        return False
+    # Tags still on a pedestal from before the restart are reported as arriving again.
+    presence_tracker.reset()
+    return reader_manager.start(handle_reader_event)
+
+def stop_scanning():
+    """
+    Stops every reader; the engines close the ports within milliseconds.
+    Returns:
+        bool: False if scanning wasn't active.
+    """
+    if hub_client is not None:
+        return hub_client.call('server.stop_scanning')
+    return reader_manager.stop()
+
+def reader_status():
+    if hub_client is not None:
+        return hub_client.call('server.reader_status')
+    return reader_manager.status()
+
+# --- RF Tuning ---
+# Like the scan controls these run where the readers are. A reader must be stopped to be
+# tuned (ReaderManager.exclusive()); calibration sweeps run as background tasks, report
+# progress as 'rf_calibration' events and are kept in calibration_jobs.
+calibration_jobs = {} # reader id -> {'reader_id', 'state' (running/done/failed/cancelled), 'done', 'total', 'result', 'error'}
+calibration_stops = {} # reader id -> threading.Event cancelling its running sweep
+
+def _reader_http_errors(reader_id, action):
+    """Runs action(reader) on a stopped reader. Returns: tuple: (response dict, HTTP status code)"""
+    if reader_id not in reader_manager.readers:
+        return {'error': f"Unknown reader '{reader_id}'"}, 404
     try:
-        while not stop_scanning_event.is_set():
-            # Check connection status before attempting scan; try to reconnect if necessary
-            if not rfid_reader_instance.is_connected:
-                print("RFID Reader: Was disconnected. Attempting to reconnect...")
-                if not rfid_reader_instance.connect():
-                    print("RFID Reader: Reconnect failed. Will try again later.")
-                    socketio.emit('rfid_error', {'message': 'RFID reader disconnected. Attempting to reconnect...'})
-                    socketio.sleep(2) # Wait before retrying connection
-                    continue # Skip this iteration and try to reconnect in the next one
-
-            # Use the new method that assumes connection is managed externally
-            response = rfid_reader_instance._perform_scan_attempt() 
-
-            if response.get("status") == "success":
-                epc = response.get("epc_hex")
-                item_name = get_name_for_epc(epc)
-                print(f"RFID Scan: Tag found - EPC: {epc}, Name: {item_name if item_name else 'Unknown'}")
-                socketio.emit('rfid_data', {
-                    'status': 'success',
-                    'epc': epc,
-                    'name': item_name if item_name else 'Unknown',
-                    'rssi': response.get('rssi_dbm'),
-                    'pc': response.get('pc_hex')
-                })
-                # Example: if you want to stop after finding one specific tag.
-                # if item_name == "cup":
-                #     stop_scanning_event.set() # Signal to stop
-                #     break
-            elif response.get("status") == "no_tag_found":
-                # print("RFID Scan: No tag found in this attempt.") # Can be spammy
-                socketio.emit('rfid_data', {'status': 'no_tag_found', 'message': 'No tag found'})
-            elif response.get("status") == "error":
-                print(f"RFID Scan Error: {response.get('message')}")
-                socketio.emit('rfid_error', {'message': response.get('message')})
-                # If certain errors occur (e.g., serial port gone), might try to reconnect or stop.
-                if "Serial port not connected" in response.get('message', "") or \
-                   "Serial communication error" in response.get('message', ""):
-                    print("RFID Reader: Critical serial error. Attempting to handle...")
-                    rfid_reader_instance.disconnect() # Ensure it's marked as disconnected
-                    # The loop will attempt to reconnect at the start of the next iteration.
-            
-            socketio.sleep(0.1) # Polling interval. Adjusted for faster attempts.
-                                # Be mindful of system load and reader capabilities.
-    
-    except Exception as e:
-        print(f"Exception in RFID scan loop: {e}")
-        socketio.emit('rfid_error', {'message': f'Critical error in scan loop: {str(e)}'})
-    finally:
-        print("RFID scan loop cleaning up.")
-        if rfid_reader_instance.is_connected:
-            rfid_reader_instance.disconnect() # Disconnect when loop ends
-        is_scanning_active = False
-        print("RFID scan loop finished.")
+        with reader_manager.exclusive(reader_id) as reader:
+            return action(reader), 200
+    except RuntimeError as e:
+        return {'error': str(e)}, 409
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    except serial.SerialException as e:
+        return {'error': f"Reader error: {e}"}, 502
+
+def reader_rf_settings(reader_id):
+    """Current power, region, channel and Query parameters read from the reader."""
+    if hub_client is not None:
+        return hub_client.call('server.reader_rf_settings', reader_id)
+    return _reader_http_errors(reader_id, lambda reader: {'reader_id': reader_id, 'settings': reader.get_rf_settings()})
+
+def tune_reader(reader_id, settings, save=False):
+    """
+    Applies RF settings now and from every later connect; save=True also stores them with
+    the reader's calibration so they survive a restart.
+    """
+    if hub_client is not None:
+        return hub_client.call('server.tune_reader', reader_id, settings, save)
+    try:
+        validate_rf_settings(settings)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+
+    def apply(reader):
+        reader.apply_rf_settings(settings)
+        reader_manager.set_rf_settings(reader_id, {**(reader.rf_settings or {}), **settings})
+        if save:
+            saved = (load_calibrations().get(reader_id) or {}).get('settings') or {}
+            save_calibration(reader_id, {'settings': {**saved, **settings}, 'source': 'manual',
+                                         'calibrated_at': time.time()})
+        return {'reader_id': reader_id, 'settings': reader.get_rf_settings(), 'saved': bool(save)}
+    return _reader_http_errors(reader_id, apply)
+
+def start_calibration(reader_id, data):
+    """
+    Starts a power x Q sweep against the reader's own tags (see rf_calibration.py).
+    `data`: {'tags': [EPC hex or item name, ...], 'powers': [dBm, ...], 'q_values': [...], 'dwell': seconds}
+    Returns:
+        tuple: (job dict, HTTP status code) - 202 once started.
+    """
+    if hub_client is not None:
+        return hub_client.call('server.start_calibration', reader_id, data)
+    if reader_id not in reader_manager.readers:
+        return {'error': f"Unknown reader '{reader_id}'"}, 404
+    try:
+        known_epcs = resolve_known_tags(data.get('tags') or [])
+        powers = [float(power) for power in data.get('powers') or DEFAULT_POWERS]
+        q_values = [int(q) for q in data.get('q_values') or DEFAULT_Q_VALUES]
+        dwell = float(data.get('dwell') or DEFAULT_DWELL)
+        for power in powers:
+            validate_rf_settings({'power_dbm': power})
+        for q in q_values:
+            validate_rf_settings({'q': q})
+        if dwell <= 0:
+            raise ValueError("dwell must be positive")
+    except (TypeError, ValueError) as e:
+        return {'error': str(e)}, 400
+
+    hold = contextlib.ExitStack()
+    try:
+        reader = hold.enter_context(reader_manager.exclusive(reader_id))
+    except RuntimeError as e:
+        return {'error': str(e)}, 409
+    job = {'reader_id': reader_id, 'state': 'running', 'done': 0, 'total': len(powers) * len(q_values),
+           'result': None, 'error': None}
+    calibration_jobs[reader_id] = job
+    calibration_stops[reader_id] = threading.Event()
+    socketio.start_background_task(run_calibration, hold, reader, job, known_epcs, powers, q_values, dwell)
+    return dict(job), 202
+
+def run_calibration(hold, reader, job, known_epcs, powers, q_values, dwell):
+    """Background task body; releases the reader (`hold`) when done."""
+    reader_id = job['reader_id']
+
+    def progress(done, total, candidate):
+        job['done'] = done
+        socketio.emit('rf_calibration', {'reader_id': reader_id, 'state': 'running', 'done': done, 'total': total,
+                                         'candidate': candidate})
+
+    with hold:
+        try:
+            result = calibrate(reader, known_epcs, powers, q_values, dwell, progress=progress,
+                               stop_event=calibration_stops[reader_id])
+            if result is None:
+                job['state'] = 'cancelled'
+            else:
+                save_calibration(reader_id, dict(result, source='calibration'))
+                reader_manager.set_rf_settings(reader_id, result['settings'])
+                job['result'] = result
+                job['state'] = 'done'
+                print(f"RF calibration of '{reader_id}': {result['settings']} -> {result['measured']}")
+        except Exception as e:
+            job['error'] = str(e)
+            job['state'] = 'failed'
+            print(f"RF calibration of '{reader_id}' failed: {e}")
+    socketio.emit('rf_calibration', {'reader_id': reader_id, 'state': job['state'], 'done': job['done'],
+                                     'total': job['total'], 'result': job['result'], 'error': job['error']})
+
+def calibration_status(reader_id):
+    if hub_client is not None:
+        return hub_client.call('server.calibration_status', reader_id)
+    job = calibration_jobs.get(reader_id)
+    if job is None:
+        return {'error': f"No calibration for reader '{reader_id}'"}, 404
+    return dict(job), 200
+
+def cancel_calibration(reader_id):
+    if hub_client is not None:
+        return hub_client.call('server.cancel_calibration', reader_id)
+    job = calibration_jobs.get(reader_id)
+    if job is None or job['state'] != 'running':
+        return {'error': f"No calibration running for reader '{reader_id}'"}, 409
+    calibration_stops[reader_id].set()
+    return dict(job), 202
+
+ANALYTICS_DEFAULT_RANGE = 24 * 3600 # seconds
+
+def query_event_log(query, params):
+    """
+    Runs one analytics query ('reads', 'completion', 'rssi', 'events' or 'stats') on the event log.
+    Args:
+        params (dict): The request's query string.
+    Returns:
+        tuple: (response dict, HTTP status code)
+    """
+    if hub_client is not None:
+        return hub_client.call('server.query_event_log', query, params)
+    if query == 'stats':
+        return event_log.stats(), 200
+    started = time.perf_counter()
+    try:
+        end = float(params.get('end') or time.time())
+        start = float(params.get('start') or end - ANALYTICS_DEFAULT_RANGE)
+        if query == 'reads':
+            result = event_log.reads_per_item(start, end, int(params.get('window') or 3600), params.get('reader'))
+        elif query == 'completion':
+            result = event_log.completion_times(start, end)
+        elif query == 'rssi':
+            result = event_log.rssi_distribution(start, end, params.get('item'), params.get('reader'))
+        elif query == 'events':
+            result = event_log.events(start, end, max(1, int(params.get('limit') or 1000)), params.get('epc'))
+        else:
+            return {'error': f'Unknown analytics query: {query}'}, 404
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    result['query_ms'] = round((time.perf_counter() - started) * 1000.0, 2)
+    return result, 200
+
+def handle_reader_event(event):
+    """Called on a reader's engine loop for every (de-duplicated) event it produces."""
+    if event["event"] == "tag":
+        tag = event["tag"]
+        event_log.append_read(tag.epc, event["reader_id"], tag.rssi, tag.timestamp)
+        for event_name, payload in presence_tracker.observe(tag, event["reader_id"]):
+            emit_presence_event(event_name, payload)
+    elif event["event"] == "error":
+        print(f"RFID Scan Error ({event['reader_id']}): {event['message']}")
+        EVENTS_EMITTED.labels('rfid_error').inc()
+        socketio.emit('rfid_error', {'message': event['message'], 'reader_id': event['reader_id']})
+
+def event_topics(event_name, payload):
+    """
+    Topics a presence event is published to: "presence" (arrivals and departures) or
+    "rssi" (signal updates), each also per reader and per item, e.g. "presence",
+    "presence:reader:main", "presence:item:cup".
+    """
+    kind = 'rssi' if event_name == 'rssi_changed' else 'presence'
+    return (kind, f"{kind}:reader:{payload['reader_id']}", f"{kind}:item:{payload['name']}")
+
+def emit_presence_event(event_name, payload):
+    item_name = get_name_for_epc(payload['epc'])
+    payload['status'] = 'success'
+    payload['name'] = item_name if item_name else 'Unknown'
+    if event_name != 'rssi_changed':
+        print(f"RFID Scan: {event_name} - EPC: {payload['epc']}, Name: {payload['name']}")
+    event_bus.publish(event_name, payload, event_topics(event_name, payload))
+
+def presence_sweep_loop():
+    """Reports tags that stopped being read. Runs for the lifetime of the server."""
+    while True:
+        for event_name, payload in presence_tracker.expire():
+            emit_presence_event(event_name, payload)
+        socketio.sleep(PRESENCE_SWEEP_INTERVAL)
+
+def ensure_background_tasks():
+    """Starts the presence sweeper and the event bus on first use."""
+    global background_tasks_started
+    if not background_tasks_started:
+        background_tasks_started = True
+        socketio.start_background_task(presence_sweep_loop)
+        socketio.start_background_task(event_bus.run)
 
 # --- Socket.IO Event Handlers ---
 @socketio.on('connect')
 def handle_connect():
+    CONNECTED_CLIENTS.inc()
     print(f"Client connected: {request.sid}")
     # Optionally, send current scanning state or other initial info
     # emit('scan_status', {'active': is_scanning_active})
 
+@socketio.on('join_session')
+def handle_join_session(data):
+    # Booth clients join their session's room to receive 'all_completed' pushes.
+    session_id = str((data or {}).get('session_id') or DEFAULT_SESSION)
+    join_room(session_id)
+    print(f"Client {request.sid} joined session '{session_id}'.")
+    emit('session_joined', {'session_id': session_id, 'current_status': scan_status_store.get(session_id)})
+
+@socketio.on('leave_session')
+def handle_leave_session(data):
+    session_id = str((data or {}).get('session_id') or DEFAULT_SESSION)
+    leave_room(session_id)
+    print(f"Client {request.sid} left session '{session_id}'.")
+
+@socketio.on('subscribe')
+def handle_subscribe(data):
+    # Joins the rooms of the given topics (see event_topics()); 'event_batch' messages follow.
+    topics = (data or {}).get('topics')
+    if not isinstance(topics, list) or not all(isinstance(topic, str) and topic for topic in topics):
+        emit('subscribed', {'status': 'error', 'message': "'topics' must be a list of topic names"})
+        return
+    if len(topics) > MAX_SUBSCRIPTIONS:
+        emit('subscribed', {'status': 'error', 'message': f"At most {MAX_SUBSCRIPTIONS} topics per request"})
+        return
+    for topic in topics:
+        join_room(room_for(topic))
+    emit('subscribed', {'status': 'success', 'topics': topics})
+
+@socketio.on('unsubscribe')
+def handle_unsubscribe(data):
+    topics = (data or {}).get('topics')
+    for topic in topics if isinstance(topics, list) else []:
+        if isinstance(topic, str):
+            leave_room(room_for(topic))
+    emit('unsubscribed', {'status': 'success', 'topics': topics if isinstance(topics, list) else []})
+
 @socketio.on('disconnect')
 def handle_disconnect():
+    CONNECTED_CLIENTS.dec()
     print(f"Client disconnected: {request.sid}")
     # If this is the last client or specific conditions met, you might stop scanning.
     # For now, scanning stops only on explicit 'stop_rfid_scan' or server shutdown.
 
 @socketio.on('start_rfid_scan')
 def handle_start_rfid_scan():
-    global scanning_thread, is_scanning_active
     client_sid = request.sid
     print(f"Received start_rfid_scan request from {client_sid}.")
 
-    if is_scanning_active:
+    if not start_scanning():
         print("Scan already active.")
         emit('rfid_status', {'status': 'already_scanning', 'message': 'RFID scanning is already active.'})
         return
 
-    is_scanning_active = True
-    stop_scanning_event.clear()
-    
-    scanning_thread = threading.Thread(target=rfid_scan_loop)
-    scanning_thread.daemon = True 
-    scanning_thread.start()
-    print("RFID scanning thread started.")
+    print("RFID reader engines started.")
     emit('rfid_status', {'status': 'scanning_started', 'message': 'RFID scanning initiated.'})
 
 @socketio.on('stop_rfid_scan')
 def handle_stop_rfid_scan():
-    global is_scanning_active # ensure we modify the global
     client_sid = request.sid
     print(f"Received stop_rfid_scan request from {client_sid}.")
     
-    if not is_scanning_active and (not scanning_thread or not scanning_thread.is_alive()):
-        print("Scan not active or thread not running.")
+    if not stop_scanning():
+        print("Scan not active.")
         emit('rfid_status', {'status': 'already_stopped', 'message': 'RFID scanning is not active.'})
         return
 
-    stop_scanning_event.set()
-    # The is_scanning_active flag will be set to False by the rfid_scan_loop's finally block.
-    # We can emit the status update here optimistically.
-    print("RFID scanning stop signal sent. Loop will terminate and clean up.")
+    # Cancellation stops the reader and closes the port on the engine loop within milliseconds.
+    print("RFID scanning stop signal sent.")
     emit('rfid_status', {'status': 'stopping', 'message': 'RFID scanning is stopping.'})
-    # Note: is_scanning_active is fully false once thread confirms exit.
+
+@socketio.on('score_gesture')
+def handle_score_gesture(data):
+    result, status_code = score_gesture_request(data or {})
+    if status_code != 200:
+        emit('gesture_score', {'status': 'error', 'message': result['error']})
+        return
+    emit('gesture_score', dict(result, status='success'))
+
+@socketio.on('imu_samples')
+def handle_imu_samples(data):
+    # Either raw bytes (packed float32 samples) or {'samples' | 'payload', 'action', 'session_id'}
+    if isinstance(data, (bytes, bytearray)):
+        data = {'payload': bytes(data)}
+    data = data or {}
+    payload = data.get('payload') if data.get('payload') is not None else (data.get('samples') or [])
+    result, status_code = ingest_imu_samples(payload, data.get('action'), get_request_session_id(data))
+    if status_code != 200:
+        emit('gesture_segment', {'status': 'error', 'message': result['error']})
+        return
+    for segment in result['segments']:
+        emit('gesture_segment', dict(segment, status='success', session_id=result['session_id']))
 
 
 if __name__ == '__main__':
-    initialize_scan_status_file() # Ensure status file is ready on server start
+    asset_server.precompress() # Hash assets and build gzip/brotli variants before the first visitor
     print("Starting Flask-SocketIO server on http://0.0.0.0:5000")
     socketio.run(app, host='0.0.0.0', port=5000, debug=True, allow_unsafe_werkzeug=True, use_reloader=False)
-    # use_reloader=False is important for threads to behave predictably during dev
+    # use_reloader=False keeps a single reader engine (and a single owner of the serial port) during dev
 
@@ -0,0 +1,385 @@
+# message_hub.py
+# A small local message hub connecting the production server's processes (see serve.py).
+#
+# The hub listens on a Unix socket (or a localhost TCP port where there are none) and
+# offers three kinds of connections:
+#   pubsub  - receives every message published by other clients (and may publish too).
+#   publish - only sends; the hub never writes to it. LocalPubSubManager publishes on one
+#             and listens on a pubsub one, so an emit in any process reaches Socket.IO
+#             clients connected to any web worker.
+#   rpc     - request/response calls to objects registered on the hub's process (the
+#             reader process registers the scan controls and the scan status store).
+#
+# Each subscriber has its own send queue and thread, so a slow one can't hold up the
+# others; one that falls SUBSCRIBER_QUEUE messages behind is disconnected.
+#
+# Connections are authenticated with an HMAC challenge on a shared key before anything
+# is unpickled. Messages are length-prefixed pickles. Only plain sockets are used, so
+# the clients cooperate with eventlet/gevent monkey patching in the web workers.
+import functools
+import hashlib
+import hmac
+import os
+import pickle
+import queue
+import select
+import socket
+import struct
+import tempfile
+import threading
+import time
+
+from socketio import PubSubManager
+
+_LENGTH = struct.Struct('<I')
+ROLE_PUBSUB = 'pubsub'
+ROLE_PUBLISH = 'publish'
+ROLE_RPC = 'rpc'
+
+
+def default_address(port):
+    """A Unix socket path next to the system's temp files, or localhost:port + 1 without AF_UNIX."""
+    if hasattr(socket, 'AF_UNIX'):
+        return os.path.join(tempfile.gettempdir(), f'rfid-hub-{port}.sock')
+    return ('127.0.0.1', port + 1)
+
+
+def parse_address(text):
+    """'host:port' for TCP, anything else is a Unix socket path."""
+    host, _, port = text.rpartition(':')
+    if host and port.isdigit():
+        return (host, int(port))
+    return text
+
+
+def format_address(address):
+    return f'{address[0]}:{address[1]}' if isinstance(address, tuple) else address
+
+
+class Channel:
+    """Framed, authenticated messages over one socket."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self._send_lock = threading.Lock()
+
+    @classmethod
+    def connect(cls, address, authkey, timeout=None):
+        """
+        Raises:
+            OSError: If the hub can't be reached or rejects the key.
+        """
+        family = socket.AF_INET if isinstance(address, tuple) else socket.AF_UNIX
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(address)
+            channel = cls(sock)
+            nonce = channel.recv_bytes()
+            channel.send_bytes(hmac.new(authkey, nonce, hashlib.sha256).digest())
+            if channel.recv_bytes() != b'OK':
+                raise ConnectionRefusedError("Message hub rejected the key")
+        except BaseException:
+            sock.close()
+            raise
+        return channel
+
+    def accept_client(self, authkey):
+        """Server side of the handshake. Returns False if the client doesn't know the key."""
+        nonce = os.urandom(32)
+        self.send_bytes(nonce)
+        answer = self.recv_bytes()
+        if not hmac.compare_digest(answer, hmac.new(authkey, nonce, hashlib.sha256).digest()):
+            self.send_bytes(b'NO')
+            return False
+        self.send_bytes(b'OK')
+        return True
+
+    def send_bytes(self, data):
+        with self._send_lock:
+            self.sock.sendall(_LENGTH.pack(len(data)) + data)
+
+    def recv_bytes(self):
+        (length,) = _LENGTH.unpack(self._recv_exactly(_LENGTH.size))
+        return self._recv_exactly(length)
+
+    def send(self, message):
+        self.send_bytes(pickle.dumps(message, pickle.HIGHEST_PROTOCOL))
+
+    def recv(self):
+        return pickle.loads(self.recv_bytes())
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+    def peer_closed(self):
+        """True if an idle connection has become readable, i.e. the other side closed it."""
+        try:
+            readable, _, _ = select.select([self.sock], [], [], 0)
+        except (OSError, ValueError):
+            return True
+        return bool(readable)
+
+    def _recv_exactly(self, size):
+        chunks = []
+        while size:
+            chunk = self.sock.recv(min(size, 1 << 20))
+            if not chunk:
+                raise ConnectionResetError("Message hub connection closed")
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b''.join(chunks)
+
+
+class _Subscriber:
+    """A pubsub connection with its own send queue and sender thread."""
+
+    def __init__(self, channel, max_queued, on_error):
+        self.channel = channel
+        self._queue = queue.Queue(max_queued)
+        self._on_error = on_error
+        threading.Thread(target=self._send_loop, name='message-hub-subscriber', daemon=True).start()
+
+    def offer(self, data):
+        """Queues a message. Returns False if the subscriber is too far behind."""
+        try:
+            self._queue.put_nowait(data)
+            return True
+        except queue.Full:
+            return False
+
+    def stop(self):
+        try:
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass # The sender stops once the channel is closed
+        self.channel.close()
+
+    def _send_loop(self):
+        while True:
+            data = self._queue.get()
+            if data is None:
+                return
+            try:
+                self.channel.send_bytes(data)
+            except OSError:
+                self._on_error(self)
+                return
+
+
+class Hub:
+    """
+    The hub server; runs on threads inside the process that owns it.
+
+    Args:
+        address: Unix socket path or (host, port).
+        authkey (bytes): Shared key clients must prove they know.
+    """
+    SUBSCRIBER_QUEUE = 1000 # Messages a subscriber may fall behind before it's dropped
+
+    def __init__(self, address, authkey):
+        self.address = address
+        self.authkey = authkey
+        self.handlers = {} # 'name.method' -> callable
+        self._subscribers = {} # Channel -> _Subscriber
+        self._lock = threading.Lock()
+        self._listener = None
+
+    def register(self, name, obj, methods):
+        """Exposes `obj.<method>` to RPC clients as 'name.method'."""
+        for method in methods:
+            self.handlers[f'{name}.{method}'] = getattr(obj, method)
+
+    def start(self):
+        if isinstance(self.address, tuple):
+            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        else:
+            if os.path.exists(self.address):
+                os.unlink(self.address) # Left over from a previous run
+            listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.address)
+        if not isinstance(self.address, tuple):
+            os.chmod(self.address, 0o600)
+        listener.listen(64)
+        self._listener = listener
+        threading.Thread(target=self._accept_loop, name='message-hub', daemon=True).start()
+
+    def publish(self, message, sender=None):
+        """Queues a message for every pubsub client except `sender`; never waits for a client."""
+        data = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            subscribers = [subscriber for channel, subscriber in self._subscribers.items() if channel is not sender]
+        for subscriber in subscribers:
+            if not subscriber.offer(data):
+                print(f"Message hub: Dropping a subscriber {self.SUBSCRIBER_QUEUE} messages behind")
+                self._drop(subscriber.channel)
+
+    def close(self):
+        if self._listener is not None:
+            self._listener.close()
+        with self._lock:
+            subscribers, self._subscribers = self._subscribers, {}
+        for subscriber in subscribers.values():
+            subscriber.stop()
+
+    def _accept_loop(self):
+        while True:
+            try:
+                sock, _ = self._listener.accept()
+            except OSError:
+                return # Closed
+            threading.Thread(target=self._serve, args=(Channel(sock),), name='message-hub-client', daemon=True).start()
+
+    def _serve(self, channel):
+        try:
+            if not channel.accept_client(self.authkey):
+                return
+            role = channel.recv()
+            if role in (ROLE_PUBSUB, ROLE_PUBLISH):
+                if role == ROLE_PUBSUB:
+                    subscriber = _Subscriber(channel, self.SUBSCRIBER_QUEUE, lambda subscriber: self._drop(subscriber.channel))
+                    with self._lock:
+                        self._subscribers[channel] = subscriber
+                while True:
+                    self.publish(channel.recv(), sender=channel)
+            elif role == ROLE_RPC:
+                while True:
+                    method, args, kwargs = channel.recv()
+                    handler = self.handlers.get(method)
+                    try:
+                        if handler is None:
+                            raise LookupError(f"Unknown method '{method}'")
+                        reply = ('ok', handler(*args, **kwargs))
+                    except Exception as e:
+                        reply = ('error', f'{type(e).__name__}: {e}')
+                    channel.send(reply)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            pass # Client went away
+        finally:
+            self._drop(channel)
+
+    def _drop(self, channel):
+        with self._lock:
+            subscriber = self._subscribers.pop(channel, None)
+        if subscriber is not None:
+            subscriber.stop()
+        channel.close()
+
+
+class RemoteError(Exception):
+    """An RPC handler on the hub raised an exception."""
+
+
+class HubClient:
+    """RPC client; one call at a time per instance, reconnecting as needed."""
+    CONNECT_TIMEOUT = 5.0
+
+    def __init__(self, address, authkey, timeout=10.0):
+        self.address = address
+        self.authkey = authkey
+        self.timeout = timeout
+        self._channel = None
+        self._lock = threading.Lock()
+
+    def call(self, method, *args, **kwargs):
+        """
+        Calls a method registered on the hub. The request is only sent again if it never
+        reached the hub, so a method runs at most once per call.
+        Raises:
+            ConnectionError: If the hub can't be reached (after one reconnect attempt), or
+                             if no reply arrived (the method may have run).
+            RemoteError: If the method raised.
+        """
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._channel is not None and self._channel.peer_closed():
+                        self._close_channel() # The hub went away while the connection was idle
+                    if self._channel is None:
+                        self._channel = Channel.connect(self.address, self.authkey, self.CONNECT_TIMEOUT)
+                        self._channel.sock.settimeout(self.timeout)
+                        self._channel.send(ROLE_RPC)
+                    # The hub only runs a request it received completely, so a failed send is safe to retry
+                    self._channel.send((method, args, kwargs))
+                    break
+                except OSError as e:
+                    self._close_channel()
+                    if attempt:
+                        raise ConnectionError(f"Message hub at {format_address(self.address)} unavailable: {e}") from e
+            try:
+                status, result = self._channel.recv()
+            except (OSError, EOFError) as e:
+                self._close_channel() # A late reply must not be taken for the next call's
+                raise ConnectionError(f"No reply from the message hub for '{method}': {e}") from e
+        if status == 'error':
+            raise RemoteError(result)
+        return result
+
+    def _close_channel(self):
+        if self._channel is not None:
+            self._channel.close()
+            self._channel = None
+
+
+class RemoteProxy:
+    """Stand-in for an object registered on the hub: proxy.method(...) becomes an RPC call."""
+
+    def __init__(self, client, name):
+        self._client = client
+        self._name = name
+
+    def __getattr__(self, method):
+        return functools.partial(self._client.call, f'{self._name}.{method}')
+
+
+class LocalPubSubManager(PubSubManager):
+    """python-socketio client manager that shares emits and rooms through the hub."""
+    name = 'localpubsub'
+    RECONNECT_DELAY = 1.0
+
+    def __init__(self, address, authkey, channel='socketio', write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.address = address
+        self.authkey = authkey
+        self._publisher = None
+        self._publisher_lock = threading.Lock()
+
+    def _publish(self, data):
+        with self._publisher_lock:
+            for attempt in range(2):
+                try:
+                    if self._publisher is None:
+                        self._publisher = Channel.connect(self.address, self.authkey, HubClient.CONNECT_TIMEOUT)
+                        self._publisher.sock.settimeout(None)
+                        self._publisher.send(ROLE_PUBLISH) # Never read from, so the hub must not write to it
+                    self._publisher.send(data)
+                    return
+                except OSError as e:
+                    if self._publisher is not None:
+                        self._publisher.close()
+                        self._publisher = None
+                    if attempt:
+                        self._get_logger().error(f"Message hub unavailable, message dropped: {e}")
+
+    def _listen(self):
+        while True:
+            try:
+                channel = Channel.connect(self.address, self.authkey, HubClient.CONNECT_TIMEOUT)
+            except OSError as e:
+                self._get_logger().error(f"Can't reach the message hub: {e}. Retrying...")
+                time.sleep(self.RECONNECT_DELAY)
+                continue
+            try:
+                channel.sock.settimeout(None)
+                channel.send(ROLE_PUBSUB)
+                while True:
+                    yield channel.recv()
+            except (OSError, EOFError) as e:
+                self._get_logger().error(f"Message hub connection lost: {e}. Reconnecting...")
+            finally:
+                channel.close()
+            time.sleep(self.RECONNECT_DELAY)
@@ -0,0 +1,125 @@
+# poll_scheduler.py
+# Decides how often the reader's radio polls for tags.
+#
+# The reader engine runs inventory in bursts of `burst` seconds. At the end of each
+# burst it asks the scheduler for a gap: 0 keeps the radio polling, anything longer
+# stops the inventory for that many seconds.
+#
+# AdaptivePollScheduler polls continuously while tags are being read (and for `hold`
+# seconds after the last read), then backs off exponentially while the field stays
+# empty. Two limits bound the backoff:
+#   latency_slo - worst-case seconds until a newly placed tag is read; caps the gap
+#                 at latency_slo - burst.
+#   duty_cycle  - largest fraction of time the radio may be on while idle; sets a
+#                 floor of burst * (1 - duty_cycle) / duty_cycle on the idle gap.
+# The latency SLO wins when the two conflict (reported as "slo_limited").
+import time
+
+
+class ContinuousPolling:
+    """Never pauses the radio (the engine's behaviour without a scheduler)."""
+    burst = 1.0
+
+    def reset(self, now):
+        pass
+
+    def record(self, reads, now):
+        pass
+
+    def next_gap(self, now):
+        return 0.0
+
+    def status(self):
+        return {"mode": "continuous", "gap": 0.0, "duty_cycle": 1.0, "worst_case_latency": 0.0}
+
+
+class AdaptivePollScheduler:
+    """
+    Args:
+        burst (float): Seconds of inventory between scheduling decisions.
+        hold (float): Seconds after the last read during which polling stays continuous.
+        first_gap (float): First idle gap; each further empty burst multiplies it by `backoff`.
+        backoff (float): Growth factor of the idle gap.
+        max_gap (float): Longest idle gap.
+        latency_slo (float, optional): Worst-case detection latency to respect (seconds).
+        duty_cycle (float, optional): Largest radio-on fraction while idle (0-1].
+    Raises:
+        ValueError: If a parameter is out of range.
+    """
+    DEFAULTS = {"burst": 0.05, "hold": 2.0, "first_gap": 0.02, "backoff": 2.0, "max_gap": 1.0,
+                "latency_slo": None, "duty_cycle": None}
+
+    def __init__(self, burst=0.05, hold=2.0, first_gap=0.02, backoff=2.0, max_gap=1.0, latency_slo=None,
+                 duty_cycle=None):
+        if burst <= 0 or first_gap <= 0 or max_gap < 0 or backoff < 1:
+            raise ValueError("burst and first_gap must be positive, max_gap non-negative and backoff at least 1")
+        if duty_cycle is not None and not 0 < duty_cycle <= 1:
+            raise ValueError("duty_cycle must be in (0, 1]")
+        if latency_slo is not None and latency_slo < burst:
+            raise ValueError("latency_slo can't be shorter than one burst")
+        self.burst = burst
+        self.hold = hold
+        self.first_gap = first_gap
+        self.backoff = backoff
+        self.duty_cycle = duty_cycle
+        self.latency_slo = latency_slo
+
+        ceiling = max_gap if latency_slo is None else min(max_gap, latency_slo - burst)
+        floor = 0.0 if duty_cycle is None else burst * (1 - duty_cycle) / duty_cycle
+        self.slo_limited = floor > ceiling
+        self.idle_floor = min(floor, ceiling)
+        self.ceiling = ceiling
+        self.reset(time.monotonic())
+
+    def reset(self, now):
+        """Starts out polling continuously, as if a tag had just been read."""
+        self._last_read = now
+        self.gap = 0.0
+
+    def record(self, reads, now):
+        """Called with the number of tags read in a chunk of reader output."""
+        if reads:
+            self._last_read = now
+            self.gap = 0.0
+
+    def next_gap(self, now):
+        """Seconds to keep the radio off before the next burst."""
+        if now - self._last_read < self.hold:
+            self.gap = 0.0
+        else:
+            gap = self.first_gap if self.gap < self.first_gap else self.gap * self.backoff
+            self.gap = min(max(gap, self.idle_floor), self.ceiling)
+        return self.gap
+
+    def status(self):
+        gap = self.gap
+        return {
+            "mode": "active" if gap == 0 else ("idle" if gap >= self.ceiling else "backoff"),
+            "gap": gap,
+            "bursts_per_second": 1.0 / (self.burst + gap),
+            "duty_cycle": self.burst / (self.burst + gap),
+            "worst_case_latency": gap + self.burst if gap else 0.0,
+            "latency_slo": self.latency_slo,
+            "duty_cycle_limit": self.duty_cycle,
+            "slo_limited": self.slo_limited,
+        }
+
+
+def scheduler_from_config(config):
+    """
+    Builds a scheduler from a reader config's "poll" section, e.g.
+        {"mode": "adaptive", "latency_slo": 0.3, "duty_cycle": 0.25}
+    A missing section or "mode": "continuous" polls without pauses.
+    Raises:
+        ValueError: On an unknown mode or invalid parameters.
+    """
+    config = dict(config or {})
+    mode = config.pop("mode", "continuous")
+    if mode == "continuous":
+        return ContinuousPolling()
+    if mode == "adaptive":
+        unknown = set(config) - set(AdaptivePollScheduler.DEFAULTS)
+        if unknown:
+            raise ValueError(f"Unknown poll settings: {', '.join(sorted(unknown))}")
+        return AdaptivePollScheduler(**config)
+    raise ValueError(f"Unknown poll mode '{mode}'")
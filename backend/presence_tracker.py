@@ -0,0 +1,114 @@
+# presence_tracker.py
+# Turns the raw stream of tag reads into edge-triggered presence events.
+#
+# The reader reports the same tag many times per second while it sits in the field.
+# Clients only care about three things: a tag showed up, a tag went away, or its
+# signal strength moved noticeably. PresenceTracker keeps per-EPC state and reports
+# exactly those transitions:
+#   tag_arrived   - after `arrive_reads` reads within `leave_timeout` of each other
+#   rssi_changed  - smoothed RSSI moved by at least `rssi_delta` since last reported
+#   tag_left      - no read for `leave_timeout` seconds (call expire() periodically)
+import threading
+import time
+
+
+class _TagState:
+    __slots__ = ("epc", "pc", "first_seen", "last_seen", "reads", "rssi_ema", "reported_rssi", "present", "reader_id")
+
+    def __init__(self, tag, reader_id=None):
+        self.epc = tag.epc
+        self.pc = tag.pc
+        self.first_seen = tag.timestamp
+        self.last_seen = tag.timestamp
+        self.reads = 1
+        self.rssi_ema = float(tag.rssi)
+        self.reported_rssi = None
+        self.present = False
+        self.reader_id = reader_id # Reader that last reported the tag (multi-reader setups)
+
+
+class PresenceTracker:
+    DEFAULT_EMA_ALPHA = 0.3 # Weight of the newest RSSI sample
+    DEFAULT_ARRIVE_READS = 2 # Reads needed before a tag counts as present (filters stray reads)
+    DEFAULT_LEAVE_TIMEOUT = 1.5 # Seconds without reads before a present tag is reported gone
+    DEFAULT_RSSI_DELTA = 3.0 # Smoothed RSSI change needed for an rssi_changed event
+
+    def __init__(self, ema_alpha=DEFAULT_EMA_ALPHA, arrive_reads=DEFAULT_ARRIVE_READS,
+                 leave_timeout=DEFAULT_LEAVE_TIMEOUT, rssi_delta=DEFAULT_RSSI_DELTA):
+        self.ema_alpha = ema_alpha
+        self.arrive_reads = max(1, arrive_reads)
+        self.leave_timeout = leave_timeout
+        self.rssi_delta = rssi_delta
+        self._tags = {} # raw EPC bytes -> _TagState
+        # observe() runs on the reader engine loop, expire() on a sweeper; guard the dict
+        self._lock = threading.Lock()
+
+    def observe(self, tag, reader_id=None):
+        """
+        Records one TagRead, optionally with the id of the reader that made it.
+        Returns:
+            list: (event_name, payload) tuples for any transitions this read caused.
+        """
+        with self._lock:
+            events = []
+            state = self._tags.get(tag.epc)
+            if state is None or (tag.timestamp - state.last_seen) > self.leave_timeout:
+                # New tag, or one whose earlier reads went stale before expire() swept it
+                if state is not None and state.present:
+                    events.append(("tag_left", self._payload(state)))
+                state = _TagState(tag, reader_id)
+                self._tags[tag.epc] = state
+            else:
+                state.reads += 1
+                state.last_seen = tag.timestamp
+                state.pc = tag.pc
+                state.reader_id = reader_id
+                state.rssi_ema += self.ema_alpha * (tag.rssi - state.rssi_ema)
+
+            if not state.present:
+                if state.reads >= self.arrive_reads:
+                    state.present = True
+                    state.reported_rssi = state.rssi_ema
+                    events.append(("tag_arrived", self._payload(state)))
+            elif abs(state.rssi_ema - state.reported_rssi) >= self.rssi_delta:
+                state.reported_rssi = state.rssi_ema
+                events.append(("rssi_changed", self._payload(state)))
+            return events
+
+    def expire(self, now=None):
+        """
+        Drops tags that haven't been read for `leave_timeout` seconds.
+        Returns:
+            list: ("tag_left", payload) tuples for tags that had been reported present.
+        """
+        if now is None:
+            now = time.time()
+        events = []
+        with self._lock:
+            for epc, state in list(self._tags.items()):
+                if (now - state.last_seen) > self.leave_timeout:
+                    del self._tags[epc]
+                    if state.present:
+                        events.append(("tag_left", self._payload(state)))
+        return events
+
+    def reset(self):
+        """Forgets every tag without reporting it (e.g. when scanning restarts)."""
+        with self._lock:
+            self._tags.clear()
+
+    def present_tags(self):
+        """Payloads for all tags currently considered present."""
+        with self._lock:
+            return [self._payload(state) for state in self._tags.values() if state.present]
+
+    def _payload(self, state):
+        return {
+            'epc': state.epc.hex().upper(),
+            'pc': state.pc.hex().upper(),
+            'rssi': round(state.rssi_ema, 1),
+            'reads': state.reads,
+            'first_seen': state.first_seen,
+            'last_seen': state.last_seen,
+            'reader_id': state.reader_id
+        }
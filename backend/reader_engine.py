@@ -0,0 +1,307 @@
+# reader_engine.py
+# asyncio based reader engine: streams tag reads from an RFIDReader without
+# parking a thread inside a blocking serial.read().
+import asyncio
+import concurrent.futures
+import threading
+import time
+
+import serial
+
+from poll_scheduler import ContinuousPolling
+from rfid_frames import parse_tag_read, ERROR_NO_TAG
+from rfid_reader import EMPTY_POLLS, SERIAL_ROUND_TRIP
+import metrics
+
+TAG_READS = metrics.counter("rfid_tag_reads_total", "Tag notifications streamed by the reader engine.")
+
+
+class SerialTransport:
+    """Non-blocking reads from an already open pyserial port inside an event loop.
+
+    On POSIX the port's file descriptor is registered with the loop, so we wake up
+    exactly when bytes arrive. Where that isn't possible (Windows COM ports, proactor
+    loops) we fall back to checking `in_waiting` every few milliseconds.
+    """
+    POLL_INTERVAL = 0.005 # seconds between in_waiting checks in fallback mode
+
+    def __init__(self, serial_conn):
+        self.serial_conn = serial_conn
+        self.serial_conn.timeout = 0 # read() returns immediately with whatever is buffered
+        try:
+            self._fileno = serial_conn.fileno()
+        except (AttributeError, OSError, serial.SerialException):
+            self._fileno = None
+
+    async def read(self):
+        """Waits until bytes are available and returns all of them."""
+        if self._fileno is not None:
+            try:
+                await self._wait_readable()
+            except NotImplementedError:
+                self._fileno = None # Loop can't watch file descriptors; poll from now on
+
+        if self._fileno is None:
+            while not self.serial_conn.in_waiting:
+                await asyncio.sleep(self.POLL_INTERVAL)
+
+        return self.serial_conn.read(self.serial_conn.in_waiting or 1)
+
+    async def _wait_readable(self):
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+
+        def on_readable():
+            if not ready.done():
+                ready.set_result(None)
+
+        loop.add_reader(self._fileno, on_readable)
+        try:
+            await ready
+        finally:
+            loop.remove_reader(self._fileno)
+
+    def write(self, data):
+        # Commands are a handful of bytes; the OS buffer takes them without blocking.
+        self.serial_conn.write(data)
+
+
+class AsyncReaderEngine:
+    """Runs the reader's multi-poll inventory on an asyncio loop.
+
+    Events are dicts with an "event" key:
+        {"event": "tag", "tag": TagRead}
+        {"event": "error", "message": str}
+
+    Use it directly from asyncio code (`async for event in engine`, with `run()`
+    scheduled as a task), or from a threaded server through `start()`/`stop()`,
+    which drive a private event loop thread and take effect within milliseconds.
+    """
+    DEFAULT_QUEUE_SIZE = 256 # Producer waits (and the serial buffer absorbs reads) when consumers fall behind
+    REARM_TIMEOUT = 1.0 # Re-issue the multi-poll command after this long without any bytes
+    RECONNECT_DELAY = 2.0
+
+    def __init__(self, reader, queue_size=DEFAULT_QUEUE_SIZE, rearm_timeout=REARM_TIMEOUT,
+                 reconnect_delay=RECONNECT_DELAY, scheduler=None):
+        """
+        Args:
+            scheduler: Decides when the radio pauses between inventory bursts
+                       (see poll_scheduler.py). Defaults to polling continuously.
+        """
+        self.reader = reader
+        self.scheduler = scheduler or ContinuousPolling()
+        self.rearm_timeout = rearm_timeout
+        self.reconnect_delay = reconnect_delay
+        self._queue = asyncio.Queue(maxsize=queue_size)
+
+        # State for the thread-safe start()/stop() API
+        self._lock = threading.Lock()
+        self._loop = None
+        self._loop_thread = None
+        self._future = None
+        self._serve_task = None # Only touched on the loop thread
+
+    # --- asyncio API ---
+    async def run(self):
+        """Produces events until cancelled, reconnecting to the reader as needed."""
+        try:
+            while True:
+                if not self.reader.connect():
+                    await self._publish({"event": "error", "message": "Failed to connect to RFID reader. Retrying..."})
+                    await asyncio.sleep(self.reconnect_delay)
+                    continue
+                try:
+                    await self._stream(SerialTransport(self.reader.serial_conn))
+                except serial.SerialException as e:
+                    await self._publish({"event": "error", "message": f"Serial communication error during scan: {str(e)}"})
+                    self.reader.disconnect()
+                    await asyncio.sleep(self.reconnect_delay)
+        finally:
+            self._shutdown_reader()
+
+    async def _stream(self, transport):
+        reader = self.reader
+        scheduler = self.scheduler
+        transport.write(reader._get_multi_inventory_command())
+        armed_at = time.perf_counter() # Cleared once the reader answers
+        quiet_since = time.monotonic() # Last time bytes arrived (or the command was re-armed)
+        scheduler.reset(quiet_since)
+        burst_end = quiet_since + scheduler.burst
+        read = None # Pending transport.read(), kept across wake-ups until it returns
+        try:
+            while True:
+                wake_at = min(quiet_since + self.rearm_timeout, burst_end)
+                if read is None:
+                    read = asyncio.ensure_future(transport.read())
+                # asyncio.wait() rather than wait_for(): on Python 3.11 wait_for() drops a
+                # cancellation that arrives just as the read completes, and stop() would be lost.
+                done, _pending = await asyncio.wait({read}, timeout=max(0.0, wake_at - time.monotonic()))
+                chunk = None
+                if done:
+                    chunk, read = read.result(), None
+                now = time.monotonic()
+
+                if chunk is None:
+                    if now - quiet_since >= self.rearm_timeout:
+                        # Poll count ran out or the reader dropped the command.
+                        EMPTY_POLLS.labels("multi").inc()
+                        transport.write(reader._get_multi_inventory_command())
+                        armed_at = time.perf_counter()
+                        quiet_since = now
+                else:
+                    quiet_since = now
+                    if armed_at is not None:
+                        SERIAL_ROUND_TRIP.labels("multi").observe(time.perf_counter() - armed_at)
+                        armed_at = None
+                    rearm = False
+                    reads = 0
+                    read_at = time.time()
+                    for frame in reader._decoder.feed(chunk):
+                        tag = parse_tag_read(frame, read_at)
+                        if tag is not None:
+                            reads += 1
+                            TAG_READS.inc()
+                            await self._publish({"event": "tag", "tag": tag})
+                        elif frame.is_error and len(frame.params) and frame.params[0] != ERROR_NO_TAG:
+                            rearm = True
+                    scheduler.record(reads, now)
+                    if rearm:
+                        transport.write(reader._get_multi_inventory_command())
+                        armed_at = time.perf_counter()
+
+                if now >= burst_end:
+                    gap = scheduler.next_gap(now)
+                    if gap > 0:
+                        # Radio off until the next burst; frames still in flight are read afterwards.
+                        transport.write(reader._get_stop_multi_inventory_command())
+                        await asyncio.sleep(gap)
+                        transport.write(reader._get_multi_inventory_command())
+                        armed_at = time.perf_counter()
+                        quiet_since = time.monotonic()
+                    burst_end = time.monotonic() + scheduler.burst
+        finally:
+            if read is not None:
+                read.cancel()
+
+    async def _publish(self, event):
+        await self._queue.put(event) # Blocks when full: backpressure instead of unbounded growth
+
+    def _shutdown_reader(self):
+        reader = self.reader
+        if reader.is_connected and reader.serial_conn and reader.serial_conn.is_open:
+            try:
+                reader.serial_conn.write(reader._get_stop_multi_inventory_command())
+            except serial.SerialException as e:
+                print(f"RFID Engine: Failed to send stop command: {e}")
+        reader.disconnect()
+
+    def queue_depth(self):
+        """Events produced but not yet handled by the consumer."""
+        return self._queue.qsize()
+
+    async def events(self):
+        """Async iterator over reader events."""
+        while True:
+            yield await self._queue.get()
+
+    def __aiter__(self):
+        return self.events()
+
+    # --- Thread-safe control for synchronous (Flask) code ---
+    @property
+    def is_running(self):
+        with self._lock:
+            return self._future is not None and not self._future.done()
+
+    def start(self, on_event):
+        """
+        Starts scanning on the engine's loop thread; `on_event(event)` is called for
+        every event (it may be a plain function or a coroutine function).
+        Returns:
+            bool: False if the engine was already running.
+        """
+        with self._lock:
+            if self._future is not None and not self._future.done():
+                return False
+            self._ensure_loop()
+            self._future = asyncio.run_coroutine_threadsafe(self._serve(on_event), self._loop)
+            return True
+
+    def stop(self):
+        """
+        Cancels scanning. The reader is stopped and disconnected by the loop right away;
+        wait_stopped() waits for that to finish.
+        Returns:
+            bool: False if the engine wasn't running.
+        """
+        with self._lock:
+            if self._future is None or self._future.done():
+                return False
+            self._future.cancel()
+            return True
+
+    def wait_stopped(self, timeout=None):
+        """
+        Waits until the last run has finished shutting down (stop command sent, port closed).
+        stop() only requests the cancellation; the loop thread may still be using the reader
+        for a moment afterwards.
+        Returns:
+            bool: True once nothing is running, False if `timeout` seconds passed first.
+        """
+        with self._lock:
+            loop = self._loop
+        if loop is None:
+            return True
+
+        async def wait_serve_task():
+            task = self._serve_task
+            if task is not None and not task.done():
+                await asyncio.wait({task}, timeout=timeout) # Unlike wait_for(), never cancels the task
+            return task is None or task.done()
+
+        future = asyncio.run_coroutine_threadsafe(wait_serve_task(), loop)
+        try:
+            return future.result(None if timeout is None else timeout + 1.0) # Margin for a busy loop
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            return False
+
+    def _ensure_loop(self):
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+            self._loop_thread = threading.Thread(target=self._loop.run_forever, name="rfid-engine-loop", daemon=True)
+            self._loop_thread.start()
+
+    async def _serve(self, on_event):
+        # A quick stop/start can schedule us while the previous run is still shutting the
+        # reader down; wait for it so it can't disconnect the port from under us.
+        previous = self._serve_task
+        self._serve_task = asyncio.current_task()
+        if previous is not None and not previous.done():
+            await asyncio.gather(previous, return_exceptions=True)
+
+        # Drop events left over from a previous run
+        while not self._queue.empty():
+            self._queue.get_nowait()
+
+        producer = asyncio.create_task(self.run())
+        consumer = asyncio.current_task()
+
+        def on_producer_done(task):
+            # An unexpected crash in the producer must not leave the consumer waiting forever.
+            if not task.cancelled() and task.exception() is not None:
+                print(f"RFID Engine: Reader task failed: {task.exception()}")
+                consumer.cancel()
+
+        producer.add_done_callback(on_producer_done)
+        try:
+            async for event in self.events():
+                result = on_event(event)
+                if asyncio.iscoroutine(result):
+                    await result
+        except Exception as e:
+            print(f"RFID Engine: Exception in event consumer: {e}")
+            raise
+        finally:
+            producer.cancel()
+            await asyncio.gather(producer, return_exceptions=True)
@@ -0,0 +1,266 @@
+# reader_manager.py
+# Several RFID readers (one per evidence pedestal / antenna) merged into one event stream.
+#
+# Every reader gets its own AsyncReaderEngine, so each one connects, streams and
+# reconnects on its own: an unplugged reader only produces error events for itself
+# while the others keep reading. Their events are merged into a single stream, each
+# tagged with the id of the reader it came from.
+#
+# A tag standing between two pedestals is read by both. Reads of one EPC are
+# de-duplicated across readers: the reader that reported it with the strongest RSSI
+# "owns" the tag, and reads of it from other readers are dropped unless they are
+# stronger (by `rssi_margin`) or the owner hasn't seen it for `dedup_window` seconds.
+#
+# How often each reader polls is set by the "poll" section (see poll_scheduler.py), at the
+# top level for every reader and per reader to override single settings.
+#
+# Transmit power, Q and region come from the reader's calibration (see rf_calibration.py),
+# with single values overridden by its "rf" section; they are applied on every connect.
+import contextlib
+import json
+import threading
+import time
+
+from poll_scheduler import scheduler_from_config
+from rf_calibration import validate_rf_settings
+from reader_engine import AsyncReaderEngine
+from rfid_reader import RFIDReader
+import metrics
+
+READS_SUPPRESSED = metrics.counter("rfid_reads_suppressed_total",
+                                   "Reads dropped because another reader sees the same tag more strongly.", ["reader"])
+OWNER_CHANGES = metrics.counter("rfid_tag_owner_changes_total", "Tags handed over to a reader with a stronger signal.")
+
+DEFAULT_READER_CONFIG = {"readers": [{"id": "main", "port": RFIDReader.DEFAULT_SERIAL_PORT}]}
+
+
+def load_reader_config(file_path):
+    """
+    Reads the reader configuration:
+        {"readers": [{"id": "cup", "port": "COM4", "baudrate": 115200, "poll": {...}, "rf": {...}}, ...],
+         "dedup_window": 0.5, "rssi_margin": 3,
+         "poll": {"mode": "adaptive", "latency_slo": 0.3, "duty_cycle": 0.25}}
+    Falls back to a single reader on the default port if the file doesn't exist.
+    Raises:
+        ValueError: If the file has no readers, duplicate reader ids or invalid poll or RF settings.
+    """
+    try:
+        with open(file_path, 'r') as f:
+            config = json.load(f)
+    except FileNotFoundError:
+        print(f"'{file_path}' not found. Using a single reader on {RFIDReader.DEFAULT_SERIAL_PORT}.")
+        return DEFAULT_READER_CONFIG
+    readers = config.get("readers") or []
+    if not readers:
+        raise ValueError(f"No readers configured in '{file_path}'")
+    ids = [reader["id"] for reader in readers]
+    if len(set(ids)) != len(ids):
+        raise ValueError(f"Duplicate reader ids in '{file_path}'")
+    for reader in readers:
+        scheduler_from_config(_poll_config(config, reader)) # Fail at startup, not when the reader starts
+        try:
+            validate_rf_settings(reader.get("rf") or {})
+        except ValueError as e:
+            raise ValueError(f"Reader '{reader['id']}' in '{file_path}': {e}") from e
+    return config
+
+
+def _poll_config(config, reader):
+    return dict(config.get("poll") or {}, **(reader.get("poll") or {}))
+
+
+class _Owner:
+    __slots__ = ("reader_id", "rssi", "last_seen")
+
+    def __init__(self, reader_id, rssi, last_seen):
+        self.reader_id = reader_id
+        self.rssi = rssi
+        self.last_seen = last_seen
+
+
+class ReaderManager:
+    """
+    Runs one AsyncReaderEngine per reader and merges their events.
+
+    Events passed to `on_event` are the engines' events plus a "reader_id" key:
+        {"event": "tag", "tag": TagRead, "reader_id": str}
+        {"event": "error", "message": str, "reader_id": str}
+    start()/stop() are thread-safe, like AsyncReaderEngine's.
+    """
+    DEFAULT_DEDUP_WINDOW = 0.5 # Seconds a reader keeps a tag without reading it again
+    DEFAULT_RSSI_MARGIN = 3 # Raw RSSI units another reader must beat the owner by
+    PRUNE_EVERY = 1024 # Reads between sweeps of stale ownership entries
+    STOP_TIMEOUT = 5.0 # Seconds exclusive() waits for a stopped reader's engine to let go of the port
+
+    def __init__(self, readers, dedup_window=DEFAULT_DEDUP_WINDOW, rssi_margin=DEFAULT_RSSI_MARGIN, engine_options=None,
+                 schedulers=None, rf_overrides=None):
+        """
+        Args:
+            readers (dict): reader id -> RFIDReader.
+            schedulers (dict, optional): reader id -> poll scheduler; others poll continuously.
+            rf_overrides (dict, optional): reader id -> RF settings that win over calibrated ones.
+        """
+        self.readers = dict(readers)
+        self.rf_overrides = dict(rf_overrides or {})
+        self._held = set() # Readers taken out of scanning by exclusive()
+        self._control_lock = threading.Lock() # Serializes start() and exclusive()
+        self.dedup_window = dedup_window
+        self.rssi_margin = rssi_margin
+        self.engines = {reader_id: AsyncReaderEngine(reader, scheduler=(schedulers or {}).get(reader_id),
+                                                     **(engine_options or {}))
+                        for reader_id, reader in self.readers.items()}
+        self._lock = threading.Lock()
+        self._owners = {} # raw EPC bytes -> _Owner
+        self._merged_reads = 0
+        self._stats = {reader_id: {"reads": 0, "forwarded": 0, "suppressed": 0, "errors": 0, "last_read": None, "last_error": None}
+                       for reader_id in self.readers}
+
+    @classmethod
+    def from_config(cls, config, serial_factory=None, calibrations=None):
+        """
+        Builds the manager from load_reader_config() output. `serial_factory(index)`, if given,
+        returns the serial factory for the reader at that position (e.g. to capture or replay it).
+        `calibrations` is rf_calibration.load_calibrations() output.
+        """
+        readers = {}
+        schedulers = {}
+        rf_overrides = {}
+        for index, entry in enumerate(config["readers"]):
+            rf_overrides[entry["id"]] = dict(entry.get("rf") or {})
+            calibrated = ((calibrations or {}).get(entry["id"]) or {}).get("settings") or {}
+            readers[entry["id"]] = RFIDReader(port=entry["port"],
+                                              baudrate=entry.get("baudrate", RFIDReader.DEFAULT_BAUD_RATE),
+                                              serial_factory=serial_factory(index) if serial_factory else None,
+                                              rf_settings=dict(calibrated, **rf_overrides[entry["id"]]) or None)
+            schedulers[entry["id"]] = scheduler_from_config(_poll_config(config, entry))
+        return cls(readers,
+                   dedup_window=config.get("dedup_window", cls.DEFAULT_DEDUP_WINDOW),
+                   rssi_margin=config.get("rssi_margin", cls.DEFAULT_RSSI_MARGIN),
+                   schedulers=schedulers, rf_overrides=rf_overrides)
+
+    # --- Control ---
+    @property
+    def is_running(self):
+        return any(engine.is_running for engine in self.engines.values())
+
+    def start(self, on_event):
+        """
+        Starts every reader that isn't running yet.
+        Returns:
+            bool: False if all of them were already running.
+        """
+        with self._lock:
+            self._owners.clear()
+        started = False
+        with self._control_lock:
+            for reader_id, engine in self.engines.items():
+                if reader_id not in self._held:
+                    started |= engine.start(self._make_handler(reader_id, on_event))
+        return started
+
+    def stop(self):
+        """
+        Stops every reader.
+        Returns:
+            bool: False if none of them was running.
+        """
+        stopped = False
+        for engine in self.engines.values():
+            stopped |= engine.stop()
+        return stopped
+
+    @contextlib.contextmanager
+    def exclusive(self, reader_id):
+        """
+        Hands out a stopped reader for direct use (RF settings, calibration); start() leaves
+        it alone until the block ends, and its port is closed afterwards. If scanning was
+        just stopped, waits for the engine to finish shutting the reader down first.
+        Raises:
+            KeyError: On an unknown reader id.
+            RuntimeError: If the reader is scanning, already in use or still shutting down.
+        """
+        reader = self.readers[reader_id]
+        engine = self.engines[reader_id]
+        with self._control_lock:
+            if reader_id in self._held or engine.is_running:
+                raise RuntimeError(f"Reader '{reader_id}' is busy; stop scanning first")
+            self._held.add(reader_id)
+        if not engine.wait_stopped(self.STOP_TIMEOUT):
+            # The engine may still touch the port, so don't close it from here
+            with self._control_lock:
+                self._held.discard(reader_id)
+            raise RuntimeError(f"Reader '{reader_id}' is still shutting down; try again")
+        try:
+            yield reader
+        finally:
+            reader.disconnect()
+            with self._control_lock:
+                self._held.discard(reader_id)
+
+    def set_rf_settings(self, reader_id, settings):
+        """New calibrated settings for a reader, applied from its next connect (its "rf" overrides still win)."""
+        self.readers[reader_id].rf_settings = dict(settings, **self.rf_overrides.get(reader_id, {})) or None
+
+    def queue_depth(self):
+        return sum(engine.queue_depth() for engine in self.engines.values())
+
+    def status(self):
+        """Per-reader port, state, counters, current poll rate and RF settings."""
+        with self._lock:
+            stats = {reader_id: dict(values) for reader_id, values in self._stats.items()}
+        return {
+            reader_id: dict(stats[reader_id], port=reader.port, running=self.engines[reader_id].is_running,
+                            connected=reader.is_connected, poll=self.engines[reader_id].scheduler.status(),
+                            rf=reader.rf_settings, busy=reader_id in self._held)
+            for reader_id, reader in self.readers.items()
+        }
+
+    def owner(self, epc):
+        """Id of the reader currently credited with a tag (raw EPC bytes), or None."""
+        with self._lock:
+            owner = self._owners.get(epc)
+            return owner.reader_id if owner is not None else None
+
+    # --- Merging ---
+    def _make_handler(self, reader_id, on_event):
+        # Runs on that reader's engine loop; each reader has its own, so a slow or
+        # failing reader never blocks the others.
+        def handle(event):
+            event["reader_id"] = reader_id
+            if event["event"] == "tag":
+                if not self._accept(reader_id, event["tag"]):
+                    return None
+            else:
+                with self._lock:
+                    self._stats[reader_id]["errors"] += 1
+                    self._stats[reader_id]["last_error"] = event.get("message")
+            return on_event(event)
+        return handle
+
+    def _accept(self, reader_id, tag):
+        """Decides whether a read is forwarded (see the module comment)."""
+        with self._lock:
+            stats = self._stats[reader_id]
+            stats["reads"] += 1
+            stats["last_read"] = tag.timestamp
+            owner = self._owners.get(tag.epc)
+            if owner is None or owner.reader_id == reader_id or (tag.timestamp - owner.last_seen) > self.dedup_window:
+                if owner is None:
+                    self._owners[tag.epc] = _Owner(reader_id, tag.rssi, tag.timestamp)
+                else:
+                    owner.reader_id, owner.rssi, owner.last_seen = reader_id, tag.rssi, tag.timestamp
+            elif tag.rssi > owner.rssi + self.rssi_margin:
+                owner.reader_id, owner.rssi, owner.last_seen = reader_id, tag.rssi, tag.timestamp
+                OWNER_CHANGES.inc()
+            else:
+                stats["suppressed"] += 1
+                READS_SUPPRESSED.labels(reader_id).inc()
+                return False
+            stats["forwarded"] += 1
+
+            self._merged_reads += 1
+            if self._merged_reads % self.PRUNE_EVERY == 0:
+                cutoff = time.time() - 10 * self.dedup_window
+                for epc in [epc for epc, entry in self._owners.items() if entry.last_seen < cutoff]:
+                    del self._owners[epc]
+            return True
@@ -0,0 +1,225 @@
+# reader_service.py
+# One long-lived RFID reader shared by every HTTP scan request in the process.
+#
+# Instead of each /api/scan_tag call opening the port, polling and closing it again,
+# callers subscribe to a single in-flight multi-poll inventory run by a worker thread.
+# Every read is appended to a short history and kept in a cache of recent reads, so:
+#   - concurrent callers all receive the first matching read after they joined, and
+#   - a caller whose tag was seen within the freshness window is answered immediately.
+#
+# Reads and reader errors also go into a longer feed ring with the same sequence numbers,
+# which feed() follows for streaming clients (Server-Sent Events in app.py): a follower
+# resuming from a sequence number gets exactly the events after it, as long as they are
+# still in the ring.
+import itertools
+import threading
+import time
+from collections import deque
+
+import serial
+
+from rfid_reader import RFIDReader
+from epc_mappings import get_name_for_epc
+import metrics
+
+SERVICE_SCANS = metrics.counter("rfid_service_scans_total",
+                                "Scan requests answered by the shared reader, by how they were answered.", ["result"])
+SERVICE_SCAN_SECONDS = metrics.histogram("rfid_service_scan_seconds", "Time to answer a scan request.")
+
+
+class ReaderService:
+    DEFAULT_FRESHNESS_MS = 500 # A cached read younger than this answers a request without waiting
+    IDLE_STOP_SECONDS = 5.0 # Stop the inventory (port stays open) after this long without callers
+    HISTORY_SIZE = 64 # Recent reads kept for waiters that haven't looked yet
+    FEED_SIZE = 1024 # Recent reads and errors kept for feed() followers to resume from
+    FEED_KEEPALIVE_SECONDS = 15.0
+
+    def __init__(self, reader=None, freshness_ms=DEFAULT_FRESHNESS_MS, idle_stop_seconds=IDLE_STOP_SECONDS):
+        self.reader = reader if reader is not None else RFIDReader()
+        self.freshness_ms = freshness_ms
+        self.idle_stop_seconds = idle_stop_seconds
+
+        self._cond = threading.Condition()
+        self._recent = {} # raw EPC bytes -> latest TagRead
+        self._history = deque(maxlen=self.HISTORY_SIZE) # (seq, TagRead)
+        self._feed = deque(maxlen=self.FEED_SIZE) # [seq, event, encoded event or None]; seqs are consecutive
+        self._seq = 0
+        self._error = None # (seq, message) of the last worker failure
+        self._waiters = 0
+        self._last_waiter_time = 0.0
+        self._worker = None
+        self._stop_event = threading.Event()
+
+    def scan(self, timeout=10, freshness_ms=None, epc=None, item_name=None):
+        """
+        Returns the first read matching the filters, the same dict shape as
+        RFIDReader.scan_single_tag(), plus "cached": True when answered from the cache.
+
+        Args:
+            timeout (float): Maximum seconds to wait for a new read. 0 only checks the cache.
+            freshness_ms (int, optional): Override for the cache freshness window.
+            epc (str, optional): Only accept this EPC (hex, case-insensitive).
+            item_name (str, optional): Only accept tags mapped to this item name.
+        """
+        started = time.perf_counter()
+        result = self._scan(timeout, freshness_ms, epc, item_name)
+        SERVICE_SCAN_SECONDS.observe(time.perf_counter() - started)
+        SERVICE_SCANS.labels("cached" if result.get("cached") else result["status"]).inc()
+        return result
+
+    def _scan(self, timeout, freshness_ms, epc, item_name):
+        if freshness_ms is None:
+            freshness_ms = self.freshness_ms
+        wanted_epc = epc.upper() if epc else None
+
+        def matches(tag):
+            if wanted_epc is not None and tag.epc_hex != wanted_epc:
+                return False
+            if item_name is not None and get_name_for_epc(tag.epc) != item_name:
+                return False
+            return True
+
+        with self._cond:
+            cutoff = time.time() - freshness_ms / 1000.0
+            fresh = [tag for tag in self._recent.values() if tag.timestamp >= cutoff and matches(tag)]
+            if fresh:
+                result = max(fresh, key=lambda tag: tag.timestamp).to_dict()
+                result["cached"] = True
+                return result
+            if not timeout or timeout <= 0:
+                return {"status": "no_tag_found", "message": "No tag found in inventory."}
+
+            checked_seq = joined_seq = self._seq
+            deadline = time.monotonic() + timeout
+            self._waiters += 1
+            try:
+                self._ensure_worker()
+                while True:
+                    for seq, tag in self._history:
+                        if seq > checked_seq and matches(tag):
+                            return tag.to_dict()
+                    if self._error is not None and self._error[0] > joined_seq:
+                        return {"status": "error", "message": self._error[1]}
+                    checked_seq = self._seq
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return {"status": "no_tag_found", "message": f"Timeout: No tag found within {timeout} seconds."}
+                    self._cond.wait(remaining)
+            finally:
+                self._release_waiter()
+
+    def feed(self, last_seq=None, encode=None, keepalive=FEED_KEEPALIVE_SECONDS):
+        """
+        Follows the reader, keeping the inventory running while the generator is open.
+
+        Args:
+            last_seq (int, optional): Resume after this sequence number; None starts from now.
+            encode (callable, optional): encode(seq, event), applied once per event and shared
+                                         by all followers (e.g. to format it for the wire).
+            keepalive (float): Seconds without events after which None is yielded.
+        Yields:
+            tuple: (seq, event, encoded event or None), in order. Events are {"event": "tag", "tag": TagRead}
+                   or {"event": "error", "message": str}. If events after `last_seq` are no longer
+                   in the ring (or `last_seq` is from before a restart), (None, {"event": "gap",
+                   "missed": int or None}, None) comes first, followed by the whole ring.
+            None: After `keepalive` seconds without events.
+        """
+        with self._cond:
+            self._waiters += 1
+            self._ensure_worker()
+            cursor = self._seq if last_seq is None else last_seq
+            restarted = cursor > self._seq
+        try:
+            if restarted:
+                # A cursor from before a restart: its events are gone, resend the whole ring
+                cursor = self._feed[0][0] - 1 if self._feed else 0
+                yield None, {"event": "gap", "missed": None}, None
+            while True:
+                with self._cond:
+                    if cursor >= self._seq:
+                        self._cond.wait(keepalive)
+                    missed, entries = self._feed_after(cursor)
+                if missed:
+                    yield None, {"event": "gap", "missed": missed}, None
+                if not entries:
+                    yield None
+                    continue
+                for entry in entries:
+                    if encode is not None and entry[2] is None:
+                        entry[2] = encode(entry[0], entry[1])
+                    cursor = entry[0]
+                    yield entry[0], entry[1], entry[2]
+        finally:
+            with self._cond:
+                self._release_waiter()
+
+    def _feed_after(self, cursor):
+        """(number of events missed, feed entries after `cursor`). Called with self._cond held."""
+        if not self._feed or cursor >= self._seq:
+            return 0, []
+        first_seq = self._feed[0][0]
+        if cursor < first_seq - 1:
+            return first_seq - 1 - cursor, list(self._feed) # Fell out of the ring
+        return 0, list(itertools.islice(self._feed, cursor - first_seq + 1, None))
+
+    def _release_waiter(self):
+        # Called with self._cond held
+        self._waiters -= 1
+        self._last_waiter_time = time.monotonic()
+        if not self._waiters:
+            idle_timer = threading.Timer(self.idle_stop_seconds + 0.1, self._stop_if_idle)
+            idle_timer.daemon = True
+            idle_timer.start()
+
+    def close(self):
+        """Stops the inventory worker and closes the serial port."""
+        self._stop_event.set()
+        worker = self._worker
+        if worker is not None:
+            worker.join(timeout=self.reader.timeout + 1)
+        self.reader.disconnect()
+
+    def _ensure_worker(self):
+        # Called with self._cond held. A worker that is winding down sees the new
+        # waiter when it re-checks under the lock and keeps going.
+        self._stop_event.clear()
+        if self._worker is not None:
+            return
+        self._worker = threading.Thread(target=self._run_inventory, name="rfid-reader-service", daemon=True)
+        self._worker.start()
+
+    def _run_inventory(self):
+        while True:
+            failed = False
+            try:
+                # The port stays open after the inventory stops; continuous_inventory only
+                # disconnects ports it opened itself, so connect first.
+                if not self.reader.connect():
+                    raise serial.SerialException(f"Failed to connect to serial port {self.reader.port}")
+                for tag in self.reader.continuous_inventory(stop_event=self._stop_event):
+                    with self._cond:
+                        self._seq += 1
+                        self._recent[tag.epc] = tag
+                        self._history.append((self._seq, tag))
+                        self._feed.append([self._seq, {"event": "tag", "tag": tag}, None])
+                        self._cond.notify_all()
+            except serial.SerialException as e:
+                print(f"Reader service: serial error: {e}")
+                failed = True
+                self.reader.disconnect()
+                with self._cond:
+                    self._seq += 1
+                    self._error = (self._seq, f"Serial communication error during scan: {str(e)}")
+                    self._feed.append([self._seq, {"event": "error", "message": self._error[1]}, None])
+                    self._cond.notify_all()
+
+            with self._cond:
+                if failed or not self._waiters:
+                    self._worker = None
+                    return
+                self._stop_event.clear() # Someone subscribed while we were stopping
+
+    def _stop_if_idle(self):
+        with self._cond:
+            if not self._waiters and (time.monotonic() - self._last_waiter_time) >= self.idle_stop_seconds:
+                self._stop_event.set()
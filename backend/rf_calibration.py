@@ -0,0 +1,246 @@
+# rf_calibration.py
+# Picks the transmit power and Q that read a pedestal's own tags fastest without picking
+# up anything else (props on the neighbouring pedestal, visitors' badges).
+#
+# calibrate() tries every combination of the given powers and Q values. For each one it
+# runs a multi-poll inventory for `dwell` seconds, with the pedestal's tags in place,
+# and measures:
+#   coverage    - fraction of the known tags read at least once
+#   reads/s     - reads of known tags per second
+#   cross reads - reads of any other tag, and how many distinct tags that was
+# The best setting sees the most known tags, then the fewest foreign tags (and reads),
+# then has the most reads/s; lower power breaks ties. It is left applied on the reader
+# and saved per reader id in data/rf_calibration.json:
+#   {"main": {"settings": {"power_dbm": 20.0, "q": 3}, "measured": {...},
+#             "candidates": [...], "known_tags": [...], "calibrated_at": 1700000000.0}}
+# ReaderManager.from_config() applies the saved settings whenever a reader connects; a
+# reader's "rf" section in readers.json overrides single values.
+#
+#   python rf_calibration.py --reader main --tags cup knife
+#   python rf_calibration.py --port COM5 --tags E280F3372000F0000FDAE3BA --powers 18 20 22 --dwell 2
+import argparse
+import json
+import os
+import sys
+import time
+
+from epc_mappings import CATALOG
+from rfid_frames import REGIONS
+
+CALIBRATION_FILE_PATH = os.path.join(os.path.dirname(__file__), 'data', 'rf_calibration.json')
+READERS_FILE_PATH = os.path.join(os.path.dirname(__file__), 'data', 'readers.json') # For the command line
+
+DEFAULT_POWERS = (15.0, 18.0, 20.0, 22.0, 24.0, 26.0) # dBm
+DEFAULT_Q_VALUES = (2, 3, 4, 5)
+DEFAULT_DWELL = 1.0 # Seconds of inventory per setting
+RF_SETTING_KEYS = ("region", "hopping", "channel", "power_dbm", "q")
+
+
+def validate_rf_settings(settings):
+    """
+    Checks an RF settings dict ({"region", "hopping", "channel", "power_dbm", "q"}, all optional).
+    Raises:
+        ValueError: On unknown keys or values out of range.
+    """
+    if not isinstance(settings, dict):
+        raise ValueError("RF settings must be an object")
+    unknown = set(settings) - set(RF_SETTING_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown RF settings: {', '.join(sorted(unknown))}")
+    if settings.get("region") is not None and settings["region"] not in REGIONS:
+        raise ValueError(f"Unknown region '{settings['region']}' (one of {', '.join(REGIONS)})")
+    if settings.get("hopping") is not None and not isinstance(settings["hopping"], bool):
+        raise ValueError("hopping must be true or false")
+    if settings.get("channel") is not None and not (isinstance(settings["channel"], int) and 0 <= settings["channel"] <= 255):
+        raise ValueError("channel must be a channel index (0-255)")
+    if settings.get("power_dbm") is not None and not (isinstance(settings["power_dbm"], (int, float)) and 0 <= settings["power_dbm"] <= 33):
+        raise ValueError("power_dbm must be between 0 and 33")
+    if settings.get("q") is not None and not (isinstance(settings["q"], int) and 0 <= settings["q"] <= 15):
+        raise ValueError("q must be an integer between 0 and 15")
+
+
+def load_calibrations(file_path=CALIBRATION_FILE_PATH):
+    """
+    Saved calibrations by reader id ({} if the file doesn't exist).
+    Raises:
+        ValueError: If the file is malformed or holds invalid settings.
+    """
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            calibrations = json.load(f)
+    except FileNotFoundError:
+        return {}
+    if not isinstance(calibrations, dict):
+        raise ValueError(f"'{file_path}' must map reader ids to calibrations")
+    for reader_id, calibration in calibrations.items():
+        try:
+            validate_rf_settings(calibration.get("settings") or {})
+        except (AttributeError, ValueError) as e:
+            raise ValueError(f"Invalid calibration for reader '{reader_id}' in '{file_path}': {e}") from e
+    return calibrations
+
+
+def save_calibration(reader_id, calibration, file_path=CALIBRATION_FILE_PATH):
+    """Stores one reader's calibration, keeping the others (temp file + atomic rename)."""
+    try:
+        calibrations = load_calibrations(file_path)
+    except ValueError as e:
+        print(f"Replacing unreadable calibration file: {e}")
+        calibrations = {}
+    calibrations[reader_id] = calibration
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(calibrations, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, file_path)
+
+
+def resolve_known_tags(tags):
+    """
+    Raw EPCs for a list of EPC hex strings and/or item names from the EPC catalog.
+    Raises:
+        ValueError: If an entry is neither hex nor a name with exact EPCs in the catalog.
+    """
+    epcs = set()
+    for tag in tags:
+        try:
+            epcs.add(bytes.fromhex(tag))
+            continue
+        except (TypeError, ValueError):
+            pass
+        named = CATALOG.epcs_for(tag)
+        if not named:
+            raise ValueError(f"'{tag}' is neither an EPC nor an item with exact EPCs in the catalog")
+        epcs.update(named)
+    if not epcs:
+        raise ValueError("No known tags given")
+    return epcs
+
+
+def measure(reader, known_epcs, dwell=DEFAULT_DWELL):
+    """
+    Runs the reader's inventory for `dwell` seconds with its current settings.
+    Returns:
+        dict: coverage, reads_per_second, slowest_tag_reads_per_second, cross_reads and cross_tags.
+    """
+    counts = {}
+    started = time.monotonic()
+    for tag in reader.continuous_inventory(duration=dwell):
+        counts[tag.epc] = counts.get(tag.epc, 0) + 1
+    elapsed = max(time.monotonic() - started, 1e-6)
+    own = [counts.get(epc, 0) for epc in known_epcs]
+    foreign = {epc: count for epc, count in counts.items() if epc not in known_epcs}
+    return {
+        "coverage": sum(1 for count in own if count) / len(own),
+        "reads_per_second": round(sum(own) / elapsed, 2),
+        "slowest_tag_reads_per_second": round(min(own) / elapsed, 2),
+        "cross_reads": sum(foreign.values()),
+        "cross_tags": len(foreign),
+    }
+
+
+def _rank(candidate):
+    measured = candidate["measured"]
+    return (-measured["coverage"], measured["cross_tags"], measured["cross_reads"], -measured["reads_per_second"],
+            candidate["settings"]["power_dbm"])
+
+
+def calibrate(reader, known_epcs, powers=DEFAULT_POWERS, q_values=DEFAULT_Q_VALUES, dwell=DEFAULT_DWELL,
+              progress=None, stop_event=None):
+    """
+    Sweeps power x Q on a reader that isn't scanning and leaves the best setting applied.
+
+    Args:
+        reader (RFIDReader): The reader; its port is opened if needed and left open.
+        known_epcs (set): Raw EPCs of the tags that belong to this reader.
+        progress (callable, optional): Called as progress(done, total, candidate) after each setting.
+        stop_event (threading.Event, optional): Cancels the sweep; the original settings are restored.
+    Returns:
+        dict: {"settings", "measured", "candidates", "known_tags", "region", "dwell", "calibrated_at"},
+              or None if cancelled.
+    Raises:
+        ValueError: If there are no known tags or nothing to sweep.
+        serial.SerialException: If the reader fails (the original settings are restored if possible).
+    """
+    known_epcs = set(known_epcs)
+    if not known_epcs or not powers or not q_values:
+        raise ValueError("Calibration needs known tags, powers and Q values")
+    original = reader.get_rf_settings()
+    candidates = []
+    total = len(powers) * len(q_values)
+    finished = False
+    try:
+        for q in q_values:
+            reader.set_q(q)
+            for power in sorted(powers):
+                if stop_event is not None and stop_event.is_set():
+                    return None
+                reader.set_power(power)
+                candidate = {"settings": {"power_dbm": float(power), "q": q}, "measured": measure(reader, known_epcs, dwell)}
+                candidates.append(candidate)
+                if progress is not None:
+                    progress(len(candidates), total, candidate)
+        best = min(candidates, key=_rank)
+        reader.apply_rf_settings(best["settings"])
+        finished = True
+    finally:
+        if not finished:
+            try:
+                reader.apply_rf_settings({"power_dbm": original["power_dbm"], "q": original["q"]})
+            except Exception as e:
+                print(f"RF calibration: Failed to restore the original settings: {e}")
+    return {
+        "settings": best["settings"],
+        "measured": best["measured"],
+        "candidates": candidates,
+        "known_tags": sorted(epc.hex().upper() for epc in known_epcs),
+        "region": original["region"],
+        "dwell": dwell,
+        "calibrated_at": time.time(),
+    }
+
+
+def main(argv=None):
+    from reader_manager import load_reader_config
+    from rfid_reader import RFIDReader
+
+    parser = argparse.ArgumentParser(description="Calibrate a reader's transmit power and Q against its known tags.")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--reader", help="reader id from data/readers.json")
+    target.add_argument("--port", help="serial port of a reader not listed in data/readers.json")
+    parser.add_argument("--tags", nargs="+", required=True, help="EPCs (hex) or catalog item names of the reader's own tags")
+    parser.add_argument("--powers", nargs="+", type=float, default=DEFAULT_POWERS, help="dBm values to try")
+    parser.add_argument("--q", nargs="+", type=int, default=DEFAULT_Q_VALUES, dest="q_values", help="Q values to try")
+    parser.add_argument("--dwell", type=float, default=DEFAULT_DWELL, help="seconds of inventory per setting")
+    parser.add_argument("--no-save", action="store_true", help="apply the result without saving it")
+    args = parser.parse_args(argv)
+
+    if args.reader:
+        entries = {entry["id"]: entry for entry in load_reader_config(READERS_FILE_PATH)["readers"]}
+        if args.reader not in entries:
+            parser.error(f"Unknown reader '{args.reader}'")
+        reader_id, port = args.reader, entries[args.reader]["port"]
+    else:
+        reader_id, port = args.port, args.port
+    reader = RFIDReader(port=port)
+
+    def report(done, total, candidate):
+        settings, measured = candidate["settings"], candidate["measured"]
+        print(f"[{done}/{total}] {settings['power_dbm']:5.1f} dBm  Q={settings['q']:<2}  "
+              f"coverage {measured['coverage']:.0%}  {measured['reads_per_second']:7.1f} reads/s  "
+              f"{measured['cross_tags']} foreign tags ({measured['cross_reads']} reads)")
+
+    try:
+        result = calibrate(reader, resolve_known_tags(args.tags), args.powers, args.q_values, args.dwell, progress=report)
+    finally:
+        reader.disconnect()
+    print(f"Best: {result['settings']} -> {result['measured']}")
+    if not args.no_save:
+        save_calibration(reader_id, result)
+        print(f"Saved for reader '{reader_id}' in {CALIBRATION_FILE_PATH}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,295 @@
+# rfid_frames.py
+# Frame level protocol helpers for the E720 reader module.
+#
+# Every frame on the wire looks like:
+#   BB | Type | Command | PL(MSB) | PL(LSB) | Params (PL bytes) | Checksum | 7E
+# where Checksum is the low byte of the sum of Type..Params.
+import metrics
+
+FRAMES_DECODED = metrics.counter("rfid_frames_decoded_total", "Valid frames decoded from reader bytes.")
+FRAME_ERRORS = metrics.counter("rfid_frame_errors_total", "Candidate frames rejected by the decoder.", ["type"])
+GARBAGE_BYTES = metrics.counter("rfid_garbage_bytes_total", "Received bytes skipped while resynchronizing.")
+
+FRAME_HEADER = 0xBB
+FRAME_END = 0x7E
+MIN_FRAME_LEN = 7 # Header + Type + Cmd + PL(2) + Checksum + End, no params
+
+# Frame types
+FRAME_TYPE_COMMAND = 0x00
+FRAME_TYPE_RESPONSE = 0x01
+FRAME_TYPE_NOTIFICATION = 0x02
+
+# Command codes we care about when decoding
+CMD_SINGLE_INVENTORY = 0x22 # Also the command code of every tag notification
+CMD_MULTI_INVENTORY = 0x27
+CMD_STOP_MULTI_INVENTORY = 0x28
+CMD_ERROR = 0xFF
+
+# RF settings commands (each answered by a response frame with the same command code)
+CMD_SET_REGION = 0x07
+CMD_GET_REGION = 0x08
+CMD_GET_QUERY = 0x0D
+CMD_SET_QUERY = 0x0E
+CMD_GET_CHANNEL = 0xAA
+CMD_SET_CHANNEL = 0xAB
+CMD_SET_HOPPING = 0xAD
+CMD_SET_POWER = 0xB6
+CMD_GET_POWER = 0xB7
+
+# Error codes carried in the first parameter byte of an error frame
+ERROR_NO_TAG = 0x15
+
+# Tag notification payload: RSSI(1) + PC(2) + EPC(12) + Tag_CRC(2) = 17 bytes
+TAG_PARAMS_LEN = 17
+
+# Regulatory regions: name -> (code, first channel in MHz, channel spacing in MHz)
+REGIONS = {
+    "china_900": (0x01, 920.125, 0.25),
+    "us": (0x02, 902.25, 0.5),
+    "europe": (0x03, 865.1, 0.2),
+    "china_800": (0x04, 840.125, 0.25),
+    "korea": (0x06, 917.1, 0.2),
+}
+REGION_NAMES = {code: name for name, (code, _, _) in REGIONS.items()}
+
+
+def calculate_checksum(data_list):
+    """Calculates the checksum for the given list of byte values."""
+    return sum(data_list) & 0xFF
+
+
+def build_frame(frame_type, command, params=b""):
+    """Encodes one frame: BB | Type | Cmd | PL(2) | Params | Checksum | 7E."""
+    body = bytes([frame_type, command, (len(params) >> 8) & 0xFF, len(params) & 0xFF]) + bytes(params)
+    return bytes([FRAME_HEADER]) + body + bytes([calculate_checksum(body), FRAME_END])
+
+
+def build_tag_notification(epc, rssi=0xC8, pc=b"\x30\x00", crc=b"\x00\x00"):
+    """A tag notification frame as the reader sends it (for simulations and replays)."""
+    return build_frame(FRAME_TYPE_NOTIFICATION, CMD_SINGLE_INVENTORY, bytes([rssi]) + bytes(pc) + bytes(epc) + bytes(crc))
+
+
+class Frame:
+    """A single, checksum-verified frame received from the reader.
+
+    `raw` holds the complete frame bytes; `params` is a memoryview slice of
+    `raw`, so reading the parameters never copies the frame again.
+    """
+    __slots__ = ("raw", "frame_type", "command", "params")
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.frame_type = raw[1]
+        self.command = raw[2]
+        self.params = memoryview(raw)[5:-2]
+
+    @property
+    def is_notification(self):
+        return self.frame_type == FRAME_TYPE_NOTIFICATION
+
+    @property
+    def is_error(self):
+        return self.frame_type == FRAME_TYPE_RESPONSE and self.command == CMD_ERROR
+
+    def hex(self):
+        return self.raw.hex().upper()
+
+    def __repr__(self):
+        return f"Frame(type={self.frame_type:02X}, cmd={self.command:02X}, params={len(self.params)} bytes)"
+
+
+class FrameDecoder:
+    """Incremental, resynchronizing decoder for the reader's byte stream.
+
+    Feed it whatever bytes the serial port has available; it keeps a persistent
+    receive buffer and returns every complete frame found so far. Partial frames
+    stay buffered until the rest arrives. Corrupt data (bad frame type, length, end
+    byte or checksum) is skipped one byte at a time until the next valid 0xBB header,
+    so a single bad byte never takes the following frames down with it.
+    """
+    MAX_PARAM_LEN = 512 # Largest payload the E720 sends; anything bigger is a false header
+
+    def __init__(self, max_param_len=MAX_PARAM_LEN):
+        self.max_param_len = max_param_len
+        self._buffer = bytearray()
+        self.frames_decoded = 0
+        self.errors = {"checksum": 0, "frame_type": 0, "length": 0, "end_byte": 0, "garbage_bytes": 0}
+
+    def reset(self):
+        """Drops any buffered partial frame (e.g. after reconnecting)."""
+        self._buffer.clear()
+
+    @property
+    def buffered(self):
+        """Number of bytes waiting for the rest of their frame."""
+        return len(self._buffer)
+
+    def feed(self, data):
+        """Appends received bytes and returns a list of all complete frames."""
+        if data:
+            self._buffer += data
+        return self._drain()
+
+    def _drain(self):
+        frames = []
+        buf = self._buffer
+        buf_len = len(buf)
+        pos = 0
+        with memoryview(buf) as view:
+            while True:
+                start = buf.find(FRAME_HEADER, pos)
+                if start < 0:
+                    # No header anywhere in the rest of the buffer: all of it is noise.
+                    self.errors["garbage_bytes"] += buf_len - pos
+                    GARBAGE_BYTES.inc(buf_len - pos)
+                    pos = buf_len
+                    break
+                if start > pos:
+                    self.errors["garbage_bytes"] += start - pos
+                    GARBAGE_BYTES.inc(start - pos)
+                    pos = start
+
+                if buf_len - pos > 1 and buf[pos + 1] > FRAME_TYPE_NOTIFICATION:
+                    # A 0xBB inside other data: don't wait for a body its bogus length promises
+                    self.errors["frame_type"] += 1
+                    FRAME_ERRORS.labels("frame_type").inc()
+                    pos += 1
+                    continue
+
+                if buf_len - pos < MIN_FRAME_LEN:
+                    break # Need more bytes to even read the header
+
+                param_len = (buf[pos + 3] << 8) | buf[pos + 4]
+                if param_len > self.max_param_len:
+                    self.errors["length"] += 1
+                    FRAME_ERRORS.labels("length").inc()
+                    pos += 1 # Not a real header, resync on the next 0xBB
+                    continue
+
+                end = pos + MIN_FRAME_LEN + param_len
+                if end > buf_len:
+                    break # Frame not complete yet, wait for more bytes
+
+                if buf[end - 1] != FRAME_END:
+                    self.errors["end_byte"] += 1
+                    FRAME_ERRORS.labels("end_byte").inc()
+                    pos += 1
+                    continue
+
+                if (sum(view[pos + 1:end - 2]) & 0xFF) != buf[end - 2]:
+                    self.errors["checksum"] += 1
+                    FRAME_ERRORS.labels("checksum").inc()
+                    pos += 1
+                    continue
+
+                frames.append(Frame(bytes(view[pos:end])))
+                pos = end
+
+        if pos:
+            del buf[:pos]
+        if frames:
+            self.frames_decoded += len(frames)
+            FRAMES_DECODED.inc(len(frames))
+        return frames
+
+
+class TagRead:
+    """One tag observation: EPC, PC, RSSI and the time it was received."""
+    __slots__ = ("epc", "pc", "rssi", "timestamp")
+
+    def __init__(self, epc, pc, rssi, timestamp):
+        self.epc = epc # raw EPC bytes
+        self.pc = pc # raw PC bytes
+        self.rssi = rssi
+        self.timestamp = timestamp # time.time() when the frame was decoded
+
+    @property
+    def epc_hex(self):
+        return self.epc.hex().upper()
+
+    @property
+    def pc_hex(self):
+        return self.pc.hex().upper()
+
+    def to_dict(self):
+        """Same shape as a successful RFIDReader scan result."""
+        return {
+            "status": "success",
+            "epc_hex": self.epc_hex,
+            "rssi_dbm": self.rssi,
+            "pc_hex": self.pc_hex,
+            "message": "Tag found."
+        }
+
+    def __repr__(self):
+        return f"TagRead(epc={self.epc_hex}, rssi={self.rssi}, t={self.timestamp:.3f})"
+
+
+def parse_tag_read(frame, timestamp):
+    """Returns a TagRead for a tag notification frame, or None if the frame isn't one."""
+    if frame.frame_type != FRAME_TYPE_NOTIFICATION or frame.command != CMD_SINGLE_INVENTORY:
+        return None
+    params = frame.params
+    if len(params) != TAG_PARAMS_LEN:
+        return None
+    # RSSI is passed through raw, same as the single-scan path.
+    return TagRead(bytes(params[3:15]), bytes(params[1:3]), params[0], timestamp)
+
+
+def channel_frequency(region, channel):
+    """Centre frequency in MHz of a channel index in a region (see REGIONS)."""
+    _, first, spacing = REGIONS[region]
+    return round(first + channel * spacing, 3)
+
+
+def encode_power(dbm):
+    """Transmit power as the reader expects it: dBm x 100, 2 bytes big-endian."""
+    value = int(round(dbm * 100))
+    if not 0 <= value <= 0xFFFF:
+        raise ValueError(f"Power out of range: {dbm} dBm")
+    return value.to_bytes(2, "big")
+
+
+def decode_power(params):
+    return int.from_bytes(bytes(params[:2]), "big") / 100.0
+
+
+class QueryParameters:
+    """
+    The Gen2 Query command parameters the reader uses for inventory rounds.
+
+    Packed into 2 bytes: DR(1) M(2) TRext(1) Sel(2) Session(2) | Target(1) Q(4) reserved(3).
+    `q` sets the number of slots per round (2^Q): too low and tags collide, too high and
+    rounds are mostly empty slots.
+    """
+    __slots__ = ("dr", "m", "trext", "sel", "session", "target", "q")
+    FIELDS = __slots__
+
+    def __init__(self, dr=0, m=0, trext=1, sel=0, session=0, target=0, q=4):
+        self.dr = dr # Divide ratio: 0 = DR 8
+        self.m = m # Cycles per symbol: 0 = FM0
+        self.trext = trext # Pilot tone
+        self.sel = sel # Which tags respond: 0/1 all, 2 ~SL, 3 SL
+        self.session = session # S0-S3
+        self.target = target # Inventoried flag: 0 = A, 1 = B
+        self.q = q # 0-15
+        if not 0 <= q <= 15:
+            raise ValueError(f"Q must be 0-15, got {q}")
+
+    @classmethod
+    def from_bytes(cls, params):
+        high, low = params[0], params[1]
+        return cls(dr=high >> 7, m=(high >> 5) & 0x03, trext=(high >> 4) & 0x01, sel=(high >> 2) & 0x03,
+                   session=high & 0x03, target=low >> 7, q=(low >> 3) & 0x0F)
+
+    def to_bytes(self):
+        return bytes([
+            (self.dr & 0x01) << 7 | (self.m & 0x03) << 5 | (self.trext & 0x01) << 4 | (self.sel & 0x03) << 2 | (self.session & 0x03),
+            (self.target & 0x01) << 7 | (self.q & 0x0F) << 3,
+        ])
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def __repr__(self):
+        return f"QueryParameters({', '.join(f'{field}={getattr(self, field)}' for field in self.FIELDS)})"
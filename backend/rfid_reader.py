@@ -1,22 +1,58 @@
 import serial
 import time
+from collections import deque
+import metrics
 from epc_mappings import get_name_for_epc # epc_mappings is in the same directory
+from rfid_frames import (build_frame, calculate_checksum, Frame, FrameDecoder, parse_tag_read, QueryParameters,
+                         channel_frequency, encode_power, decode_power, REGIONS, REGION_NAMES,
+                         FRAME_TYPE_COMMAND, FRAME_TYPE_NOTIFICATION, FRAME_TYPE_RESPONSE, CMD_SINGLE_INVENTORY,
+                         CMD_MULTI_INVENTORY, CMD_STOP_MULTI_INVENTORY, ERROR_NO_TAG, TAG_PARAMS_LEN,
+                         CMD_SET_REGION, CMD_GET_REGION, CMD_GET_QUERY, CMD_SET_QUERY, CMD_GET_CHANNEL,
+                         CMD_SET_CHANNEL, CMD_SET_HOPPING, CMD_SET_POWER, CMD_GET_POWER)
 
-# Module-level helper function for checksum calculation
-def calculate_checksum(data_list):
-    """Calculates the checksum for the given list of byte values."""
-    return sum(data_list) & 0xFF
+SCAN_ATTEMPTS = metrics.counter("rfid_scan_attempts_total", "Single-scan attempts by result.", ["result"])
+SERIAL_ROUND_TRIP = metrics.histogram("rfid_serial_round_trip_seconds",
+                                      "Time from sending an inventory command to the reader's first answer.", ["mode"])
+EMPTY_POLLS = metrics.counter("rfid_empty_polls_total",
+                              "Inventory rounds that found no tag (single) or went silent and were re-armed (multi).", ["mode"])
+RECONNECTS = metrics.counter("rfid_reconnects_total", "Serial port re-opened after an earlier connection.")
+CONNECT_FAILURES = metrics.counter("rfid_connect_failures_total", "Failed attempts to open the serial port.")
+COMMANDS = metrics.counter("rfid_commands_total", "RF settings commands sent to the reader, by result.", ["command", "result"])
+
+
+class ReaderCommandError(serial.SerialException):
+    """The reader answered a command with an error frame."""
+
+    def __init__(self, command, code):
+        super().__init__(f"Reader rejected command {command:02X} (error code {code:02X})")
+        self.command = command
+        self.code = code
 
 class RFIDReader:
     DEFAULT_SERIAL_PORT = "COM4"
     DEFAULT_BAUD_RATE = 115200
+    MULTI_POLL_MAX_COUNT = 65535 # Largest poll count the multi-inventory command accepts
+    RETRY_DELAY = 0.05 # Seconds between scan_single_tag() attempts without a poll scheduler
 
-    def __init__(self, port=DEFAULT_SERIAL_PORT, baudrate=DEFAULT_BAUD_RATE, timeout=1):
+    def __init__(self, port=DEFAULT_SERIAL_PORT, baudrate=DEFAULT_BAUD_RATE, timeout=1, serial_factory=None,
+                 poll_scheduler=None, rf_settings=None):
         self.port = port
         self.baudrate = baudrate
         self.timeout = timeout # Default timeout for serial read operations
+        # Called as serial_factory(port, baudrate, timeout=...) to open the port. Defaults to
+        # serial.Serial; fake_serial.ReplaySerial.factory() replays a capture instead.
+        self.serial_factory = serial_factory or serial.Serial
+        # Spaces out scan_single_tag() attempts (see poll_scheduler.py); None keeps RETRY_DELAY.
+        self.poll_scheduler = poll_scheduler
+        # Applied every time the port is opened (see apply_rf_settings()), e.g. a calibration result.
+        self.rf_settings = rf_settings
         self.serial_conn = None
         self.is_connected = False
+        # Persistent receive buffer: bytes left over from one read are kept for the next,
+        # and frames that arrive before we ask for them are queued instead of dropped.
+        self._decoder = FrameDecoder()
+        self._pending_frames = deque()
+        self._has_connected = False
 
     def connect(self):
         if self.is_connected and self.serial_conn and self.serial_conn.is_open:
@@ -27,12 +63,24 @@ class RFIDReader:
             if self.serial_conn and self.serial_conn.is_open:
                 self.serial_conn.close()
             
-            self.serial_conn = serial.Serial(self.port, self.baudrate, timeout=self.timeout)
+            self.serial_conn = self.serial_factory(self.port, self.baudrate, timeout=self.timeout)
+            self._decoder.reset()
+            self._pending_frames.clear()
             self.is_connected = True
+            if self._has_connected:
+                RECONNECTS.inc()
+            self._has_connected = True
             # print(f"RFID Reader: Successfully connected to {self.port} at {self.baudrate} baud.")
+            if self.rf_settings:
+                try:
+                    self.apply_rf_settings(self.rf_settings)
+                except serial.SerialException as e:
+                    # The reader keeps scanning with its previous settings
+                    print(f"RFID Reader: Failed to apply RF settings on {self.port}: {e}")
             return True
         except serial.SerialException as e:
             print(f"RFID Reader: Serial connection error on {self.port}: {e}")
+            CONNECT_FAILURES.inc()
             self.is_connected = False
             self.serial_conn = None # Ensure serial_conn is None on failure
             return False
@@ -45,24 +93,26 @@ class RFIDReader:
         # self.serial_conn = None # Option to fully reset, or leave for potential re-open
 
     def _build_command_frame(self, command_type, command_code, params=None):
-        if params is None:
-            params = []
-        
-        payload_len_msb = (len(params) >> 8) & 0xFF
-        payload_len_lsb = len(params) & 0xFF
-        
-        # Data for checksum: Type, Cmd, PL_MSB, PL_LSB, Params (if any)
-        frame_parts_for_checksum = [command_type, command_code, payload_len_msb, payload_len_lsb] + params
-        checksum = calculate_checksum(frame_parts_for_checksum)
-        
-        full_frame = [0xBB] + frame_parts_for_checksum + [checksum, 0x7E]
-        return bytes(full_frame)
+        # BB | Type | Cmd | PL_MSB | PL_LSB | Params | Checksum (of Type..Params) | 7E
+        return build_frame(command_type, command_code, bytes(params or []))
 
     def _get_single_inventory_command(self):
         # Command: BB 00 22 00 00 22 7E
-        return self._build_command_frame(command_type=0x00, command_code=0x22, params=[])
+        return self._build_command_frame(command_type=0x00, command_code=CMD_SINGLE_INVENTORY, params=[])
+
+    def _get_multi_inventory_command(self, poll_count=MULTI_POLL_MAX_COUNT):
+        # Command: BB 00 27 00 03 22 <count MSB> <count LSB> <checksum> 7E
+        # The reader keeps running inventory rounds and notifies every tag it sees.
+        poll_count = max(1, min(poll_count, self.MULTI_POLL_MAX_COUNT))
+        return self._build_command_frame(command_type=0x00, command_code=CMD_MULTI_INVENTORY,
+                                         params=[0x22, (poll_count >> 8) & 0xFF, poll_count & 0xFF])
+
+    def _get_stop_multi_inventory_command(self):
+        # Command: BB 00 28 00 00 28 7E
+        return self._build_command_frame(command_type=0x00, command_code=CMD_STOP_MULTI_INVENTORY, params=[])
 
     def _parse_response_data(self, response_bytes):
+        """Validates one complete frame given as raw bytes and parses it (see _parse_frame)."""
         if not response_bytes:
             return {"status": "error", "message": "No response from reader (timeout likely)."}
         
@@ -81,72 +131,316 @@ class RFIDReader:
         if received_checksum_byte != calculated_response_checksum:
             return {"status": "error", "message": f"Response checksum mismatch. Expected {calculated_response_checksum:02X}, Got {received_checksum_byte:02X}. Response: {response_bytes.hex().upper()}"}
 
-        frame_type = response_bytes[1]
-        command_code_resp = response_bytes[2]
-        param_len_resp = (response_bytes[3] << 8) + response_bytes[4]
+        return self._parse_frame(Frame(bytes(response_bytes)))
+
+    def _parse_frame(self, frame):
+        """Turns a decoded Frame into the result dict used by the rest of the backend."""
+        frame_type = frame.frame_type
+        command_code_resp = frame.command
+        params = frame.params
+        param_len_resp = len(params)
 
-        if frame_type == 0x02 and command_code_resp == 0x22: # Tag successfully read
-            expected_params_len = 1 + 2 + 12 + 2 # RSSI(1) + PC(2) + EPC(12) + Tag_CRC(2) = 17 bytes
+        if frame_type == FRAME_TYPE_NOTIFICATION and command_code_resp == CMD_SINGLE_INVENTORY: # Tag successfully read
+            expected_params_len = TAG_PARAMS_LEN # RSSI(1) + PC(2) + EPC(12) + Tag_CRC(2) = 17 bytes
             if param_len_resp != expected_params_len:
                 return {"status": "error", "message": f"Unexpected parameter length for tag data. Expected {expected_params_len}, Got {param_len_resp}."}
             
-            params_start_index = 5
-            rssi_raw = response_bytes[params_start_index]
             # RSSI conversion: Signed byte, (Value - 129) dBm according to some reader docs
             # Or just use raw if specific conversion isn't clear for E720 module series.
-            # For now, let's assume it's a direct value or a placeholder.
-            rssi_dbm = rssi_raw # Placeholder, actual conversion might be needed.
-
-            pc_bytes = response_bytes[params_start_index+1 : params_start_index+1+2]
-            pc_hex = pc_bytes.hex().upper()
-            
-            epc_bytes = response_bytes[params_start_index+1+2 : params_start_index+1+2+12]
-            epc_hex = epc_bytes.hex().upper()
-            
-            # tag_crc_bytes = response_bytes[params_start_index+1+2+12 : params_start_index+1+2+12+2]
-            # tag_crc_hex = tag_crc_bytes.hex().upper()
-
-            return {
-                "status": "success", 
-                "epc_hex": epc_hex, 
-                "rssi_dbm": rssi_dbm, 
-                "pc_hex": pc_hex,
-                "message": "Tag found."
-            }
+            # For now, parse_tag_read passes the raw value through as a placeholder.
+            return parse_tag_read(frame, time.time()).to_dict()
         
-        elif frame_type == 0x01 and command_code_resp == 0xFF: # Operation failed or no tag
-            error_code = response_bytes[5] # Assuming error code is at index 5
-            if error_code == 0x15: # Specific error code for "No tag inventoried"
+        elif frame.is_error: # Operation failed or no tag
+            if param_len_resp < 1:
+                return {"status": "error", "message": f"Reader error frame without error code: {frame.hex()}"}
+            error_code = params[0]
+            if error_code == ERROR_NO_TAG: # Specific error code for "No tag inventoried"
                 return {"status": "no_tag_found", "message": "No tag found in inventory."}
             else:
                 return {"status": "error", "message": f"Reader error code: {error_code:02X}."}
         
         else: # Unknown response type
-            return {"status": "error", "message": f"Unknown response frame type: {frame_type:02X}, command: {command_code_resp:02X}. Full: {response_bytes.hex().upper()}"}
+            return {"status": "error", "message": f"Unknown response frame type: {frame_type:02X}, command: {command_code_resp:02X}. Full: {frame.hex()}"}
+
+    def _read_available_frames(self):
+        """
+        Reads whatever bytes are waiting on the port (blocking up to the serial timeout
+        for the first byte) and queues every complete frame they finish.
+        Returns:
+            int: Number of bytes read (0 if the read timed out).
+        """
+        waiting = self.serial_conn.in_waiting
+        chunk = self.serial_conn.read(waiting or 1)
+        if not chunk:
+            return 0
+        self._pending_frames.extend(self._decoder.feed(chunk))
+        return len(chunk)
+
+    def _next_frame(self, deadline):
+        """Returns the next queued frame, reading from the port until `deadline` (time.monotonic())."""
+        while not self._pending_frames:
+            if time.monotonic() >= deadline:
+                return None
+            self._read_available_frames()
+        return self._pending_frames.popleft()
+
+    def _is_inventory_result(self, frame):
+        return (frame.frame_type == FRAME_TYPE_NOTIFICATION and frame.command == CMD_SINGLE_INVENTORY) or frame.is_error
 
     def _perform_scan_attempt(self):
         """
         Performs a single RFID scan attempt. Assumes serial connection is ALREADY OPEN.
         This method does not manage connect/disconnect.
+        If an earlier inventory round returned several tags, the queued tags are
+        returned first (one per call) before a new inventory command is sent.
         Returns:
             dict: Parsed response from the reader.
         """
+        result = self._scan_attempt()
+        status = result["status"]
+        SCAN_ATTEMPTS.labels(status).inc()
+        if status == "no_tag_found":
+            EMPTY_POLLS.labels("single").inc()
+        return result
+
+    def _scan_attempt(self):
         if not self.is_connected or not self.serial_conn or not self.serial_conn.is_open:
             return {"status": "error", "message": "Serial port not connected or not open."}
 
-        command = self._get_single_inventory_command()
         try:
+            # Serve tags already received from a previous multi-tag round.
+            while self._pending_frames:
+                frame = self._pending_frames.popleft()
+                if self._is_inventory_result(frame) and not frame.is_error:
+                    return self._parse_frame(frame)
+
+            command = self._get_single_inventory_command()
             self.serial_conn.write(command)
+            sent = time.perf_counter()
             # The E720 module's response time is typically very fast.
-            # A small explicit sleep here can be counterproductive if the serial timeout is set appropriately.
-            # Rely on serial.Serial(timeout=...) for read operations.
-            response_bytes = self.serial_conn.read(64) # Read up to 64 bytes
-            return self._parse_response_data(response_bytes)
+            # Rely on serial.Serial(timeout=...) for read operations; the reply may arrive
+            # split across reads or together with other frames, the decoder handles both.
+            deadline = time.monotonic() + (self.timeout or 0)
+            while True:
+                frame = self._next_frame(deadline)
+                if frame is None:
+                    return {"status": "error", "message": "No response from reader (timeout likely)."}
+                if self._is_inventory_result(frame):
+                    SERIAL_ROUND_TRIP.labels("single").observe(time.perf_counter() - sent)
+                    return self._parse_frame(frame)
+                # Frames for other commands are not ours to answer; skip them.
         except serial.SerialTimeoutException:
             return {"status": "error", "message": "Serial read timeout during scan attempt."}
         except serial.SerialException as e:
             return {"status": "error", "message": f"Serial communication error during scan: {str(e)}"}
 
+    def continuous_inventory(self, duration=None, stop_event=None, poll_count=MULTI_POLL_MAX_COUNT):
+        """
+        Streams every tag in the field using the reader's multi-poll inventory.
+        The reader runs inventory rounds back to back on its own, so the read rate is
+        bounded by the radio rather than by a command/response round trip per tag.
+        The stop command is always sent when the generator finishes or is closed.
+
+        Args:
+            duration (float, optional): Stop after this many seconds. None runs until stopped.
+            stop_event (threading.Event, optional): Stop as soon as this event is set.
+            poll_count (int, optional): Inventory rounds per multi-poll command (1-65535).
+                                        The command is re-issued when the reader finishes or goes quiet.
+        Yields:
+            TagRead: One item per tag notification (EPC, PC, RSSI, timestamp).
+        Raises:
+            serial.SerialException: If the port can't be opened or fails while streaming.
+        """
+        opened_here = not self.is_connected
+        if not self.connect():
+            raise serial.SerialException(f"Failed to connect to serial port {self.port}")
+
+        start_time = time.monotonic()
+        try:
+            self.serial_conn.write(self._get_multi_inventory_command(poll_count))
+            armed_at = time.perf_counter() # Cleared once the reader answers
+            while True:
+                if stop_event is not None and stop_event.is_set():
+                    return
+                if duration is not None and (time.monotonic() - start_time) >= duration:
+                    return
+
+                if not self._pending_frames and self._read_available_frames() == 0:
+                    # Nothing for a whole serial timeout: the poll count ran out or the
+                    # reader dropped the command. Re-arm it.
+                    EMPTY_POLLS.labels("multi").inc()
+                    self.serial_conn.write(self._get_multi_inventory_command(poll_count))
+                    armed_at = time.perf_counter()
+                    continue
+
+                if armed_at is not None:
+                    SERIAL_ROUND_TRIP.labels("multi").observe(time.perf_counter() - armed_at)
+                    armed_at = None
+                rearm = False
+                while self._pending_frames:
+                    frame = self._pending_frames.popleft()
+                    tag = parse_tag_read(frame, time.time())
+                    if tag is not None:
+                        yield tag
+                    elif frame.is_error and len(frame.params) and frame.params[0] != ERROR_NO_TAG:
+                        # Any error other than "no tag this round" ends the multi-poll on the reader.
+                        rearm = True
+                if rearm:
+                    self.serial_conn.write(self._get_multi_inventory_command(poll_count))
+                    armed_at = time.perf_counter()
+        finally:
+            self._stop_multi_inventory()
+            if opened_here:
+                self.disconnect()
+
+    def _stop_multi_inventory(self):
+        """Sends the stop command and discards tag frames still in flight until it is acknowledged."""
+        if not self.is_connected or not self.serial_conn or not self.serial_conn.is_open:
+            return
+        try:
+            self.serial_conn.write(self._get_stop_multi_inventory_command())
+            deadline = time.monotonic() + (self.timeout or 0)
+            while True:
+                frame = self._next_frame(deadline)
+                if frame is None:
+                    break
+                if frame.frame_type == FRAME_TYPE_RESPONSE and frame.command == CMD_STOP_MULTI_INVENTORY:
+                    break
+        except serial.SerialException as e:
+            print(f"RFID Reader: Failed to stop multi-poll inventory on {self.port}: {e}")
+
+    # --- RF settings ---
+    def _command(self, command_code, params=b""):
+        """
+        Sends a command and waits for the reader's response to it. Frames that belong to
+        something else (tag notifications still in flight, "no tag" errors of an earlier
+        inventory) are kept queued, in order, for whoever reads next.
+        The port is opened if needed and left open.
+
+        Returns:
+            Frame: The response frame (same command code).
+        Raises:
+            ReaderCommandError: If the reader answered with an error frame.
+            serial.SerialException: If the port can't be opened or the reader didn't answer in time.
+        """
+        if not self.connect():
+            raise serial.SerialException(f"Failed to connect to serial port {self.port}")
+        name = f"{command_code:02X}"
+        self.serial_conn.write(self._build_command_frame(FRAME_TYPE_COMMAND, command_code, params))
+        deadline = time.monotonic() + (self.timeout or 0)
+        skipped = []
+        try:
+            while True:
+                frame = self._next_frame(deadline)
+                if frame is None:
+                    COMMANDS.labels(name, "timeout").inc()
+                    raise serial.SerialTimeoutException(f"No response to command {name} from {self.port}")
+                if frame.frame_type == FRAME_TYPE_RESPONSE and frame.command == command_code:
+                    COMMANDS.labels(name, "ok").inc()
+                    return frame
+                # Error frames don't say which command failed; "no tag" only ever answers an inventory.
+                if frame.is_error and len(frame.params) and frame.params[0] != ERROR_NO_TAG:
+                    COMMANDS.labels(name, "error").inc()
+                    raise ReaderCommandError(command_code, frame.params[0])
+                skipped.append(frame)
+        finally:
+            self._pending_frames.extendleft(reversed(skipped))
+
+    def _set_command(self, command_code, params):
+        """Sends a set command; its response carries 0x00 on success."""
+        frame = self._command(command_code, params)
+        if len(frame.params) and frame.params[0] != 0x00:
+            COMMANDS.labels(f"{command_code:02X}", "error").inc()
+            raise ReaderCommandError(command_code, frame.params[0])
+
+    def get_power(self):
+        """Returns: float: Transmit power in dBm."""
+        return decode_power(self._command(CMD_GET_POWER).params)
+
+    def set_power(self, dbm):
+        """Sets the transmit power (dBm, 0.01 steps; the module clamps it to what it supports)."""
+        self._set_command(CMD_SET_POWER, encode_power(dbm))
+
+    def get_region(self):
+        """Returns: str: Region name (a key of rfid_frames.REGIONS), or "unknown_XX"."""
+        code = self._command(CMD_GET_REGION).params[0]
+        return REGION_NAMES.get(code, f"unknown_{code:02X}")
+
+    def set_region(self, region):
+        """
+        Sets the regulatory region (a key of rfid_frames.REGIONS); the reader moves to its channel 0.
+        Raises:
+            ValueError: On an unknown region.
+        """
+        if region not in REGIONS:
+            raise ValueError(f"Unknown region '{region}'")
+        self._set_command(CMD_SET_REGION, bytes([REGIONS[region][0]]))
+
+    def get_channel(self):
+        """Returns: int: Index of the working channel within the region."""
+        return self._command(CMD_GET_CHANNEL).params[0]
+
+    def set_channel(self, channel):
+        """Fixes the working channel (only used while frequency hopping is off)."""
+        if not 0 <= channel <= 0xFF:
+            raise ValueError(f"Channel index out of range: {channel}")
+        self._set_command(CMD_SET_CHANNEL, bytes([channel]))
+
+    def set_frequency_hopping(self, enabled):
+        """Turns automatic frequency hopping over the region's channels on or off."""
+        self._set_command(CMD_SET_HOPPING, bytes([0xFF if enabled else 0x00]))
+
+    def get_query_parameters(self):
+        """Returns: QueryParameters: The Gen2 Query settings, including Q."""
+        return QueryParameters.from_bytes(self._command(CMD_GET_QUERY).params)
+
+    def set_query_parameters(self, query):
+        self._set_command(CMD_SET_QUERY, query.to_bytes())
+
+    def set_q(self, q):
+        """Changes only Q (read-modify-write of the Query parameters)."""
+        if not 0 <= q <= 15:
+            raise ValueError(f"Q must be 0-15, got {q}")
+        query = self.get_query_parameters()
+        query.q = q
+        self.set_query_parameters(query)
+
+    def get_rf_settings(self):
+        """
+        Returns:
+            dict: {"power_dbm", "region", "channel", "frequency_mhz", "q", "query"}. Hopping
+                  can't be read back from the module.
+        """
+        region = self.get_region()
+        channel = self.get_channel()
+        query = self.get_query_parameters()
+        return {
+            "power_dbm": self.get_power(),
+            "region": region,
+            "channel": channel,
+            "frequency_mhz": channel_frequency(region, channel) if region in REGIONS else None,
+            "q": query.q,
+            "query": query.to_dict(),
+        }
+
+    def apply_rf_settings(self, settings):
+        """
+        Applies the settings present in `settings` ({"region", "hopping", "channel",
+        "power_dbm", "q"}, all optional), region first since it resets the channel.
+        Raises:
+            ReaderCommandError, serial.SerialException: On the first setting that fails.
+        """
+        if settings.get("region") is not None:
+            self.set_region(settings["region"])
+        if settings.get("hopping") is not None:
+            self.set_frequency_hopping(settings["hopping"])
+        if settings.get("channel") is not None:
+            self.set_channel(settings["channel"])
+        if settings.get("power_dbm") is not None:
+            self.set_power(settings["power_dbm"])
+        if settings.get("q") is not None:
+            self.set_q(settings["q"])
+
     def scan_single_tag(self, wait_for_tag_timeout=10):
         """
         Scans for a single RFID tag, managing its own connection.
@@ -162,6 +456,9 @@ class RFIDReader:
             return {"status": "error", "message": f"Failed to connect to serial port {self.port}"}
 
         start_time = time.time()
+        scheduler = self.poll_scheduler
+        if scheduler is not None:
+            scheduler.reset(time.monotonic())
         try:
             while True:
                 parsed_data = self._perform_scan_attempt()
@@ -181,8 +478,9 @@ class RFIDReader:
                         return parsed_data 
                     return {"status": "no_tag_found", "message": f"Timeout: No tag found within {wait_for_tag_timeout} seconds."}
                 
-                time.sleep(0.05) # Brief pause before retrying to avoid busy-looping.
-                                # Adjust if necessary. Should be short.
+                # Brief pause before retrying to avoid busy-looping; a scheduler stretches it
+                # while nothing is being read.
+                time.sleep(scheduler.next_gap(time.monotonic()) if scheduler is not None else self.RETRY_DELAY)
         finally:
             self.disconnect() # Always disconnect when this method exits
         
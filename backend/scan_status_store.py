@@ -0,0 +1,265 @@
+# scan_status_store.py
+# In-memory scan progress, scoped per session, with crash-safe write-behind persistence.
+#
+# Each booth / visitor session has its own status document, looked up by session id
+# in an LRU-ordered dict. Sessions idle for longer than `session_ttl` are evicted (and
+# one that comes back after that starts over) and at most `max_sessions` are kept, so
+# memory stays bounded however many kiosks and visitors come through. Clients that
+# don't send a session id share DEFAULT_SESSION.
+#
+# Only mark_completed() creates sessions; get() and reset() of an unknown id just
+# answer with the default status. A new session stays "new" until it is written to
+# again within the TTL; new sessions are capped at `max_new_sessions` and are evicted
+# first when the store is full, so requests with made-up ids only push each other
+# out, never established booth sessions.
+#
+# The documents are loaded from disk once. After that every read is served from
+# memory under a lock, and changes are written back on a short debounce: the JSON
+# is written to a temp file in the same directory, fsync'ed, then atomically renamed
+# over the real file, so readers of the file (and a restart after a crash) only ever
+# see a complete document. On disk the file maps session id -> status.
+import atexit
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+DEFAULT_SESSION = "default"
+
+WRITE_SECONDS = metrics.histogram("scan_status_write_seconds", "Time to persist the scan status file (write, fsync, rename).")
+WRITE_ERRORS = metrics.counter("scan_status_write_errors_total", "Failed attempts to persist the scan status file.")
+
+
+class _Session:
+    __slots__ = ("status", "last_access")
+
+    def __init__(self, status, last_access):
+        self.status = status
+        self.last_access = last_access
+
+
+class ScanStatusStore:
+    DEFAULT_DEBOUNCE_SECONDS = 0.5 # Changes within this window are coalesced into one write
+    DEFAULT_SESSION_TTL = 30 * 60 # Seconds a session may sit idle before it is evicted
+    DEFAULT_MAX_SESSIONS = 256
+
+    def __init__(self, file_path, completion_keys, debounce_seconds=DEFAULT_DEBOUNCE_SECONDS,
+                 session_ttl=DEFAULT_SESSION_TTL, max_sessions=DEFAULT_MAX_SESSIONS, max_new_sessions=None):
+        self.file_path = file_path
+        self.completion_keys = list(completion_keys)
+        self.debounce_seconds = debounce_seconds
+        self.session_ttl = session_ttl
+        self.max_sessions = max(1, max_sessions)
+        # Sessions written to only once so far; default: a quarter of max_sessions
+        self.max_new_sessions = max(1, self.max_sessions // 4 if max_new_sessions is None else max_new_sessions)
+
+        self._lock = threading.Lock() # Guards _sessions and the pending timer
+        self._write_lock = threading.Lock() # Serializes writers of the file itself
+        self._write_timer = None
+        self._version = 0 # Bumped on every change
+        self._written_version = 0
+
+        self._sessions = self._load() # session id -> _Session, least recently used first
+        self._new = OrderedDict() # Ids of new sessions, oldest first (loaded ones are established)
+        atexit.register(self.flush)
+
+    # --- Reads (never touch disk) ---
+    def get(self, session_id=DEFAULT_SESSION):
+        """
+        Returns a copy of the session's status, including 'all_completed'. Read-only: an
+        unknown (or expired) session gets the default status without being created, so
+        made-up ids can't push real sessions out.
+        """
+        with self._lock:
+            now = time.monotonic()
+            session = self._sessions.get(session_id)
+            if session is None or (now - session.last_access) > self.session_ttl:
+                return self._default_status()
+            session.last_access = now
+            self._sessions.move_to_end(session_id)
+            return dict(session.status)
+
+    def session_ids(self):
+        with self._lock:
+            self._evict_idle(time.monotonic())
+            return list(self._sessions)
+
+    # --- Writes ---
+    def mark_completed(self, key, session_id=DEFAULT_SESSION):
+        """
+        Sets one completion key to True for a session.
+        Returns:
+            tuple: (changed, status copy). changed is False if it was already completed.
+        """
+        with self._lock:
+            status = self._session(session_id).status
+            if status.get(key) is True:
+                return False, dict(status)
+            status[key] = True
+            status['all_completed'] = self._all_done(status)
+            self._changed()
+            return True, dict(status)
+
+    def reset(self, session_id=DEFAULT_SESSION):
+        """Marks every item as not completed for one session. Returns the new status."""
+        with self._lock:
+            session = self._session(session_id, create=False)
+            if session is None:
+                return self._default_status() # Nothing to reset, and nothing is stored
+            session.status = self._default_status()
+            self._changed()
+            return dict(session.status)
+
+    def flush(self):
+        """Writes pending changes to disk now (called automatically at exit)."""
+        with self._lock:
+            if self._write_timer is not None:
+                self._write_timer.cancel()
+                self._write_timer = None
+        self._write_behind()
+
+    # --- Internals ---
+    def _session(self, session_id, create=True):
+        # Called with self._lock held, by writes only. O(1): dict lookups plus an LRU move.
+        now = time.monotonic()
+        session = self._sessions.get(session_id)
+        if session is None:
+            if not create:
+                return None
+            session = _Session(self._default_status(), now)
+            self._sessions[session_id] = session
+            self._new[session_id] = None
+            while len(self._new) > self.max_new_sessions:
+                del self._sessions[self._new.popitem(last=False)[0]]
+            self._changed()
+        else:
+            if (now - session.last_access) > self.session_ttl:
+                # Expired but not evicted yet: a returning visitor starts over
+                session.status = self._default_status()
+                self._changed()
+            else:
+                self._new.pop(session_id, None) # Written to again: established
+            session.last_access = now
+            self._sessions.move_to_end(session_id)
+        self._evict_idle(now)
+        return session
+
+    def _evict_idle(self, now):
+        # Called with self._lock held. Oldest sessions sit at the front, so this only
+        # looks at the sessions it actually removes (plus one).
+        evicted = False
+        while len(self._sessions) > 1:
+            oldest_id, oldest = next(iter(self._sessions.items()))
+            if (now - oldest.last_access) > self.session_ttl:
+                victim = oldest_id
+            elif len(self._sessions) > self.max_sessions:
+                # Full: new sessions go first, so a flood of made-up ids can't evict real ones
+                victim = next(iter(self._new)) if len(self._new) > 1 else oldest_id
+            else:
+                break
+            del self._sessions[victim]
+            self._new.pop(victim, None)
+            evicted = True
+        if evicted:
+            self._changed()
+
+    def _default_status(self):
+        status = {key: False for key in self.completion_keys}
+        status['all_completed'] = False
+        return status
+
+    def _all_done(self, status):
+        return all(status.get(key, False) for key in self.completion_keys)
+
+    def _valid_status(self, status):
+        return isinstance(status, dict) and all(key in status for key in self.completion_keys)
+
+    def _load(self):
+        os.makedirs(os.path.dirname(self.file_path), exist_ok=True) # Ensure data directory exists
+        sessions = OrderedDict()
+        try:
+            with open(self.file_path, 'r') as f:
+                data = json.load(f)
+            if self._valid_status(data):
+                # Single-document file from before sessions existed
+                data = {DEFAULT_SESSION: data}
+                self._version += 1
+            if not isinstance(data, dict):
+                raise json.JSONDecodeError("expected an object", "", 0)
+            for session_id, status in data.items():
+                if self._valid_status(status):
+                    sessions[session_id] = status
+                else:
+                    print(f"Scan status for session '{session_id}' is missing keys. Re-initializing it.")
+                    sessions[session_id] = self._default_status()
+                    self._version += 1
+        except FileNotFoundError:
+            print(f"'{self.file_path}' not found. Initializing a new one.")
+            self._version += 1
+        except json.JSONDecodeError as e:
+            print(f"Error decoding JSON from '{self.file_path}': {e}. Re-initializing file.")
+            sessions.clear()
+            self._version += 1
+
+        if DEFAULT_SESSION not in sessions:
+            sessions[DEFAULT_SESSION] = self._default_status()
+            self._version += 1
+
+        now = time.monotonic()
+        for status in sessions.values():
+            status['all_completed'] = self._all_done(status)
+        # Loaded sessions start their idle clock now
+        sessions = OrderedDict((session_id, _Session(status, now)) for session_id, status in sessions.items())
+        if self._version:
+            self._write_file(self._snapshot(sessions))
+            self._written_version = self._version
+        return sessions
+
+    def _snapshot(self, sessions):
+        return {session_id: dict(session.status) for session_id, session in sessions.items()}
+
+    def _changed(self):
+        # Called with self._lock held
+        self._version += 1
+        if self._write_timer is None:
+            self._write_timer = threading.Timer(self.debounce_seconds, self._write_behind)
+            self._write_timer.daemon = True
+            self._write_timer.start()
+
+    def _write_behind(self):
+        with self._write_lock:
+            with self._lock:
+                self._write_timer = None
+                if self._version == self._written_version:
+                    return
+                snapshot = self._snapshot(self._sessions)
+                version = self._version
+            started = time.perf_counter()
+            try:
+                self._write_file(snapshot)
+            except OSError as e:
+                # Keep the change in memory; the next change (or flush) retries the write.
+                WRITE_ERRORS.inc()
+                print(f"Error saving scan status to '{self.file_path}': {e}")
+                return
+            WRITE_SECONDS.observe(time.perf_counter() - started)
+            self._written_version = version
+        print(f"Scan status saved for {len(snapshot)} session(s).")
+
+    def _write_file(self, data):
+        tmp_path = self.file_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.file_path)
+        if hasattr(os, 'O_DIRECTORY'):
+            # Make the rename itself durable (POSIX only; Windows has no directory handles)
+            dir_fd = os.open(os.path.dirname(self.file_path), os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
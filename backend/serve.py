@@ -0,0 +1,189 @@
+# serve.py
+# Production entry point: the RFID readers in one dedicated process, HTTP/Socket.IO
+# spread over several worker processes.
+#
+#   python serve.py --workers 4 --port 5000
+#
+# Layout:
+#   reader process - the only process touching the serial ports. Runs the reader engines,
+#                    presence tracking, the event bus, the scan status store, the event
+#                    log, the glove (IMU) streams and the gesture template library, and
+#                    hosts the message hub (message_hub.py) on a Unix socket
+#                    (localhost TCP on Windows). Nothing else runs there, so video
+#                    downloads and busy websockets can't delay the scan loop.
+#   web workers    - serve the frontend, the REST API and Socket.IO on an async worker
+#                    (eventlet or gevent when installed, threads otherwise). They share
+#                    the listening port through SO_REUSEPORT, forward scan controls and
+#                    scan progress to the reader process, and receive its event batches
+#                    through the hub.
+#
+# Workers are balanced per connection, so clients must use the websocket transport
+# (the frontend does); long-polling would need sticky sessions. Glove samples and template
+# uploads go to the reader process, so they can arrive through any worker. Without
+# SO_REUSEPORT (Windows) a single worker is started. Crashed processes are restarted.
+import argparse
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+
+from message_hub import default_address, format_address, parse_address
+
+ASYNC_MODES = ('eventlet', 'gevent', 'threading')
+RESTART_DELAY = 1.0 # Seconds before restarting a crashed process
+
+
+def detect_async_mode():
+    """The best installed async worker: eventlet, then gevent, then plain threads."""
+    for mode in ASYNC_MODES[:-1]:
+        try:
+            __import__(mode)
+            return mode
+        except ImportError:
+            continue
+    return 'threading'
+
+
+def register_services(hub, main_server):
+    """Exposes the reader process's state to the web workers (they call it through RemoteProxy / hub_client)."""
+    import metrics
+    hub.register('server', main_server, ['start_scanning', 'stop_scanning', 'reader_status', 'reader_rf_settings',
+                                         'tune_reader', 'start_calibration', 'calibration_status', 'cancel_calibration',
+                                         'query_event_log'])
+    hub.register('scan_status_store', main_server.scan_status_store, ['get', 'mark_completed', 'reset', 'flush'])
+    hub.register('event_log', main_server.event_log, ['append_read', 'append_session_event'])
+    hub.register('gesture_matcher', main_server.gesture_matcher, ['has_action', 'score_batch', 'template_info',
+                                                                  'add_templates'])
+    hub.register('imu_streams', main_server.imu_streams, ['feed', 'state', 'reset'])
+    hub.register('metrics', metrics.REGISTRY, ['render'])
+
+
+def run_reader_process(ready):
+    """Reader process body; `ready` is set once the hub is answering calls."""
+    from message_hub import Hub
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0)) # Run the cleanup below on terminate()
+    hub = Hub(parse_address(os.environ['RFID_HUB_ADDRESS']), bytes.fromhex(os.environ['RFID_HUB_AUTHKEY']))
+    hub.start()
+    import main_server # After the hub is up: its Socket.IO emits are published through it
+    register_services(hub, main_server)
+    main_server.ensure_background_tasks()
+    print(f"Reader process {os.getpid()}: message hub on {format_address(hub.address)}")
+    ready.set()
+    try:
+        while True:
+            time.sleep(3600)
+    finally:
+        main_server.stop_scanning()
+        main_server.scan_status_store.flush()
+        main_server.event_log.close()
+        hub.close()
+
+
+def _listening_socket(host, port, reuse_port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(128)
+    return sock
+
+
+def run_worker(host, port, reuse_port):
+    """Web worker body."""
+    mode = os.environ['SOCKETIO_ASYNC_MODE']
+    if mode == 'eventlet':
+        import eventlet
+        eventlet.monkey_patch()
+    elif mode == 'gevent':
+        from gevent import monkey
+        monkey.patch_all()
+
+    import main_server
+    main_server.asset_server.precompress()
+    sock = _listening_socket(host, port, reuse_port)
+    print(f"Web worker {os.getpid()} ({mode}) serving on http://{host}:{port}")
+    if mode == 'eventlet':
+        import eventlet.wsgi
+        eventlet.wsgi.server(sock, main_server.app, log_output=False)
+    elif mode == 'gevent':
+        from gevent import pywsgi
+        try:
+            from geventwebsocket.handler import WebSocketHandler
+            pywsgi.WSGIServer(sock, main_server.app, handler_class=WebSocketHandler, log=None).serve_forever()
+        except ImportError:
+            pywsgi.WSGIServer(sock, main_server.app, log=None).serve_forever()
+    else:
+        from werkzeug.serving import make_server
+        make_server(host, port, main_server.app, threaded=True, fd=sock.fileno()).serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Production server: one reader process plus web workers.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="web worker processes (default: CPU count)")
+    parser.add_argument("--async-mode", choices=ASYNC_MODES, help="web worker type (default: best installed)")
+    parser.add_argument("--hub", help="message hub address, a Unix socket path or host:port (default: per port)")
+    args = parser.parse_args(argv)
+
+    workers = max(1, args.workers)
+    reuse_port = hasattr(socket, 'SO_REUSEPORT')
+    if workers > 1 and not reuse_port:
+        print("SO_REUSEPORT isn't available on this platform; starting a single web worker.")
+        workers = 1
+    mode = args.async_mode or detect_async_mode()
+    if mode == 'threading':
+        print("Neither eventlet nor gevent is installed; web workers use threads.")
+
+    hub_address = parse_address(args.hub) if args.hub else default_address(args.port)
+    # Inherited by every child process (fork or spawn)
+    os.environ['RFID_HUB_ADDRESS'] = format_address(hub_address)
+    os.environ['RFID_HUB_AUTHKEY'] = os.urandom(32).hex()
+
+    def start_reader():
+        ready = multiprocessing.Event()
+        os.environ['SERVER_ROLE'] = 'reader'
+        os.environ['SOCKETIO_ASYNC_MODE'] = 'threading' # The reader engines use real threads
+        process = multiprocessing.Process(target=run_reader_process, args=(ready,), name='rfid-reader')
+        process.start()
+        if not ready.wait(30):
+            raise RuntimeError("Reader process did not start")
+        return process
+
+    def start_worker(index):
+        os.environ['SERVER_ROLE'] = 'worker'
+        os.environ['SOCKETIO_ASYNC_MODE'] = mode
+        process = multiprocessing.Process(target=run_worker, args=(args.host, args.port, reuse_port),
+                                          name=f'web-worker-{index}')
+        process.start()
+        return process
+
+    reader = start_reader()
+    web_workers = [start_worker(index) for index in range(workers)]
+    try:
+        while True:
+            time.sleep(RESTART_DELAY)
+            if not reader.is_alive():
+                print(f"Reader process exited with code {reader.exitcode}; restarting it.")
+                reader = start_reader()
+            for index, worker in enumerate(web_workers):
+                if not worker.is_alive():
+                    print(f"Web worker {worker.pid} exited with code {worker.exitcode}; restarting it.")
+                    web_workers[index] = start_worker(index)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in web_workers:
+            process.terminate()
+        reader.terminate() # Stops the readers and writes pending scan progress first
+        for process in web_workers + [reader]:
+            process.join(5)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,150 @@
+# stage_manifest.py
+# Which frontend media each stage needs, and which stage can come next, so the
+# frontend can prefetch the next stage's videos/audio while the current one plays.
+#
+# Stage membership comes from the asset tree itself: everything under
+# frontend/assets/<stage>/ belongs to that stage, and a directory named after a
+# parent stage is shared by its sub-stages (assets/stage4/ is part of stage4-1 ... stage4-4).
+# Adding a file to a stage directory is enough; there is no list to keep in sync.
+
+import os
+
+ASSETS_DIR = "assets" # Relative to the frontend root
+
+# Stages that can follow each stage. From the floorplan any evidence item may be scanned;
+# after a gesture replay the visitor goes back to the floorplan, or to the ending.
+# Stage ids match the frontend's `currentStage` values; sub-stages such as
+# 'stage4-1-1' or 'stage3-2-robot-image' fall back to their parent ('stage4-1', 'stage3-2').
+STAGE_FLOW = {
+    "stage0": ["stage1"],
+    "stage1": ["stage2"],
+    "stage2": ["stage3-1", "stage3-2", "stage3-3", "stage3-4"],
+    "stage3-1": ["stage4-1"],
+    "stage3-2": ["stage4-2"],
+    "stage3-3": ["stage4-3"],
+    "stage3-4": ["stage4-4"],
+    "stage4-1": ["stage2", "stage5"],
+    "stage4-2": ["stage2", "stage5"],
+    "stage4-3": ["stage2", "stage5"],
+    "stage4-4": ["stage2", "stage5"],
+    "stage5": ["stage0"],
+}
+
+# The Link header only hints the smallest asset of each next stage, and only if it is
+# at most this big; the frontend prefetches the rest itself (js/stagePrefetch.js).
+# Preloading whole stages of multi-MB videos would compete with the current stage's media.
+PRELOAD_MAX_BYTES = 512 * 1024
+
+# `as` values for <link rel=preload>, by file extension
+PRELOAD_TYPES = {
+    ".mp4": "video", ".webm": "video",
+    ".mp3": "audio", ".wav": "audio", ".ogg": "audio",
+    ".png": "image", ".jpg": "image", ".jpeg": "image", ".svg": "image",
+    ".js": "script", ".css": "style",
+}
+
+
+def normalize_stage(stage):
+    """Maps a frontend stage id to a key of STAGE_FLOW, or None if unknown."""
+    if not stage:
+        return None
+    parts = stage.split("-")
+    for count in range(len(parts), 0, -1):
+        candidate = "-".join(parts[:count])
+        if candidate in STAGE_FLOW:
+            return candidate
+    return None
+
+
+def _stage_dirs(stage):
+    """Asset directories of a stage: its own, then each parent's ('stage4-2' -> stage4-2, stage4)."""
+    parts = stage.split("-")
+    return ["-".join(parts[:count]) for count in range(len(parts), 0, -1)]
+
+
+def _stage_files(asset_server, stage):
+    rel_paths = []
+    for dir_name in _stage_dirs(stage):
+        stage_dir = os.path.join(asset_server.root_dir, ASSETS_DIR, dir_name)
+        for dir_path, dir_names, file_names in os.walk(stage_dir):
+            dir_names.sort()
+            for file_name in sorted(file_names):
+                if file_name.startswith("."):
+                    continue # .DS_Store, .gitkeep
+                full_path = os.path.join(dir_path, file_name)
+                rel_paths.append(os.path.relpath(full_path, asset_server.root_dir).replace(os.sep, "/"))
+    return rel_paths
+
+
+def _asset_info(asset_server, rel_path):
+    entry = asset_server.lookup(rel_path)
+    if entry is None:
+        return None
+    ext = rel_path[rel_path.rfind("."):].lower()
+    return {
+        "path": rel_path,
+        "url": "/" + entry.hashed_name, # Immutable URL, safe to cache forever
+        "bytes": entry.size,
+        "hash": entry.digest,
+        "as": PRELOAD_TYPES.get(ext, "fetch"),
+    }
+
+
+def _stage_assets(asset_server, stage):
+    assets = []
+    for rel_path in _stage_files(asset_server, stage):
+        info = _asset_info(asset_server, rel_path)
+        if info is not None: # Removed between the walk and the lookup
+            assets.append(info)
+    assets.sort(key=lambda info: (info["bytes"], info["path"])) # Smallest (quickest to fetch) first
+    return {
+        "assets": assets,
+        "total_bytes": sum(info["bytes"] for info in assets),
+    }
+
+
+def build_stage_manifest(asset_server, stage=None):
+    """
+    Builds the preload manifest from the frontend tree.
+
+    With a stage: that stage's assets plus the assets of every stage that can come next.
+    Without: every stage. Assets are listed smallest first. Sizes and hashes come from
+    `asset_server` (a StaticAssetServer), which only re-hashes files that changed on disk.
+    Returns:
+        dict, or None if the stage is unknown.
+    """
+    if stage is None:
+        return {
+            "stages": {name: dict(_stage_assets(asset_server, name), next_stages=STAGE_FLOW[name])
+                       for name in STAGE_FLOW}
+        }
+
+    key = normalize_stage(stage)
+    if key is None:
+        return None
+    next_stages = STAGE_FLOW[key]
+    return {
+        "stage": key,
+        "current": _stage_assets(asset_server, key),
+        "next_stages": next_stages,
+        "next": {name: _stage_assets(asset_server, name) for name in next_stages},
+    }
+
+
+def preload_link_header(manifest, max_bytes=PRELOAD_MAX_BYTES):
+    """
+    `Link: rel=preload` value for a single-stage manifest: the smallest asset of each
+    next stage, if it is at most `max_bytes`. Everything else is left to the frontend's
+    low-priority prefetch.
+    """
+    links = []
+    seen = set()
+    for stage_info in manifest["next"].values():
+        if not stage_info["assets"]:
+            continue
+        info = stage_info["assets"][0]
+        if info["bytes"] > max_bytes or info["url"] in seen:
+            continue
+        seen.add(info["url"])
+        links.append(f'<{info["url"]}>; rel=preload; as={info["as"]}')
+    return ", ".join(links)
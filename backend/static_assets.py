@@ -0,0 +1,206 @@
+# static_assets.py
+# Cache-friendly serving of the frontend directory (HTML, JS/CSS, images, audio, video).
+#
+# - Every file gets a strong ETag derived from a SHA-256 of its content, so browsers
+#   revalidate with a cheap 304 instead of downloading multi-megabyte media again.
+# - Every file is also reachable under a content-hashed name (js/main.<hash>.js);
+#   those URLs never change content and are served with `Cache-Control: immutable`.
+#   HTML pages are rewritten on the fly to reference the hashed names, and the full
+#   mapping is available from manifest().
+# - HTTP Range / If-Range requests are answered with 206 partial content, so video
+#   seeking only streams the part being watched. HTML is the exception: its rewritten
+#   body is always sent whole, so one URL never has two representations.
+# - Text assets (HTML, JS, CSS, JSON, SVG) are precompressed once with gzip, and
+#   brotli when the optional `brotli` package is installed, and served according to
+#   Accept-Encoding.
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+
+from flask import Response, abort, request, send_file
+from werkzeug.security import safe_join
+
+try:
+    import brotli # Optional: pip install brotli
+except ImportError:
+    brotli = None
+
+
+class _AssetEntry:
+    __slots__ = ("path", "size", "mtime_ns", "digest", "hashed_name", "encoded")
+
+    def __init__(self, path, size, mtime_ns, digest, hashed_name):
+        self.path = path
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.digest = digest
+        self.hashed_name = hashed_name
+        self.encoded = None # (body digest, {"identity": bytes, "gzip": bytes, "br": bytes}) for text assets
+
+
+class StaticAssetServer:
+    IMMUTABLE_MAX_AGE = 365 * 24 * 3600 # One year for content-hashed URLs
+    DIGEST_LENGTH = 12 # Hex characters of the content hash used in file names
+    COMPRESSIBLE_EXTENSIONS = ('.html', '.js', '.css', '.json', '.svg')
+    HASH_CHUNK_SIZE = 1024 * 1024
+
+    _HASHED_NAME_RE = re.compile(r'^(?P<base>.+)\.(?P<digest>[0-9a-f]{12})(?P<ext>\.[^./]+)$')
+    _HTML_REF_RE = re.compile(r'(?P<attr>\b(?:src|href)=")(?P<url>[^":#?]+)(?=")')
+
+    def __init__(self, root_dir):
+        self.root_dir = os.path.abspath(root_dir)
+        self._entries = {} # relative path ("js/main.js") -> _AssetEntry
+        self._lock = threading.Lock()
+
+    # --- Public API ---
+    def send(self, rel_path):
+        """Builds the response for a request of `rel_path` (relative to root_dir)."""
+        rel_path = rel_path.replace('\\', '/').lstrip('/')
+        immutable = False
+        entry = self._entry(rel_path)
+        if entry is None:
+            match = self._HASHED_NAME_RE.match(rel_path)
+            if match is None:
+                abort(404)
+            entry = self._entry(match.group('base') + match.group('ext'))
+            if entry is None:
+                abort(404)
+            # A stale hash still gets the current file, just without the long-lived caching.
+            immutable = entry.digest == match.group('digest')
+            rel_path = match.group('base') + match.group('ext')
+
+        if rel_path.endswith('.html') or (rel_path.endswith(self.COMPRESSIBLE_EXTENSIONS) and 'Range' not in request.headers):
+            response = self._send_encoded(entry, rel_path) # Ignores Range
+        else:
+            response = send_file(entry.path, conditional=True, etag=entry.digest)
+            response.headers['Accept-Ranges'] = 'bytes'
+
+        if immutable:
+            response.headers['Cache-Control'] = f'public, max-age={self.IMMUTABLE_MAX_AGE}, immutable'
+        else:
+            response.headers['Cache-Control'] = 'no-cache' # Always revalidate; the ETag makes that a 304
+        return response
+
+    def manifest(self):
+        """Maps every asset's path to its content-hashed path."""
+        manifest = {}
+        for rel_path in self._walk():
+            entry = self._entry(rel_path)
+            if entry is not None:
+                manifest[rel_path] = entry.hashed_name
+        return manifest
+
+    def lookup(self, rel_path):
+        """Returns the asset's entry (path, size, digest, hashed_name), or None if it doesn't exist."""
+        return self._entry(rel_path.replace('\\', '/').lstrip('/'))
+
+    def precompress(self):
+        """Hashes every asset and compresses the text ones up front (e.g. at server start)."""
+        for rel_path in self._walk():
+            entry = self._entry(rel_path)
+            if entry is not None and rel_path.endswith(self.COMPRESSIBLE_EXTENSIONS):
+                self._encoded(entry, rel_path)
+
+    # --- Internals ---
+    def _walk(self):
+        for dir_path, _dir_names, file_names in os.walk(self.root_dir):
+            for file_name in file_names:
+                full_path = os.path.join(dir_path, file_name)
+                yield os.path.relpath(full_path, self.root_dir).replace(os.sep, '/')
+
+    def _entry(self, rel_path):
+        """Returns the up-to-date entry for a file, re-hashing it only when it changed on disk."""
+        full_path = safe_join(self.root_dir, rel_path)
+        if full_path is None:
+            return None
+        try:
+            stat = os.stat(full_path)
+        except OSError:
+            return None
+        if not os.path.isfile(full_path):
+            return None
+
+        with self._lock:
+            entry = self._entries.get(rel_path)
+            if entry is not None and entry.size == stat.st_size and entry.mtime_ns == stat.st_mtime_ns:
+                return entry
+
+        digest = self._hash_file(full_path)
+        base, ext = os.path.splitext(rel_path)
+        entry = _AssetEntry(full_path, stat.st_size, stat.st_mtime_ns, digest, f"{base}.{digest}{ext}")
+        with self._lock:
+            self._entries[rel_path] = entry
+        return entry
+
+    def _hash_file(self, full_path):
+        sha = hashlib.sha256()
+        with open(full_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(self.HASH_CHUNK_SIZE), b''):
+                sha.update(chunk)
+        return sha.hexdigest()[:self.DIGEST_LENGTH]
+
+    def _encoded(self, entry, rel_path):
+        """
+        Returns (body digest, {encoding: bytes}) for a text asset, compressing only when
+        the body changed. HTML bodies depend on the hashes of the files they reference,
+        so they are re-rewritten (cheap) on every call and get their own digest.
+        """
+        cached = entry.encoded
+        if rel_path.endswith('.html'):
+            with open(entry.path, 'rb') as f:
+                body = self._rewrite_html(f.read(), os.path.dirname(rel_path))
+            body_digest = hashlib.sha256(body).hexdigest()[:self.DIGEST_LENGTH]
+            if cached is not None and cached[0] == body_digest:
+                return cached
+        else:
+            if cached is not None:
+                return cached
+            with open(entry.path, 'rb') as f:
+                body = f.read()
+            body_digest = entry.digest
+
+        encoded = {'identity': body, 'gzip': gzip.compress(body, compresslevel=9)}
+        if brotli is not None:
+            encoded['br'] = brotli.compress(body)
+        entry.encoded = (body_digest, encoded)
+        return entry.encoded
+
+    def _rewrite_html(self, body, base_dir):
+        """Points local src/href references at their content-hashed names."""
+        text = body.decode('utf-8')
+
+        def replace(match):
+            url = match.group('url')
+            if url.startswith('/'):
+                rel_path = url.lstrip('/')
+            else:
+                rel_path = os.path.normpath(os.path.join(base_dir, url)).replace(os.sep, '/')
+            entry = self._entry(rel_path)
+            if entry is None:
+                return match.group(0)
+            hashed_url = url[:len(url) - len(os.path.basename(url))] + os.path.basename(entry.hashed_name)
+            return match.group('attr') + hashed_url
+
+        return self._HTML_REF_RE.sub(replace, text).encode('utf-8')
+
+    def _send_encoded(self, entry, rel_path):
+        body_digest, encoded = self._encoded(entry, rel_path)
+        accepted = request.accept_encodings
+        if 'br' in encoded and accepted['br']:
+            encoding = 'br'
+        elif accepted['gzip']:
+            encoding = 'gzip'
+        else:
+            encoding = 'identity'
+
+        mimetype = mimetypes.guess_type(rel_path)[0] or 'application/octet-stream'
+        response = Response(encoded[encoding], mimetype=mimetype)
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+        # Each representation needs its own strong ETag
+        response.set_etag(body_digest if encoding == 'identity' else f"{body_digest}-{encoding}")
+        return response.make_conditional(request)
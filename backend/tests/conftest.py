@@ -0,0 +1,7 @@
+# conftest.py
+# The backend modules import each other by plain name (they run from backend/), so the
+# tests put backend/ on sys.path the same way.
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,78 @@
+# test_epc_mappings.py
+# EPC catalog: exact / prefix / mask precedence and hot reload of the catalog file.
+import json
+import os
+
+import pytest
+
+from epc_mappings import EPCCatalog
+
+CUP = 'E280F3372000F0000FDAE3BA'
+
+
+def write_catalog(path, data):
+    path.write_text(json.dumps(data))
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000)) # Same-size rewrites still look changed
+
+
+@pytest.fixture
+def catalog_file(tmp_path):
+    path = tmp_path / 'epc_catalog.json'
+    write_catalog(path, {
+        "version": 1,
+        "tags": {CUP: "cup"},
+        "prefixes": [{"prefix": "E280F3", "name": "batch"}, {"prefix": "E280F33720", "name": "batch_a"},
+                     {"prefix": "E2801", "name": "odd_prefix"}],
+        "masks": [{"value": "300000AA", "mask": "F00000FF", "name": "mask_first"},
+                  {"value": "30000000", "mask": "F0000000", "name": "mask_second"}],
+    })
+    return path
+
+
+def test_lookup_precedence(catalog_file):
+    catalog = EPCCatalog(str(catalog_file), check_interval=60)
+    assert catalog.name_for(bytes.fromhex(CUP)) == 'cup' # Exact beats every prefix
+    assert catalog.name_for(bytes.fromhex('E280F3372000000000000001')) == 'batch_a' # Longest prefix
+    assert catalog.name_for(bytes.fromhex('E280F3000000000000000001')) == 'batch'
+    assert catalog.name_for(bytes.fromhex('E2801F000000000000000001')) == 'odd_prefix' # Half-byte prefix
+    assert catalog.name_for(bytes.fromhex('E2802F000000000000000001')) is None
+    assert catalog.name_for(bytes.fromhex('312345AA0000')) == 'mask_first' # Masks in file order
+    assert catalog.name_for(bytes.fromhex('312345BB0000')) == 'mask_second'
+    assert catalog.name_for(bytes.fromhex('31')) is None # Shorter than the mask
+    assert catalog.name_for(bytearray.fromhex(CUP)) == 'cup'
+    assert catalog.epcs_for('cup') == [bytes.fromhex(CUP)]
+    assert catalog.stats()['tags'] == 1 and catalog.stats()['prefixes'] == 2 and catalog.stats()['masks'] == 3
+
+
+def test_invalid_mask_rule_is_rejected(tmp_path):
+    path = tmp_path / 'epc_catalog.json'
+    write_catalog(path, {"masks": [{"value": "E28", "mask": "FFF", "name": "bad"}]})
+    catalog = EPCCatalog(str(path))
+    assert catalog.loaded_at is None and catalog.stats()['masks'] == 0
+
+
+def test_hot_reload(catalog_file):
+    catalog = EPCCatalog(str(catalog_file), check_interval=0)
+    knife = bytes.fromhex('E280F3372000F0000FDAE3BB')
+    assert catalog.name_for(knife) == 'batch_a' # Cached as a prefix match
+
+    write_catalog(catalog_file, {"tags": {CUP: "cup", knife.hex().upper(): "knife"}})
+    assert catalog.name_for(knife) == 'knife' # Picked up on the next lookup, cache dropped with the old index
+    assert catalog.name_for(bytes.fromhex('E280F3000000000000000001')) is None
+
+    loaded_at = catalog.loaded_at
+    catalog_file.write_text('{"tags": ') # A half-written file keeps the current catalog
+    assert catalog.name_for(knife) == 'knife' and catalog.loaded_at == loaded_at
+    assert not catalog.reload()
+
+    os.remove(catalog_file)
+    assert catalog.name_for(knife) == 'knife'
+
+
+def test_changes_are_checked_at_most_every_interval(catalog_file):
+    catalog = EPCCatalog(str(catalog_file), check_interval=60)
+    write_catalog(catalog_file, {"tags": {CUP: "mug"}})
+    assert catalog.name_for(bytes.fromhex(CUP)) == 'cup'
+    assert catalog.reload()
+    assert catalog.name_for(bytes.fromhex(CUP)) == 'mug'
@@ -0,0 +1,96 @@
+# test_event_bus.py
+# Binary event batches: encode/decode round trip, coalescing and publish order across rooms.
+import pytest
+
+from event_bus import EventBus, decode_batch, encode_batch, encode_event
+
+CUP = 'E280F3372000F0000FDAE3BA'
+KNIFE = 'E280F3372000F0000FDAE3BB'
+
+
+def payload(epc=CUP, rssi=-52.5, name='cup', reader_id='main', **fields):
+    return dict({'epc': epc, 'pc': '3000', 'rssi': rssi, 'reads': 7, 'first_seen': 1700000000.25,
+                 'last_seen': 1700000001.5, 'name': name, 'reader_id': reader_id}, **fields)
+
+
+def topics(event_name, data):
+    """Same topics as main_server.event_topics()."""
+    kind = 'rssi' if event_name == 'rssi_changed' else 'presence'
+    return (kind, f"{kind}:reader:{data['reader_id']}", f"{kind}:item:{data['name']}")
+
+
+class Recorder:
+    def __init__(self):
+        self.batches = []
+
+    def emit(self, event, data, to):
+        self.batches.append((to, decode_batch(data)))
+
+    def events(self):
+        return [(name, data['epc'], data['rssi']) for _to, events in self.batches for name, data in events]
+
+
+def publish(bus, event_name, **fields):
+    data = payload(**fields)
+    bus.publish(event_name, data, topics(event_name, data))
+
+
+def test_round_trip():
+    events = [('tag_arrived', payload()), ('rssi_changed', payload(KNIFE, rssi=-70.0, name='刀', reader_id=None)),
+              ('tag_left', payload(name='x' * 300))]
+    decoded = decode_batch(encode_batch([encode_event(name, data) for name, data in events]))
+    assert [name for name, _data in decoded] == ['tag_arrived', 'rssi_changed', 'tag_left']
+    first = decoded[0][1]
+    assert first == dict(payload(), status='success')
+    assert decoded[1][1]['name'] == '刀' and decoded[1][1]['reader_id'] is None and decoded[1][1]['rssi'] == -70.0
+    assert decoded[2][1]['name'] == 'x' * 255 # Text fields are capped at 255 bytes
+    assert decode_batch(encode_batch([])) == []
+
+
+def test_malformed_batches():
+    data = encode_batch([encode_event('tag_arrived', payload())])
+    with pytest.raises(ValueError):
+        decode_batch(data[:-3])
+    with pytest.raises(ValueError):
+        decode_batch(b'\x02' + data[1:])
+
+
+def test_rssi_updates_coalesce_and_are_superseded():
+    recorder = Recorder()
+    bus = EventBus(recorder.emit)
+    publish(bus, 'rssi_changed', rssi=-60.0)
+    publish(bus, 'rssi_changed', epc=KNIFE, name='knife', rssi=-61.0)
+    publish(bus, 'rssi_changed', rssi=-55.0)
+    bus.flush()
+    assert recorder.events() == [('rssi_changed', KNIFE, -61.0), ('rssi_changed', CUP, -55.0)]
+
+    recorder.batches.clear()
+    publish(bus, 'rssi_changed', rssi=-58.0)
+    publish(bus, 'tag_left', rssi=-58.0) # Different rooms than the RSSI update, still supersedes it
+    assert bus.flush() == 1
+    assert recorder.events() == [('tag_left', CUP, -58.0)]
+    assert recorder.batches[0][0] == ['topic:presence', 'topic:presence:reader:main', 'topic:presence:item:cup']
+
+
+def test_publish_order_is_kept_across_rooms():
+    recorder = Recorder()
+    bus = EventBus(recorder.emit)
+    # Unknown tags share their rooms; KNIFE's RSSI update must not overtake its arrival
+    publish(bus, 'rssi_changed', name='Unknown', rssi=-60.0)
+    publish(bus, 'tag_arrived', epc=KNIFE, name='Unknown', rssi=-62.0)
+    publish(bus, 'rssi_changed', epc=KNIFE, name='Unknown', rssi=-61.0)
+    publish(bus, 'tag_arrived', epc='E2', name='Unknown', rssi=-70.0)
+    assert bus.flush() == 4
+    assert recorder.events() == [('rssi_changed', CUP, -60.0), ('tag_arrived', KNIFE, -62.0),
+                                 ('rssi_changed', KNIFE, -61.0), ('tag_arrived', 'E2', -70.0)]
+    assert bus.flush() == 0
+
+
+def test_consecutive_events_share_a_batch_up_to_the_limit():
+    recorder = Recorder()
+    bus = EventBus(recorder.emit)
+    bus.MAX_BATCH_EVENTS = 3
+    for index in range(7):
+        publish(bus, 'tag_arrived', epc=f'{index:024X}', rssi=-50.0)
+    assert bus.flush() == 3
+    assert [len(events) for _to, events in recorder.batches] == [3, 3, 1]
@@ -0,0 +1,145 @@
+# test_event_log.py
+# EventLog: segment rotation, sidecars, and reloading (including after a crash).
+import os
+
+import numpy as np
+import pytest
+
+from event_log import HEADER_SIZE, RECORD, EventLog
+
+T0 = 1699999200.0 # On an hour boundary
+EPCS = ("E20000000000000000000AA1", "E20000000000000000000AA2")
+
+
+@pytest.fixture
+def log_dir(tmp_path):
+    return str(tmp_path / "event_log")
+
+
+def _open(log_dir, **options):
+    options.setdefault("flush_interval", 3600) # Only flush() writes, so batches are deterministic
+    return EventLog(log_dir, **options)
+
+
+def _fill(log, count, step=1.0, start=T0):
+    for index in range(count):
+        log.append_read(EPCS[index % 2], "reader-%d" % (index % 3), 100 + index % 50, timestamp=start + index * step)
+    end = start + count * step # After the reads: timestamps are written non-decreasing
+    log.append_session_event("reset", "booth-1", timestamp=end)
+    log.append_session_event("completed", "booth-1", item="cup", timestamp=end + 90)
+    log.flush()
+
+
+def _files(log_dir, extension):
+    return sorted(name for name in os.listdir(log_dir) if name.endswith(extension))
+
+
+def _answers(log):
+    """Every query's answer over the whole test range."""
+    end = T0 + 4 * 3600
+    return (log.stats()["records"], log.reads_per_item(T0, end, window=600), log.rssi_distribution(T0, end),
+            log.completion_times(T0, end), log.events(T0, end, limit=10000))
+
+
+def test_rotates_by_record_count_and_seals_segments(log_dir):
+    log = _open(log_dir, segment_records=100)
+    _fill(log, 250)
+    assert log.stats()["segments"] == 3 and log.stats()["records"] == 252
+    assert _files(log_dir, ".evt") == ["seg-000001.evt", "seg-000002.evt", "seg-000003.evt"]
+    assert _files(log_dir, ".npz") == ["seg-000001.npz", "seg-000002.npz"] # The active segment has none
+    for name, count in zip(_files(log_dir, ".evt"), (100, 100, 52)):
+        assert os.path.getsize(os.path.join(log_dir, name)) == HEADER_SIZE + count * RECORD.itemsize
+
+    reads = log.events(T0, T0 + 3600, limit=10000)["reads"]
+    assert len(reads) == 250 # Across all three segments, oldest first
+    assert [read["t"] for read in reads] == sorted(read["t"] for read in reads)
+    totals = log.reads_per_item(T0, T0 + 3600)["items"]
+    assert sum(sum(counts) for counts in totals.values()) == 250
+    log.close()
+
+
+def test_rotates_by_age_within_one_batch(log_dir):
+    log = _open(log_dir, segment_seconds=3600)
+    _fill(log, 170, step=60) # Almost three hours in one flush
+    assert log.stats()["segments"] == 3
+    for segment in log._segments:
+        assert segment.last_t - segment.first_t < 3600
+    assert log.reads_per_item(T0, T0 + 3 * 3600, window=3600)["windows"] == [T0, T0 + 3600, T0 + 7200]
+    log.close()
+
+
+def test_reload_gives_the_same_answers(log_dir):
+    log = _open(log_dir, segment_records=100)
+    _fill(log, 250)
+    before = _answers(log)
+    log.close()
+
+    reloaded = _open(log_dir, segment_records=100)
+    assert _answers(reloaded) == before
+    reloaded.append_read(EPCS[0], "reader-0", 120, timestamp=T0 + 400) # Continues the active segment
+    reloaded.flush()
+    assert reloaded.stats()["segments"] == 3 and reloaded.stats()["records"] == 253
+    assert reloaded.events(T0 + 400, T0 + 401)["reads"] == [{"t": T0 + 400, "epc": EPCS[0], "reader_id": "reader-0",
+                                                           "rssi": 120}]
+    reloaded.close()
+
+
+@pytest.mark.parametrize("damage", ["missing", "corrupt", "stale"])
+def test_sealed_segment_summaries_are_rebuilt_without_a_usable_sidecar(log_dir, damage):
+    log = _open(log_dir, segment_records=100)
+    _fill(log, 250)
+    before = _answers(log)
+    log.close()
+
+    sidecar = os.path.join(log_dir, "seg-000001.npz")
+    if damage == "missing":
+        os.remove(sidecar)
+    elif damage == "corrupt":
+        with open(sidecar, "wb") as f:
+            f.write(b"not an npz")
+    else:
+        with np.load(sidecar) as data:
+            arrays = dict(data)
+        arrays["count"] = np.array([99]) # Written for fewer records than the segment holds
+        np.savez(sidecar, **arrays)
+
+    reloaded = _open(log_dir, segment_records=100)
+    assert _answers(reloaded) == before
+    with np.load(sidecar) as data:
+        assert int(data["count"][0]) == 100 # Written again
+    reloaded.close()
+
+
+def test_reload_drops_a_record_cut_short_by_a_crash(log_dir):
+    log = _open(log_dir, segment_records=100)
+    _fill(log, 150)
+    before = _answers(log)
+    log.close()
+
+    active = os.path.join(log_dir, "seg-000002.evt")
+    size = os.path.getsize(active)
+    with open(active, "ab") as f:
+        f.write(b"\x01" * (RECORD.itemsize // 2))
+
+    reloaded = _open(log_dir, segment_records=100)
+    assert os.path.getsize(active) == size
+    assert _answers(reloaded) == before
+    reloaded.append_read(EPCS[1], "reader-1", 90, timestamp=T0 + 300)
+    reloaded.flush()
+    assert os.path.getsize(active) == size + RECORD.itemsize
+    assert reloaded.events(T0 + 300, T0 + 301)["reads"][0]["rssi"] == 90
+    reloaded.close()
+
+
+def test_skips_files_that_are_not_segments_without_overwriting_them(log_dir):
+    os.makedirs(log_dir)
+    foreign = os.path.join(log_dir, "seg-000001.evt")
+    with open(foreign, "wb") as f:
+        f.write(b"something else entirely")
+    log = _open(log_dir)
+    assert log.stats()["segments"] == 0
+    _fill(log, 10)
+    assert _files(log_dir, ".evt") == ["seg-000001.evt", "seg-000002.evt"]
+    with open(foreign, "rb") as f:
+        assert f.read() == b"something else entirely"
+    log.close()
@@ -0,0 +1,110 @@
+# test_fake_serial.py
+# Capture files and ReplaySerial: timing, injected faults, disconnects and RFIDReader on a replay.
+import time
+
+import numpy as np
+import pytest
+import serial
+
+from capture_log import KIND_DISCONNECT, KIND_IMU, KIND_MARKER, KIND_SERIAL_RX, CaptureReader, CaptureRecord, CaptureWriter
+from fake_serial import ReplaySerial, synthetic_records
+from rfid_frames import FrameDecoder, build_tag_notification
+from rfid_reader import RFIDReader
+
+EPCS = [bytes([0xE2, 0x80, index] * 4) for index in range(20)]
+TAGS = [build_tag_notification(epc) for epc in EPCS]
+
+
+def read_all(port, deadline=5.0):
+    data = bytearray()
+    end = time.monotonic() + deadline
+    while not port.finished or port.in_waiting:
+        data += port.read(port.in_waiting or 1)
+        assert time.monotonic() < end
+    return bytes(data)
+
+
+def test_capture_round_trip_and_truncated_tail(tmp_path):
+    path = str(tmp_path / 'field.cap')
+    writer = CaptureWriter(path)
+    writer.serial_rx(TAGS[0], channel=1)
+    writer.imu(np.ones((2, 6)))
+    writer.disconnect('cable pulled')
+    writer.close()
+    with open(path, 'ab') as f:
+        f.write(b'\x01' * 20) # A record header cut short by a crash
+
+    records = list(CaptureReader(path).records(kinds={KIND_SERIAL_RX, KIND_IMU, KIND_DISCONNECT}))
+    assert [record.kind for record in records] == [KIND_SERIAL_RX, KIND_IMU, KIND_DISCONNECT]
+    assert bytes(records[0].payload) == TAGS[0] and records[0].channel == 1
+    assert records[1].imu_samples().tolist() == [[1.0] * 6] * 2
+    assert records[0].timestamp_ns <= records[1].timestamp_ns <= records[2].timestamp_ns
+
+    CaptureWriter(path).close() # Reopening drops the partial record and keeps appending
+    kinds = [record.kind for record in CaptureReader(path).records()]
+    assert kinds.count(KIND_MARKER) == 2 and len(kinds) == 5
+
+    not_a_capture = tmp_path / 'notes.txt'
+    not_a_capture.write_bytes(b'not a capture file')
+    with pytest.raises(ValueError):
+        list(CaptureReader(str(not_a_capture)).records())
+
+
+def test_replay_as_fast_as_possible_with_faults():
+    port = ReplaySerial(synthetic_records(TAGS), speed=0, timeout=1, split_rate=0.5, corrupt_rate=0.2, seed=3)
+    data = read_all(port)
+    assert len(data) == sum(map(len, TAGS))
+    assert port.stats["splits"] > 0 and port.stats["corrupted"] > 0
+
+    decoder = FrameDecoder()
+    frames = decoder.feed(data)
+    assert len(frames) + decoder.errors["checksum"] == len(TAGS)
+    assert decoder.errors["checksum"] == port.stats["corrupted"]
+
+    clean = ReplaySerial(synthetic_records(TAGS), speed=0, timeout=1, split_rate=0.5, seed=3)
+    assert read_all(clean) == b''.join(TAGS) # Splitting changes the reads, never the bytes
+
+
+def test_replay_keeps_recorded_timing():
+    port = ReplaySerial(synthetic_records(TAGS[:3], interval=0.1), speed=1, timeout=1)
+    started = time.monotonic()
+    read_all(port)
+    assert 0.18 <= time.monotonic() - started < 1.0
+    fast = ReplaySerial(synthetic_records(TAGS[:3], interval=0.1), speed=10, timeout=1)
+    started = time.monotonic()
+    read_all(fast)
+    assert time.monotonic() - started < 0.15
+
+
+def test_recorded_and_injected_disconnects():
+    records = synthetic_records(TAGS[:2]) + [CaptureRecord(int(0.03e9), KIND_DISCONNECT, 0, b'cable pulled')]
+    port = ReplaySerial(records, speed=0, timeout=1)
+    assert port.read(len(TAGS[0]) + len(TAGS[1])) == TAGS[0] + TAGS[1] # Data before the failure still arrives
+    with pytest.raises(serial.SerialException, match='cable pulled'):
+        port.read(1)
+
+    port = ReplaySerial(synthetic_records(TAGS, interval=0.05), speed=1, timeout=1, disconnect_after=0.12)
+    with pytest.raises(serial.SerialException, match='Injected disconnect'):
+        read_all(port)
+
+    port.close()
+    with pytest.raises(serial.PortNotOpenError):
+        port.write(b'\x00')
+
+
+def test_rfid_reader_streams_a_replay(tmp_path):
+    path = str(tmp_path / 'field.cap')
+    writer = CaptureWriter(path)
+    for tag in TAGS[:5]:
+        writer.serial_rx(tag, channel=0)
+    writer.serial_rx(TAGS[9], channel=1) # Another reader's traffic
+    writer.close()
+
+    reader = RFIDReader(serial_factory=ReplaySerial.factory(path, channel=0, speed=0), timeout=0.2)
+    tags = []
+    for tag in reader.continuous_inventory():
+        tags.append(tag.epc)
+        if len(tags) == 5:
+            break
+    assert tags == EPCS[:5]
+    assert not reader.is_connected
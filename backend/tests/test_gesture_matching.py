@@ -0,0 +1,71 @@
+# test_gesture_matching.py
+# DTW scoring: time-stretch invariance and pruned batch search vs. exhaustive DTW.
+import numpy as np
+import pytest
+
+from gesture_matching import GestureMatcher, TemplateLibrary, cost_matrices, dtw_batch, template_features
+
+CONFIG = {"decay": 0.5} # Fixed scoring, independent of data/gesture_scoring.json
+
+
+def gesture(length, phase=0.0, freq=1.0):
+    """A smooth 6-axis movement sampled `length` times over the same duration."""
+    t = np.linspace(0, 2 * np.pi, length)[:, None]
+    axes = np.arange(6)[None, :]
+    return np.sin(freq * t + phase + axes) * (1 + axes) + 0.5
+
+
+def exhaustive(library, action, attempt):
+    """Smallest normalized DTW distance over every template, no pruning."""
+    best = None
+    for index, template in enumerate(library.templates(action)):
+        max_accel, avg_accel = template_features(template)
+        distance = dtw_batch(cost_matrices(attempt[None], template, max_accel, library.config))[0]
+        distance /= len(template) * avg_accel
+        if best is None or distance < best[0]:
+            best = (distance, index)
+    return best
+
+
+def test_time_stretched_attempt_still_matches():
+    matcher = GestureMatcher({"cup": [gesture(60)]}, config=CONFIG)
+    same, slower, faster = matcher.score_batch("cup", [gesture(60), gesture(80), gesture(45)])
+    other = matcher.score("cup", gesture(60, phase=2.0, freq=2.0))
+    assert same["distance"] == pytest.approx(0.0)
+    for result in (slower, faster):
+        assert result["matchPercentage"] >= 85 and result["matchPercentage"] > other["matchPercentage"] + 30
+    # Comparing sample i with sample i, as gesture.js does, would penalize the stretch
+    template, attempt = gesture(60), gesture(80)[:60]
+    max_accel, avg_accel = template_features(template)
+    lockstep = np.trace(cost_matrices(attempt[None], template, max_accel, matcher.config)[0]) / (60 * avg_accel)
+    assert slower["distance"] * 5 < lockstep
+
+
+def test_batch_search_matches_exhaustive_dtw():
+    rng = np.random.default_rng(7)
+    templates = [gesture(length, phase=rng.uniform(0, 6), freq=rng.uniform(0.5, 2))
+                 for length in (40, 40, 50, 50, 50, 60) for _ in range(3)]
+    library = TemplateLibrary({"knife": templates}, config=CONFIG)
+    attempts = [gesture(int(rng.integers(35, 70)), phase=rng.uniform(0, 6), freq=rng.uniform(0.5, 2))
+                + rng.normal(0, 0.05, (1, 6)) for _ in range(12)]
+    attempts.append(templates[4][::2])
+
+    results = library.nearest_batch("knife", attempts)
+    for attempt, (distance, index) in zip(attempts, results):
+        expected_distance, expected_index = exhaustive(library, "knife", attempt)
+        assert distance == pytest.approx(expected_distance)
+        assert index == expected_index
+    assert library.nearest("knife", attempts[0]) == results[0]
+    stats = library.stats
+    assert stats["queries"] == 14
+    assert stats["lb_kim_pruned"] + stats["lb_keogh_pruned"] > 0
+    assert stats["dtw_completed"] + stats["lb_kim_pruned"] + stats["lb_keogh_pruned"] == 14 * len(templates)
+
+
+def test_empty_attempt():
+    matcher = GestureMatcher({"phone": [gesture(30)]}, config=CONFIG)
+    empty, full = matcher.score_batch("phone", [[], gesture(30)])
+    assert empty["distance"] is None and empty["template_index"] is None
+    assert full["template_index"] == 0
+    with pytest.raises(KeyError):
+        matcher.score("monitor", gesture(30))
@@ -0,0 +1,86 @@
+# test_imu_stream.py
+# IMU sample decoding, the ring buffer and online gesture segmentation.
+import numpy as np
+import pytest
+
+from gesture_matching import GestureMatcher
+from imu_stream import (GestureSegmenter, IMURingBuffer, IMUStream, parse_binary_samples, parse_samples,
+                        parse_text_samples)
+
+GRAVITY = [0.0, 0.0, 9.8, 0.0, 0.0, 0.0]
+
+
+def idle(count):
+    return np.tile(GRAVITY, (count, 1))
+
+
+def motion(count):
+    t = np.linspace(0, 2 * np.pi, count)[:, None]
+    return idle(count) + np.hstack([3 * np.sin(t), 2 * np.cos(t), np.sin(2 * t), 2 * np.sin(t), np.cos(t), 0 * t])
+
+
+def test_parse_text_and_binary():
+    text = 'ax:10.01,ay:-0.69,az:3.05,gx:-0.44,gy:0.33,gz:-0.94;ax:1,gz:2\n\n'
+    rows = parse_text_samples(text)
+    assert rows.tolist() == [[10.01, -0.69, 3.05, -0.44, 0.33, -0.94], [1, 0, 0, 0, 0, 2]]
+    packed = rows.astype('<f4').tobytes()
+    assert np.allclose(parse_samples(packed), rows, atol=1e-5)
+    assert parse_samples([{'accel': {'x': 1}, 'gyro': {'z': 2}}]).tolist() == [[1, 0, 0, 0, 0, 2]]
+    with pytest.raises(ValueError):
+        parse_binary_samples(packed[:-1])
+    with pytest.raises(ValueError):
+        parse_text_samples('ax:fast')
+
+
+def test_ring_buffer_keeps_sequence_numbers_after_wrapping():
+    buffer = IMURingBuffer(capacity=16)
+    samples = np.arange(40 * 6, dtype=float).reshape(40, 6)
+    assert buffer.extend(samples[:10]) == 0
+    assert buffer.extend(samples[10:]) == 10 # More than the capacity: only the newest 16 are kept
+    assert buffer.total == 40 and buffer.oldest == 24
+    assert np.array_equal(buffer.window(20, 30), samples[24:30]) # Clipped to what is buffered
+    assert np.array_equal(buffer.window(35, 99), samples[35:40])
+    assert len(buffer.window(10, 20)) == 0
+
+
+@pytest.mark.parametrize("chunk", [1, 7, 200])
+def test_segmenter_finds_the_motion_whatever_the_chunking(chunk):
+    samples = np.vstack([idle(30), motion(25), idle(30)])
+    buffer = IMURingBuffer(capacity=256)
+    segmenter = GestureSegmenter()
+    segments = []
+    for offset in range(0, len(samples), chunk):
+        first = buffer.extend(samples[offset:offset + chunk])
+        segments += segmenter.update(buffer, first, len(samples[offset:offset + chunk]))
+    assert len(segments) == 1
+    start, end = segments[0]
+    assert 30 - segmenter.pre_roll - 1 <= start <= 32 # Starts with the motion, pre-roll included
+    assert 53 <= end <= 60 # Trailing idle frames are not part of the gesture
+    assert not segmenter.active
+
+
+def test_segmenter_limits():
+    segmenter = GestureSegmenter(max_samples=20)
+    buffer = IMURingBuffer(capacity=256)
+    long_motion = np.vstack([idle(10), np.tile(motion(25), (3, 1))])
+    segments = segmenter.update(buffer, buffer.extend(long_motion), len(long_motion))
+    assert segments and all(end - start == 20 for start, end in segments)
+
+    segmenter = GestureSegmenter(min_samples=12) # The energy window smears a twitch over ~9 samples
+    buffer = IMURingBuffer(capacity=256)
+    twitch = np.vstack([idle(20), idle(2) + [5, 0, 0, 3, 0, 0], idle(20)])
+    assert segmenter.update(buffer, buffer.extend(twitch), len(twitch)) == [] # Too short to be a gesture
+
+
+def test_stream_scores_detected_gestures():
+    template = motion(25)
+    stream = IMUStream(GestureMatcher({"cup": [template]}, config={"decay": 0.5}))
+    assert stream.feed(idle(30), action="cup") == []
+    assert stream.feed(motion(25), action="cup") == []
+    assert stream.state()["recording"]
+    results = stream.feed(idle(30), action="cup")
+    assert len(results) == 1
+    assert results[0]["samples"] == results[0]["end"] - results[0]["start"]
+    assert results[0]["template_index"] == 0 and results[0]["matchPercentage"] > 50
+    stream.reset()
+    assert stream.state() == {"recording": False, "gesture_start": None, "received": 0}
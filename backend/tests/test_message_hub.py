@@ -0,0 +1,112 @@
+# test_message_hub.py
+# Fan-out and RPC retry behaviour of the message hub (run from backend/: python -m pytest tests)
+import os
+import tempfile
+import threading
+import time
+
+import pytest
+
+from message_hub import (Channel, Hub, HubClient, ROLE_PUBLISH, ROLE_PUBSUB, ROLE_RPC, default_address)
+
+AUTHKEY = b'test-key'
+
+
+@pytest.fixture
+def hub():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        address = os.path.join(tmp_dir, 'hub.sock') if hasattr(os, 'fork') else default_address(47000)
+        hub = Hub(address, AUTHKEY)
+        hub.start()
+        yield hub
+        hub.close()
+
+
+def _connect(hub, role):
+    channel = Channel.connect(hub.address, AUTHKEY, timeout=5)
+    channel.send(role)
+    return channel
+
+
+def _receive(channel, count, timeout=5):
+    channel.sock.settimeout(timeout)
+    return [channel.recv() for _ in range(count)]
+
+
+def _wait_for_subscribers(hub, count):
+    deadline = time.monotonic() + 5
+    while len(hub._subscribers) < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(hub._subscribers) == count
+
+
+def test_publish_only_clients_are_never_written_to(hub):
+    subscriber = _connect(hub, ROLE_PUBSUB)
+    publishers = [_connect(hub, ROLE_PUBLISH) for _ in range(2)]
+    _wait_for_subscribers(hub, 1)
+    received = []
+    reader = threading.Thread(target=lambda: received.extend(_receive(subscriber, 2000)))
+    reader.start()
+    payload = 'x' * 400
+    for index in range(2000): # Far more than a socket buffer's worth per publisher
+        publishers[index % 2].send((index, payload))
+    reader.join(10)
+    assert sorted(index for index, _ in received) == list(range(2000))
+    for publisher in publishers:
+        assert not publisher.peer_closed() # Nothing was sent to them
+        publisher.close()
+    subscriber.close()
+
+
+def test_slow_subscriber_does_not_hold_up_the_others(hub):
+    hub.SUBSCRIBER_QUEUE = 500 # The slow one overflows it (and its socket buffer) long before 3000
+    slow = _connect(hub, ROLE_PUBSUB) # Never reads
+    fast = _connect(hub, ROLE_PUBSUB)
+    _wait_for_subscribers(hub, 2)
+    publisher = _connect(hub, ROLE_PUBLISH)
+    received = []
+    reader = threading.Thread(target=lambda: received.extend(_receive(fast, 3000)))
+    reader.start()
+    payload = b'y' * 4096
+    for index in range(3000):
+        publisher.send((index, payload))
+    reader.join(10)
+    assert [index for index, _ in received] == list(range(3000))
+    _wait_for_subscribers(hub, 1) # The slow one was dropped
+    for channel in (slow, fast, publisher):
+        channel.close()
+
+
+def test_call_is_not_repeated_when_the_reply_times_out(hub):
+    calls = []
+
+    def slow_append(value):
+        calls.append(value)
+        time.sleep(0.5)
+        return value
+
+    hub.register('log', type('Log', (), {'append': staticmethod(slow_append)}), ['append'])
+    client = HubClient(hub.address, AUTHKEY, timeout=0.1)
+    with pytest.raises(ConnectionError):
+        client.call('log.append', 1)
+    time.sleep(0.6)
+    assert calls == [1]
+
+    client.timeout = 5
+    assert client.call('log.append', 2) == 2 # A fresh connection; the late reply isn't mixed up
+    assert calls == [1, 2]
+
+
+def test_call_reconnects_when_the_idle_connection_was_closed(hub):
+    hub.register('echo', type('Echo', (), {'say': staticmethod(lambda value: value)}), ['say'])
+    client = HubClient(hub.address, AUTHKEY)
+    assert client.call('echo.say', 'a') == 'a'
+    client._channel.sock.shutdown(2) # As if the hub had closed it
+    assert client.call('echo.say', 'b') == 'b'
+
+
+def test_rpc_role_is_not_subscribed(hub):
+    channel = _connect(hub, ROLE_RPC)
+    time.sleep(0.05)
+    assert not hub._subscribers
+    channel.close()
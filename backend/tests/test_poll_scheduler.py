@@ -0,0 +1,70 @@
+# test_poll_scheduler.py
+# AdaptivePollScheduler: continuous while tags are read, bounded backoff while idle.
+import pytest
+
+from poll_scheduler import AdaptivePollScheduler, ContinuousPolling, scheduler_from_config
+
+
+def idle_gaps(scheduler, count, start=10.0):
+    """Gaps chosen for `count` empty bursts after the hold period."""
+    return [scheduler.next_gap(start + index) for index in range(count)]
+
+
+def test_backoff_while_idle_and_back_to_continuous_on_a_read():
+    scheduler = AdaptivePollScheduler(burst=0.05, hold=2.0, first_gap=0.02, backoff=2.0, max_gap=0.1)
+    scheduler.reset(0.0)
+    assert scheduler.next_gap(1.9) == 0.0 # Still within the hold period
+    assert idle_gaps(scheduler, 5) == pytest.approx([0.02, 0.04, 0.08, 0.1, 0.1])
+    assert scheduler.status()["mode"] == "idle"
+
+    scheduler.record(1, 20.0)
+    assert scheduler.gap == 0.0 and scheduler.status()["mode"] == "active"
+    assert scheduler.next_gap(21.0) == 0.0
+    assert scheduler.next_gap(22.5) == pytest.approx(0.02) # Backoff starts over
+
+
+def test_latency_slo_caps_the_gap():
+    scheduler = AdaptivePollScheduler(burst=0.05, hold=0, max_gap=5.0, latency_slo=0.3)
+    scheduler.reset(0.0)
+    gaps = idle_gaps(scheduler, 20)
+    assert max(gaps) == pytest.approx(0.25)
+    assert scheduler.status()["worst_case_latency"] == pytest.approx(0.3)
+    assert not scheduler.slo_limited
+
+
+def test_duty_cycle_sets_a_floor_on_idle_gaps():
+    scheduler = AdaptivePollScheduler(burst=0.05, hold=0, first_gap=0.01, max_gap=1.0, duty_cycle=0.25)
+    scheduler.reset(0.0)
+    gaps = idle_gaps(scheduler, 10)
+    assert min(gaps) == pytest.approx(0.15) # burst * (1 - 0.25) / 0.25
+    assert all(scheduler.burst / (scheduler.burst + gap) <= 0.25 + 1e-9 for gap in gaps)
+    assert max(gaps) == pytest.approx(1.0)
+
+
+def test_latency_slo_wins_over_duty_cycle():
+    scheduler = AdaptivePollScheduler(burst=0.05, hold=0, latency_slo=0.1, duty_cycle=0.1)
+    scheduler.reset(0.0)
+    assert scheduler.slo_limited
+    assert idle_gaps(scheduler, 3) == pytest.approx([0.05, 0.05, 0.05])
+    status = scheduler.status()
+    assert status["slo_limited"] and status["duty_cycle"] == pytest.approx(0.5)
+
+
+@pytest.mark.parametrize("options", [
+    {"burst": 0}, {"first_gap": 0}, {"max_gap": -1}, {"backoff": 0.5},
+    {"duty_cycle": 0}, {"duty_cycle": 1.5}, {"latency_slo": 0.01},
+])
+def test_out_of_range_parameters(options):
+    with pytest.raises(ValueError):
+        AdaptivePollScheduler(**options)
+
+
+def test_scheduler_from_config():
+    assert isinstance(scheduler_from_config(None), ContinuousPolling)
+    assert scheduler_from_config({"mode": "continuous"}).next_gap(0) == 0.0
+    scheduler = scheduler_from_config({"mode": "adaptive", "latency_slo": 0.3, "duty_cycle": 0.25})
+    assert isinstance(scheduler, AdaptivePollScheduler) and scheduler.ceiling == pytest.approx(0.25)
+    with pytest.raises(ValueError):
+        scheduler_from_config({"mode": "adaptive", "latency": 0.3})
+    with pytest.raises(ValueError):
+        scheduler_from_config({"mode": "sometimes"})
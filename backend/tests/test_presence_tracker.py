@@ -0,0 +1,53 @@
+# test_presence_tracker.py
+# PresenceTracker: arrivals after enough reads, RSSI smoothing and departures.
+from presence_tracker import PresenceTracker
+from rfid_frames import TagRead
+
+EPC = bytes.fromhex('E280F3372000F0000FDAE3BA')
+
+
+def _read(t, rssi=200, epc=EPC):
+    return TagRead(epc, b'\x30\x00', rssi, t)
+
+
+def _names(events):
+    return [name for name, _ in events]
+
+
+def test_arrives_after_enough_reads():
+    tracker = PresenceTracker(arrive_reads=2, leave_timeout=1.0)
+    assert tracker.observe(_read(0.0), 'main') == []
+    events = tracker.observe(_read(0.1), 'main')
+    assert _names(events) == ['tag_arrived']
+    payload = events[0][1]
+    assert payload['epc'] == EPC.hex().upper() and payload['reads'] == 2 and payload['reader_id'] == 'main'
+    assert tracker.observe(_read(0.2)) == [] # No repeat while present
+
+
+def test_stray_read_never_arrives():
+    tracker = PresenceTracker(arrive_reads=2, leave_timeout=1.0)
+    tracker.observe(_read(0.0))
+    assert tracker.observe(_read(5.0)) == [] # Too late to count with the first read
+    assert tracker.expire(now=10.0) == [] # Never present, so no departure
+
+
+def test_rssi_changed_uses_smoothed_value():
+    tracker = PresenceTracker(arrive_reads=1, ema_alpha=0.5, rssi_delta=10)
+    tracker.observe(_read(0.0, rssi=200))
+    assert tracker.observe(_read(0.1, rssi=210)) == [] # EMA 205: below the threshold
+    events = tracker.observe(_read(0.2, rssi=220)) # EMA 212.5
+    assert _names(events) == ['rssi_changed'] and events[0][1]['rssi'] == 212.5
+
+
+def test_leaves_after_timeout():
+    tracker = PresenceTracker(arrive_reads=1, leave_timeout=1.0)
+    tracker.observe(_read(0.0))
+    assert tracker.expire(now=0.5) == []
+    assert _names(tracker.expire(now=1.6)) == ['tag_left']
+    assert tracker.present_tags() == []
+
+
+def test_stale_tag_leaves_and_arrives_again_on_next_read():
+    tracker = PresenceTracker(arrive_reads=1, leave_timeout=1.0)
+    tracker.observe(_read(0.0))
+    assert _names(tracker.observe(_read(3.0))) == ['tag_left', 'tag_arrived']
@@ -0,0 +1,97 @@
+# test_reader_manager.py
+# Cross-reader de-duplication and handing a just-stopped reader out with exclusive().
+import threading
+import time
+
+from fake_serial import ReplaySerial, synthetic_records
+from reader_manager import ReaderManager
+from rfid_frames import TagRead, build_tag_notification
+from rfid_reader import RFIDReader
+
+EPC = bytes.fromhex('E280F3372000F0000FDAE3BA')
+
+
+def manager(**options):
+    readers = {reader_id: RFIDReader(port=reader_id) for reader_id in ('cup', 'knife')}
+    return ReaderManager(readers, dedup_window=0.5, rssi_margin=3, **options)
+
+
+def feed(manager, forwarded, reader_id, rssi, timestamp):
+    handle = manager._make_handler(reader_id, forwarded.append)
+    handle({"event": "tag", "tag": TagRead(EPC, b'\x30\x00', rssi, timestamp)})
+
+
+def test_strongest_reader_owns_the_tag():
+    readers = manager()
+    forwarded = []
+    feed(readers, forwarded, 'cup', 200, 100.0)
+    feed(readers, forwarded, 'knife', 202, 100.1) # Not stronger by the margin: suppressed
+    feed(readers, forwarded, 'cup', 190, 100.2) # The owner's reads always pass
+    assert [event["reader_id"] for event in forwarded] == ['cup', 'cup']
+    assert readers.owner(EPC) == 'cup'
+
+    feed(readers, forwarded, 'knife', 210, 100.3) # Clearly stronger: takes the tag over
+    assert readers.owner(EPC) == 'knife' and forwarded[-1]["reader_id"] == 'knife'
+    feed(readers, forwarded, 'cup', 200, 100.4)
+    assert forwarded[-1]["reader_id"] == 'knife'
+
+    feed(readers, forwarded, 'cup', 150, 101.0) # The owner went quiet for longer than the window
+    assert readers.owner(EPC) == 'cup' and forwarded[-1]["reader_id"] == 'cup'
+
+    status = readers.status()
+    assert (status['cup']['reads'], status['cup']['forwarded'], status['cup']['suppressed']) == (4, 3, 1)
+    assert (status['knife']['reads'], status['knife']['forwarded'], status['knife']['suppressed']) == (2, 1, 1)
+
+
+def test_errors_are_counted_and_forwarded():
+    readers = manager()
+    forwarded = []
+    readers._make_handler('knife', forwarded.append)({"event": "error", "message": "unplugged"})
+    assert forwarded == [{"event": "error", "message": "unplugged", "reader_id": "knife"}]
+    assert readers.status()['knife']['errors'] == 1 and readers.status()['knife']['last_error'] == 'unplugged'
+
+
+class SlowClosingSerial(ReplaySerial):
+    """Takes a while to close, like a USB adapter; the engine closes it when scanning stops."""
+    closes = []
+
+    def close(self):
+        time.sleep(0.3)
+        super().close()
+        self.closes.append(threading.current_thread().name)
+
+
+def test_exclusive_waits_for_the_engine_to_release_the_reader():
+    records = synthetic_records([build_tag_notification(EPC)] * 1000, interval=0.005)
+    reader = RFIDReader(port='cup', serial_factory=SlowClosingSerial.factory(records=records, speed=1))
+    readers = ReaderManager({'cup': reader})
+    engine = readers.engines['cup']
+    assert engine.wait_stopped(0.1) # Never started
+
+    got_tag = threading.Event()
+    readers.start(lambda event: got_tag.set() if event["event"] == "tag" else None)
+    assert got_tag.wait(2)
+    assert readers.stop()
+    with readers.exclusive('cup') as held:
+        assert SlowClosingSerial.closes == ['rfid-engine-loop'] # The engine is done with the port
+        assert not held.is_connected
+        assert held.connect()
+        time.sleep(0.1)
+        assert held.is_connected # Nothing from the old run disconnects it
+    assert not reader.is_connected
+    assert readers.status()['cup']['busy'] is False
+
+
+def test_exclusive_refuses_a_running_reader():
+    records = synthetic_records([build_tag_notification(EPC)] * 1000, interval=0.005)
+    readers = ReaderManager({'cup': RFIDReader(port='cup', serial_factory=ReplaySerial.factory(records=records))})
+    readers.start(lambda event: None)
+    try:
+        try:
+            with readers.exclusive('cup'):
+                raise AssertionError("a scanning reader was handed out")
+        except RuntimeError as e:
+            assert 'busy' in str(e)
+    finally:
+        readers.stop()
+        assert readers.engines['cup'].wait_stopped(2)
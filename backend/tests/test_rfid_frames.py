@@ -0,0 +1,53 @@
+# test_rfid_frames.py
+# FrameDecoder: frames split across reads, several frames per read, and resync after noise.
+from rfid_frames import (CMD_SINGLE_INVENTORY, FRAME_HEADER, FRAME_TYPE_RESPONSE, FrameDecoder, build_frame,
+                         build_tag_notification, parse_tag_read)
+
+EPC = bytes.fromhex('E280F3372000F0000FDAE3BA')
+TAG = build_tag_notification(EPC)
+
+
+def test_frame_split_across_reads():
+    decoder = FrameDecoder()
+    for byte in TAG[:-1]:
+        assert decoder.feed(bytes([byte])) == []
+    frames = decoder.feed(TAG[-1:])
+    assert [frame.raw for frame in frames] == [TAG]
+    assert decoder.buffered == 0
+
+
+def test_merged_frames_in_one_read():
+    response = build_frame(FRAME_TYPE_RESPONSE, 0xB7, b'\x07\xD0')
+    frames = FrameDecoder().feed(TAG + response + TAG[:5])
+    assert [frame.raw for frame in frames] == [TAG, response]
+    assert frames[0].is_notification and bytes(frames[1].params) == b'\x07\xD0'
+
+
+def test_tag_notification_fields():
+    tag = parse_tag_read(FrameDecoder().feed(TAG)[0], timestamp=1.0)
+    assert tag.epc == EPC and tag.rssi == 0xC8 and tag.pc == b'\x30\x00'
+
+
+def test_resync_after_noise_and_bad_checksum():
+    decoder = FrameDecoder()
+    corrupt = bytearray(TAG)
+    corrupt[-2] ^= 0xFF
+    frames = decoder.feed(b'\x00\x13' + bytes(corrupt) + b'\x7E\x7E' + TAG)
+    assert [frame.raw for frame in frames] == [TAG]
+    assert decoder.errors["checksum"] == 1
+    assert decoder.errors["garbage_bytes"] > 0
+
+
+def test_false_header_with_bad_type_does_not_hold_back_frames():
+    decoder = FrameDecoder()
+    # 0xBB followed by an impossible frame type and a plausible length (512)
+    frames = decoder.feed(bytes([FRAME_HEADER, 0x55, CMD_SINGLE_INVENTORY, 0x02, 0x00]) + TAG)
+    assert [frame.raw for frame in frames] == [TAG]
+    assert decoder.errors["frame_type"] == 1
+
+
+def test_oversized_length_is_skipped():
+    decoder = FrameDecoder(max_param_len=32)
+    frames = decoder.feed(bytes([FRAME_HEADER, 0x01, 0x22, 0x7F, 0xFF]) + TAG)
+    assert [frame.raw for frame in frames] == [TAG]
+    assert decoder.errors["length"] == 1
@@ -0,0 +1,100 @@
+# test_scan_status_store.py
+# ScanStatusStore: write-behind persistence, per-session TTL and LRU bounds.
+import json
+import os
+import time
+
+import pytest
+
+from scan_status_store import DEFAULT_SESSION, ScanStatusStore
+
+KEYS = ("cup_completed", "knife_completed")
+
+
+@pytest.fixture
+def status_path(tmp_path):
+    return str(tmp_path / "data" / "status.json")
+
+
+def _on_disk(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def test_changes_are_written_behind_and_reloaded(status_path):
+    store = ScanStatusStore(status_path, KEYS, debounce_seconds=0.05)
+    store.mark_completed("cup_completed", "booth-1")
+    store.mark_completed("knife_completed", "booth-1")
+    assert "booth-1" not in _on_disk(status_path) # Not written yet (debounced)
+    time.sleep(0.3)
+    assert _on_disk(status_path)["booth-1"]["all_completed"] is True
+    assert not os.path.exists(status_path + ".tmp")
+
+    reloaded = ScanStatusStore(status_path, KEYS)
+    assert reloaded.get("booth-1") == {"cup_completed": True, "knife_completed": True, "all_completed": True}
+
+
+def test_flush_writes_immediately(status_path):
+    store = ScanStatusStore(status_path, KEYS, debounce_seconds=60)
+    changed, status = store.mark_completed("cup_completed")
+    assert changed and status["cup_completed"] is True
+    assert store.mark_completed("cup_completed")[0] is False
+    store.flush()
+    assert _on_disk(status_path)[DEFAULT_SESSION]["cup_completed"] is True
+
+
+def test_legacy_single_document_file_becomes_the_default_session(status_path):
+    os.makedirs(os.path.dirname(status_path))
+    with open(status_path, "w") as f:
+        json.dump({"cup_completed": True, "knife_completed": False, "all_completed": False}, f)
+    store = ScanStatusStore(status_path, KEYS)
+    assert store.get()["cup_completed"] is True
+    assert set(_on_disk(status_path)) == {DEFAULT_SESSION}
+
+
+def test_corrupt_file_is_reinitialized(status_path):
+    os.makedirs(os.path.dirname(status_path))
+    with open(status_path, "w") as f:
+        f.write("{not json")
+    store = ScanStatusStore(status_path, KEYS)
+    assert store.get() == {"cup_completed": False, "knife_completed": False, "all_completed": False}
+    assert _on_disk(status_path)[DEFAULT_SESSION]["all_completed"] is False
+
+
+def test_get_and_reset_of_unknown_session_store_nothing(status_path):
+    store = ScanStatusStore(status_path, KEYS, max_sessions=4)
+    for index in range(50):
+        assert store.get(f"made-up-{index}")["all_completed"] is False
+        store.reset(f"made-up-{index}")
+    assert store.session_ids() == [DEFAULT_SESSION]
+
+
+def test_expired_session_starts_over(status_path):
+    store = ScanStatusStore(status_path, KEYS, session_ttl=0.05)
+    store.mark_completed("cup_completed", "visitor")
+    store.mark_completed("knife_completed", "visitor")
+    time.sleep(0.1)
+    assert store.get("visitor")["cup_completed"] is False
+    changed, status = store.mark_completed("cup_completed", "visitor")
+    assert changed and status == {"cup_completed": True, "knife_completed": False, "all_completed": False}
+    assert store.get("visitor")["knife_completed"] is False
+
+
+def test_least_recently_used_session_is_evicted(status_path):
+    store = ScanStatusStore(status_path, KEYS, max_sessions=3, max_new_sessions=3)
+    for session_id in ("a", "b", "c", "d"):
+        store.mark_completed("cup_completed", session_id)
+        store.mark_completed("knife_completed", session_id) # Established
+    assert set(store.session_ids()) == {"b", "c", "d"}
+
+
+def test_made_up_sessions_cannot_evict_established_ones(status_path):
+    store = ScanStatusStore(status_path, KEYS, max_sessions=8, max_new_sessions=2)
+    for session_id in ("booth-1", "booth-2"):
+        store.mark_completed("cup_completed", session_id)
+        store.mark_completed("knife_completed", session_id)
+    for index in range(300):
+        store.mark_completed("cup_completed", f"made-up-{index}")
+    ids = store.session_ids()
+    assert {"booth-1", "booth-2"} <= set(ids) and len(ids) <= 8
+    assert store.get("booth-1")["all_completed"] is True
@@ -0,0 +1,124 @@
+# test_serve.py
+# The reader process's hub services as the web workers see them: glove streams and
+# gesture templates shared across workers, and a real web worker per async mode.
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+import numpy as np
+import pytest
+
+import main_server
+import serve
+from gesture_matching import GestureMatcher
+from imu_stream import IMUStreams
+from message_hub import Hub, HubClient, RemoteProxy, default_address, format_address
+
+AUTHKEY = b'test-key'
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GRAVITY = [0.0, 0.0, 9.8, 0.0, 0.0, 0.0]
+
+
+def glove_recording():
+    """Idle, one gesture, idle again: exactly one segment."""
+    t = np.linspace(0, 2 * np.pi, 25)[:, None]
+    motion = np.tile(GRAVITY, (25, 1)) + np.hstack([3 * np.sin(t), 2 * np.cos(t), np.sin(2 * t),
+                                                   2 * np.sin(t), np.cos(t), 0 * t])
+    return np.vstack([np.tile(GRAVITY, (30, 1)), motion, np.tile(GRAVITY, (30, 1))])
+
+
+@pytest.fixture
+def reader_hub(tmp_path, monkeypatch):
+    """A hub serving what the reader process serves, with the templates in a temp file."""
+    matcher = GestureMatcher({'cup': [glove_recording()[30:55]]}, config={'decay': 0.5},
+                             file_path=str(tmp_path / 'gesture_templates.json'))
+    monkeypatch.setattr(main_server, 'gesture_matcher', matcher)
+    monkeypatch.setattr(main_server, 'imu_streams', IMUStreams(matcher))
+    address = str(tmp_path / 'hub.sock') if hasattr(socket, 'AF_UNIX') else default_address(47100)
+    hub = Hub(address, AUTHKEY)
+    hub.start()
+    serve.register_services(hub, main_server)
+    yield hub
+    hub.close()
+
+
+def test_workers_share_glove_streams_and_templates(reader_hub, tmp_path):
+    clients = [HubClient(reader_hub.address, AUTHKEY) for _ in range(2)]
+    streams = [RemoteProxy(client, 'imu_streams') for client in clients]
+    matchers = [RemoteProxy(client, 'gesture_matcher') for client in clients]
+
+    # One glove's batches, alternating between two workers, still form one gesture
+    samples = glove_recording()
+    segments = []
+    for index, offset in enumerate(range(0, len(samples), 5)):
+        segments += streams[index % 2].feed('glove-1', samples[offset:offset + 5], 'cup')['segments']
+    assert len(segments) == 1 and 'matchPercentage' in segments[0]
+    assert streams[1].state('glove-1')['received'] == len(samples)
+    assert streams[0].state('glove-2')['received'] == 0
+    streams[1].reset('glove-1')
+    assert streams[0].state('glove-1')['received'] == 0
+
+    # A template added through one worker is used by the other
+    assert not matchers[1].has_action('knife')
+    result = matchers[0].add_templates('knife', [samples[30:55]])
+    assert result['counts']['knife'] == 1
+    assert matchers[1].has_action('knife')
+    assert matchers[1].template_info()['counts'] == {'cup': 1, 'knife': 1}
+    with open(tmp_path / 'gesture_templates.json', encoding='utf-8') as f:
+        assert len(json.load(f)['templates']['knife']) == 1
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _request(url, body=None, content_type='application/json'):
+    request = urllib.request.Request(url, data=body, headers={'Content-Type': content_type} if body else {})
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.load(response)
+
+
+@pytest.mark.parametrize("mode", ['eventlet', 'gevent', 'threading'])
+def test_web_worker_serves_gestures_through_the_hub(reader_hub, mode):
+    if mode != 'threading':
+        pytest.importorskip(mode)
+    port = _free_port()
+    env = dict(os.environ, SERVER_ROLE='worker', SOCKETIO_ASYNC_MODE=mode,
+               RFID_HUB_ADDRESS=format_address(reader_hub.address), RFID_HUB_AUTHKEY=AUTHKEY.hex())
+    worker = subprocess.Popen([sys.executable, '-c', f'import serve; serve.run_worker("127.0.0.1", {port}, False)'],
+                              cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL)
+    base_url = f'http://127.0.0.1:{port}'
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                info = _request(f'{base_url}/api/gesture/templates')
+                break
+            except (urllib.error.URLError, ConnectionError):
+                assert worker.poll() is None and time.monotonic() < deadline
+                time.sleep(0.2)
+        assert info['counts'] == {'cup': 1}
+
+        samples = glove_recording()
+        segments = []
+        for offset in range(0, len(samples), 10):
+            packed = samples[offset:offset + 10].astype('<f4').tobytes()
+            result = _request(f'{base_url}/api/imu/stream?session_id=glove-1&action=cup', packed,
+                              'application/octet-stream')
+            segments += result['segments']
+        assert len(segments) == 1
+        assert main_server.imu_streams.state('glove-1')['received'] == len(samples) # Fed in the reader process
+
+        body = json.dumps({'action': 'knife', 'samples': samples[30:55].tolist()}).encode()
+        assert _request(f'{base_url}/api/gesture/templates', body)['counts']['knife'] == 1
+        assert main_server.gesture_matcher.has_action('knife')
+    finally:
+        worker.terminate()
+        worker.wait(10)
@@ -0,0 +1,67 @@
+# test_stage_manifest.py
+# Stage membership from frontend/assets/<stage>/ and the Link preload hints.
+import pytest
+
+from static_assets import StaticAssetServer
+from stage_manifest import build_stage_manifest, preload_link_header
+
+
+def write(root, rel_path, size):
+    path = root / rel_path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b'x' * size)
+
+
+@pytest.fixture
+def frontend(tmp_path):
+    write(tmp_path, 'assets/stage3-1/cup_scan.mp3', 10_000)
+    write(tmp_path, 'assets/stage3-1/wife.png', 2_000_000)
+    write(tmp_path, 'assets/stage3/scanning.wav', 300_000) # Shared by stage3-1 ... stage3-4
+    write(tmp_path, 'assets/stage3-2/knife_scan.mp4', 3_000_000)
+    write(tmp_path, 'assets/stage3-2/.DS_Store', 10)
+    return tmp_path
+
+
+def paths(stage_info):
+    return [info['path'] for info in stage_info['assets']]
+
+
+def test_membership_comes_from_stage_directories(frontend):
+    manifest = build_stage_manifest(StaticAssetServer(str(frontend)), 'stage2')
+    assert paths(manifest['next']['stage3-1']) == [ # Smallest first, parent stage dir included
+        'assets/stage3-1/cup_scan.mp3', 'assets/stage3/scanning.wav', 'assets/stage3-1/wife.png']
+    assert paths(manifest['next']['stage3-2']) == ['assets/stage3/scanning.wav', 'assets/stage3-2/knife_scan.mp4']
+    assert paths(manifest['next']['stage3-3']) == ['assets/stage3/scanning.wav']
+    assert manifest['next']['stage3-1']['total_bytes'] == 2_310_000
+
+
+def test_new_files_join_their_stage(frontend):
+    server = StaticAssetServer(str(frontend))
+    build_stage_manifest(server, 'stage2')
+    write(frontend, 'assets/stage3-3/phone_scan.mp3', 5_000)
+    manifest = build_stage_manifest(server, 'stage2')
+    assert paths(manifest['next']['stage3-3'])[0] == 'assets/stage3-3/phone_scan.mp3'
+
+
+def test_link_header_hints_smallest_asset_per_next_stage(frontend):
+    manifest = build_stage_manifest(StaticAssetServer(str(frontend)), 'stage2-intro')
+    links = preload_link_header(manifest).split(', ')
+    # cup_scan.mp3 for stage3-1; stage3-2/3-3/3-4 share scanning.wav, hinted once
+    assert len(links) == 2
+    assert links[0].startswith('</assets/stage3-1/cup_scan.') and links[0].endswith('rel=preload; as=audio')
+    assert links[1].startswith('</assets/stage3/scanning.')
+    assert preload_link_header(manifest, max_bytes=100_000).count('rel=preload') == 1
+
+
+def test_unknown_stage(frontend):
+    server = StaticAssetServer(str(frontend))
+    assert build_stage_manifest(server, 'stage9') is None
+    assert build_stage_manifest(server, '') is None
+
+
+def test_empty_stage_parameter_is_a_bad_request():
+    import main_server
+    client = main_server.app.test_client()
+    assert client.get('/api/preload_manifest?stage=').status_code == 400
+    assert client.get('/api/preload_manifest?stage=nope').status_code == 404
+    assert client.get('/api/preload_manifest?stage=stage0').status_code == 200
@@ -0,0 +1,55 @@
+# test_static_assets.py
+# StaticAssetServer: ETags, hashed URLs, Range requests and HTML rewriting.
+import pytest
+from flask import Flask
+
+from static_assets import StaticAssetServer
+
+VIDEO = bytes(range(256)) * 40
+
+
+@pytest.fixture
+def client(tmp_path):
+    (tmp_path / 'js').mkdir()
+    (tmp_path / 'js' / 'main.js').write_text('console.log("hello");' * 20)
+    (tmp_path / 'clip.mp4').write_bytes(VIDEO)
+    (tmp_path / 'index.html').write_text('<script src="js/main.js"></script>')
+    server = StaticAssetServer(str(tmp_path))
+    app = Flask(__name__)
+    app.add_url_rule('/<path:rel_path>', 'asset', server.send)
+    client = app.test_client()
+    client.server = server
+    return client
+
+
+def test_etag_revalidation(client):
+    response = client.get('/clip.mp4')
+    assert response.status_code == 200 and response.data == VIDEO
+    assert client.get('/clip.mp4', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+
+def test_hashed_url_is_immutable(client):
+    hashed = client.server.manifest()['js/main.js']
+    response = client.get('/' + hashed)
+    assert response.status_code == 200 and 'immutable' in response.headers['Cache-Control']
+    assert 'immutable' not in client.get('/js/main.js').headers['Cache-Control']
+
+
+def test_range_request_on_media(client):
+    response = client.get('/clip.mp4', headers={'Range': 'bytes=100-199'})
+    assert response.status_code == 206 and response.data == VIDEO[100:200]
+
+
+def test_html_is_rewritten_and_ignores_range(client):
+    hashed = client.server.manifest()['js/main.js']
+    full = client.get('/index.html', headers={'Accept-Encoding': 'identity'})
+    assert full.status_code == 200 and hashed.encode() in full.data
+    ranged = client.get('/index.html', headers={'Accept-Encoding': 'identity', 'Range': 'bytes=0-9'})
+    assert ranged.status_code == 200
+    assert ranged.data == full.data and ranged.headers['ETag'] == full.headers['ETag']
+
+
+def test_text_assets_are_compressed(client):
+    response = client.get('/js/main.js', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['ETag'].endswith('-gzip"')
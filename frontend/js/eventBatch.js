@@ -0,0 +1,48 @@
+// eventBatch.js
+// Decodes the binary 'event_batch' messages sent by backend/event_bus.py.
+// Layout (little-endian): header u8 version, u8 reserved, u16 count; then per event
+// u8 kind, u8 EPC length, EPC, 2-byte PC, f32 RSSI, u32 reads, f64 first_seen,
+// f64 last_seen, u8-length-prefixed UTF-8 name and reader id.
+
+const EVENT_NAMES = { 1: 'tag_arrived', 2: 'tag_left', 3: 'rssi_changed' };
+const textDecoder = new TextDecoder();
+
+function toHex(bytes) {
+    return Array.from(bytes, (b) => b.toString(16).padStart(2, '0')).join('').toUpperCase();
+}
+
+export function decodeEventBatch(buffer) {
+    const bytes = buffer instanceof Uint8Array ? buffer : new Uint8Array(buffer);
+    const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+    if (view.getUint8(0) !== 1) {
+        throw new Error(`Unsupported event batch version ${view.getUint8(0)}`);
+    }
+    const count = view.getUint16(2, true);
+    const events = [];
+    let offset = 4;
+    const readText = () => {
+        const length = view.getUint8(offset);
+        const text = textDecoder.decode(bytes.subarray(offset + 1, offset + 1 + length));
+        offset += 1 + length;
+        return text;
+    };
+    for (let i = 0; i < count; i++) {
+        const kind = view.getUint8(offset);
+        const epcLength = view.getUint8(offset + 1);
+        const epc = toHex(bytes.subarray(offset + 2, offset + 2 + epcLength));
+        offset += 2 + epcLength;
+        const pc = toHex(bytes.subarray(offset, offset + 2));
+        const rssi = Math.round(view.getFloat32(offset + 2, true) * 10) / 10;
+        const reads = view.getUint32(offset + 6, true);
+        const firstSeen = view.getFloat64(offset + 10, true);
+        const lastSeen = view.getFloat64(offset + 18, true);
+        offset += 26;
+        const name = readText();
+        const readerId = readText() || null;
+        events.push({
+            event: EVENT_NAMES[kind], status: 'success', epc, pc, rssi, reads,
+            first_seen: firstSeen, last_seen: lastSeen, name, reader_id: readerId,
+        });
+    }
+    return events;
+}
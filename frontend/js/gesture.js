@@ -691,30 +691,30 @@ async function showMatchResultInStage(matchResult) {
 
         if (window.currentStage === 'stage4-1-1') {
             if (matchResult.level && highMatchLevels.includes(matchResult.level)) {
-                videoSrc = 'assets/videos/cup_high.mp4';
+                videoSrc = 'assets/stage4-1/cup_high.mp4';
             } else {
-                videoSrc = 'assets/videos/cup_low.mp4';
+                videoSrc = 'assets/stage4-1/cup_low.mp4';
             }
             console.log(`Stage 4-1-1 (Cup): Match level '${matchResult.level}', determined video: ${videoSrc}`);
         } else if (window.currentStage === 'stage4-2-1') {
             if (matchResult.level && highMatchLevels.includes(matchResult.level)) {
-                videoSrc = 'assets/videos/knife_high.mp4';
+                videoSrc = 'assets/stage4-2/knife_high.mp4';
             } else {
-                videoSrc = 'assets/videos/knife_low.mp4';
+                videoSrc = 'assets/stage4-2/knife_low.mp4';
             }
             console.log(`Stage 4-2-1 (Knife): Match level '${matchResult.level}', determined video: ${videoSrc}`);
         } else if (window.currentStage === 'stage4-3-1') {
             if (matchResult.level && highMatchLevels.includes(matchResult.level)) {
-                videoSrc = 'assets/videos/phone_high.mp4';
+                videoSrc = 'assets/stage4-3/phone_high.mp4';
             } else {
-                videoSrc = 'assets/videos/phone_low.mp4';
+                videoSrc = 'assets/stage4-3/phone_low.mp4';
             }
             console.log(`Stage 4-3-1 (Phone): Match level '${matchResult.level}', determined video: ${videoSrc}`);
         } else if (window.currentStage === 'stage4-4-1') {
             if (matchResult.level && highMatchLevels.includes(matchResult.level)) {
-                videoSrc = 'assets/videos/camera_high.mp4';
+                videoSrc = 'assets/stage4-4/camera_high.mp4';
             } else {
-                videoSrc = 'assets/videos/camera_low.mp4';
+                videoSrc = 'assets/stage4-4/camera_low.mp4';
             }
             console.log(`Stage 4-4-1 (Camera/Monitor): Match level '${matchResult.level}', determined video: ${videoSrc}`);
         }
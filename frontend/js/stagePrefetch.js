@@ -0,0 +1,35 @@
+// stagePrefetch.js
+// Prefetches the media of the stages that can come after the current one, using
+// backend /api/preload_manifest?stage=<currentStage>. The server's Link header only
+// preloads the smallest asset of each next stage; the rest is requested here as
+// <link rel=prefetch>, which the browser fetches at idle priority so the current
+// stage's video/audio is not slowed down.
+// The page loads media by plain path ('assets/stage3-1/cup_scan.mp3'), so that is what
+// gets prefetched; the hashed URLs in the manifest are for HTML-referenced assets.
+
+const prefetched = new Set(); // Paths already handed to the browser
+let lastStage = null;
+
+export async function prefetchNextStages(stage) {
+    if (!stage || stage === lastStage) return;
+    lastStage = stage;
+    let manifest;
+    try {
+        const response = await fetch(`/api/preload_manifest?stage=${encodeURIComponent(stage)}`);
+        if (!response.ok) return; // Unknown stage: nothing to prefetch
+        manifest = await response.json();
+    } catch (error) {
+        console.warn('Stage prefetch: manifest request failed', error);
+        return;
+    }
+    for (const stageInfo of Object.values(manifest.next)) {
+        for (const asset of stageInfo.assets) {
+            if (prefetched.has(asset.path)) continue;
+            prefetched.add(asset.path);
+            const link = document.createElement('link');
+            link.rel = 'prefetch';
+            link.href = '/' + asset.path;
+            document.head.appendChild(link);
+        }
+    }
+}